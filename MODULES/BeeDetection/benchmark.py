@@ -0,0 +1,150 @@
+ #THIS FILE BENCHMARKS THE BEE DETECTION MODEL ON THIS MACHINE'S CPU. FOR EVERY BACKEND
+ #(pt, onnx, openvino, ... SEE detector.BACKENDS) AND THREAD COUNT IT RUNS count MODE
+ #OVER THE GIVEN IMAGES AND REPORTS IMAGES/S AND p50/p95/p99 LATENCY PER MODEL CALL. i.e
+ #   python benchmark.py --images /var/www/html/ademnea_website/public/hiveimage/2 --threads 1,2,4
+ #EACH COMBINATION RUNS IN ITS OWN PROCESS, PINNED TO THAT MANY CPU CORES, SO ONE
+ #RUNTIME'S THREAD POOLS DO NOT LEAK INTO THE NEXT MEASUREMENT.
+ #BACKENDS THAT ARE NOT EXPORTED YET ARE EXPORTED FIRST WITH --export.
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import detector
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png")
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def image_files(paths, limit):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in sorted(names) if name.lower().endswith(IMAGE_EXTENSIONS))
+        else:
+            files.append(path)
+    return files[:limit]
+
+
+#RUNS IN THE CHILD PROCESS: ONE BACKEND, ONE THREAD COUNT
+def measure(args):
+    cores = sorted(os.sched_getaffinity(0))[:args.threads] if hasattr(os, "sched_setaffinity") else None
+    if cores:
+        os.sched_setaffinity(0, cores)
+    detector.set_threads(args.threads)
+    try:
+        model = detector.load_model(args.backend, args.model, fallback=False)
+    except Exception as e:
+        return {"backend": args.backend, "threads": args.threads, "error": str(e)}
+
+    images = [image for image in map(detector.read_image, image_files(args.images, args.limit)) if image is not None]
+    if not images:
+        return {"backend": args.backend, "threads": args.threads, "error": "no readable images"}
+    batches = [images[i:i + args.batch] for i in range(0, len(images), args.batch)]
+    for batch in batches[:args.warmup]:
+        detector.count(model, batch)
+
+    latencies, bees, done = [], 0, 0
+    started = time.perf_counter()
+    for _ in range(args.repeat):
+        for batch in batches:
+            call = time.perf_counter()
+            bees += sum(detector.count(model, batch))
+            latencies.append(time.perf_counter() - call)
+            done += len(batch)
+    seconds = time.perf_counter() - started
+    return {
+        "backend": args.backend,
+        "threads": args.threads,
+        "images": done,
+        "batch": args.batch,
+        "seconds": seconds,
+        "images_per_s": done / seconds if seconds else 0.0,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "bees_per_image": bees / done if done else 0.0,
+    }
+
+
+def run(backend, threads, args):
+    command = [sys.executable, os.path.abspath(__file__), "--child", "--backends", backend, "--threads", str(threads),
+               "--model", args.model, "--batch", str(args.batch), "--warmup", str(args.warmup),
+               "--repeat", str(args.repeat), "--limit", str(args.limit), "--images", *args.images]
+    env = dict(os.environ, OMP_NUM_THREADS=str(threads), OPENBLAS_NUM_THREADS=str(threads), MKL_NUM_THREADS=str(threads))
+    if args.tile_size is not None:
+        env["BEE_TILE_SIZE"] = str(args.tile_size)
+    done = subprocess.run(command, env=env, stdout=subprocess.PIPE, stderr=None if args.verbose else subprocess.DEVNULL,
+                          text=True)
+    lines = done.stdout.strip().splitlines()
+    if done.returncode != 0 or not lines:
+        return {"backend": backend, "threads": threads, "error": f"exited with {done.returncode}"}
+    return json.loads(lines[-1])
+
+
+def report(results):
+    header = f"{'backend':<15}{'threads':>8}{'images':>8}{'seconds':>9}{'images/s':>10}" \
+             f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'bees/img':>10}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        if "error" in r:
+            print(f"{r['backend']:<15}{r['threads']:>8}  not run: {r['error']}")
+            continue
+        print(f"{r['backend']:<15}{r['threads']:>8}{r['images']:>8}{r['seconds']:>9.2f}{r['images_per_s']:>10.2f}"
+              f"{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}{r['bees_per_image']:>10.1f}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="CPU benchmark of the bee detection model per backend and thread count")
+    parser.add_argument("--images", nargs="+", default=[os.path.join(os.path.dirname(os.path.abspath(__file__)), "test3.jpeg")],
+                        help="image files or folders")
+    parser.add_argument("--limit", type=int, default=64, help="most images read")
+    parser.add_argument("--backends", default="pt,onnx,openvino")
+    parser.add_argument("--threads", default=f"1,{os.cpu_count() or 1}", help="comma separated thread counts")
+    parser.add_argument("--model", default=detector.MODEL_PATH)
+    parser.add_argument("--batch", type=int, default=1, help="images per model call")
+    parser.add_argument("--tile-size", type=int, help="run tiled count mode with this tile size, 0 for whole images")
+    parser.add_argument("--warmup", type=int, default=2, help="batches run before timing")
+    parser.add_argument("--repeat", type=int, default=5, help="passes over the images")
+    parser.add_argument("--export", action="store_true", help="export missing backends first")
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the model's own output")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+    args.backends = [b for b in args.backends.split(",") if b]
+    for backend in args.backends:
+        if backend not in detector.BACKENDS:
+            parser.error(f"unknown backend {backend}, choose from {', '.join(detector.BACKENDS)}")
+    args.threads = [int(t) for t in str(args.threads).split(",") if t]
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.child:
+        args.backend, args.threads = args.backends[0], args.threads[0]
+        print(json.dumps(measure(args)))
+        return
+    if args.export:
+        for backend in args.backends:
+            if not os.path.exists(detector.exported_path(backend, args.model)):
+                print(f"Exporting {backend}")
+                detector.export_model(backend, args.model)
+    results = [run(backend, threads, args) for backend in args.backends for threads in args.threads]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+
+if __name__ == "__main__":
+    main()
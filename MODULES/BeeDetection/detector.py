@@ -0,0 +1,252 @@
+ #THIS FILE LOADS THE BEE DETECTION MODEL AND RUNS IT ON HIVE IMAGES. TWO MODES:
+ #  count: ONE FORWARD PASS OVER A BATCH OF INDEPENDENT IMAGES, RETURNS BEES PER IMAGE
+ #  track: ONE FRAME AT A TIME OF A VIDEO, KEEPS TRACK IDS FROM FRAME TO FRAME
+ #WITH BEE_TILE_SIZE SET, count CUTS LARGE IMAGES INTO OVERLAPPING TILES THE MODEL SEES
+ #AT FULL RESOLUTION, RUNS THEM IN BATCHES AND MERGES THE BOXES OF ALL TILES.
+ #THE MODEL CAN BE EXPORTED TO ONNX OR OPENVINO (OPTIONALLY int8) FOR FASTER CPU
+ #INFERENCE: python detector.py --export openvino_int8. load_model() FALLS BACK TO THE
+ #.pt MODEL WHEN THE EXPORT OR ITS RUNTIME IS NOT THERE.
+ #NEEDS: pip install ultralytics (IT BRINGS opencv-python), PLUS onnxruntime OR openvino
+import os
+import sys
+import hashlib
+import argparse
+import traceback
+import cv2
+import numpy as np
+
+MODEL_PATH = os.getenv("BEE_MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bee_detection_model.pt"))
+
+#pt, onnx, onnx_int8, openvino OR openvino_int8
+BACKEND = os.getenv("BEE_BACKEND", "pt")
+BACKENDS = ("pt", "onnx", "onnx_int8", "openvino", "openvino_int8")
+
+#MINIMUM CONFIDENCE OF A BOX THAT COUNTS AS A BEE, INPUT SIZE OF EXPORTED MODELS
+CONFIDENCE = float(os.getenv("BEE_CONFIDENCE", "0.25"))
+IMAGE_SIZE = int(os.getenv("BEE_IMAGE_SIZE", "640"))
+
+#TILED count MODE: TILE SIDE IN PIXELS (0 TURNS IT OFF, BEST EQUAL TO BEE_IMAGE_SIZE), SHARE OF A TILE OVERLAPPING ITS
+#NEIGHBOUR, TILES PER MODEL CALL, AND HOW MUCH OF THE SMALLER OF TWO BOXES MUST BE COVERED
+#BY THE OTHER FOR THEM TO BE THE SAME BEE (A BEE CUT BY A TILE EDGE GIVES A PARTIAL BOX)
+TILE_SIZE = int(os.getenv("BEE_TILE_SIZE", "0"))
+TILE_OVERLAP = float(os.getenv("BEE_TILE_OVERLAP", "0.2"))
+TILE_BATCH = int(os.getenv("BEE_TILE_BATCH", "8"))
+MERGE_THRESHOLD = float(os.getenv("BEE_MERGE_THRESHOLD", "0.6"))
+
+#CPU THREADS FOR PYTORCH, 0 LEAVES THE DEFAULT (ALL CORES)
+THREADS = int(os.getenv("BEE_THREADS", "0"))
+
+#TRACKER CONFIG OF ultralytics USED IN track MODE
+TRACKER = os.getenv("BEE_TRACKER", "bytetrack.yaml")
+
+#DATASET YAML USED TO CALIBRATE THE openvino_int8 EXPORT
+CALIBRATION_DATA = os.getenv("BEE_CALIBRATION_DATA", "")
+
+
+#WHERE THE EXPORT OF EACH BACKEND LIVES, NEXT TO THE .pt (THE NAMES ultralytics GIVES THEM)
+def exported_path(backend, pt_path=MODEL_PATH):
+    stem = os.path.splitext(pt_path)[0]
+    return {
+        "pt": pt_path,
+        "onnx": stem + ".onnx",
+        "onnx_int8": stem + "_int8.onnx",
+        "openvino": stem + "_openvino_model",
+        "openvino_int8": stem + "_int8_openvino_model",
+    }[backend]
+
+
+def set_threads(threads):
+    if threads <= 0:
+        return
+    try:
+        import torch
+        torch.set_num_threads(threads)
+    except ImportError:
+        pass
+
+
+#BACKEND PLUS A HASH OF THE WEIGHTS, CHANGES WHENEVER THE MODEL FILE IS REPLACED
+def model_version(backend, pt_path=MODEL_PATH):
+    digest = hashlib.blake2b(digest_size=8)
+    with open(pt_path, "rb") as file_obj:
+        for chunk in iter(lambda: file_obj.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return f"{backend}-{digest.hexdigest()}"
+
+
+#THE MODEL OF backend, OR THE .pt MODEL IF THAT CANNOT BE LOADED AND fallback IS SET
+#THE BACKEND ACTUALLY USED IS LEFT IN model.bee_backend, ITS model_version() IN model.bee_version
+def load_model(backend=BACKEND, pt_path=MODEL_PATH, fallback=True):
+    from ultralytics import YOLO
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend}, choose from {', '.join(BACKENDS)}")
+    set_threads(THREADS)
+    if backend != "pt":
+        path = exported_path(backend, pt_path)
+        try:
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"{path} not found, export it with: python detector.py --export {backend}")
+            model = YOLO(path, task="detect")
+            #ONNX AND OPENVINO MODELS ARE ONLY OPENED ON THE FIRST CALL, FAIL HERE INSTEAD
+            model.predict(np.zeros((IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8), imgsz=IMAGE_SIZE, device="cpu", verbose=False)
+            model.bee_backend = backend
+            model.bee_version = model_version(backend, pt_path)
+            return model
+        except Exception as e:
+            if not fallback:
+                raise
+            print(f"Cannot use the {backend} model ({e}), using {pt_path}")
+    model = YOLO(pt_path)
+    model.bee_backend = "pt"
+    model.bee_version = model_version("pt", pt_path)
+    return model
+
+
+#WRITES THE EXPORT OF backend NEXT TO THE .pt MODEL AND RETURNS ITS PATH
+def export_model(backend, pt_path=MODEL_PATH, image_size=IMAGE_SIZE, calibration_data=CALIBRATION_DATA):
+    from ultralytics import YOLO
+    if backend == "pt":
+        return pt_path
+    if backend == "onnx_int8":
+        #DYNAMIC QUANTIZATION: int8 WEIGHTS, NO CALIBRATION DATA NEEDED
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        onnx_path = exported_path("onnx", pt_path)
+        if not os.path.exists(onnx_path):
+            export_model("onnx", pt_path, image_size)
+        quantize_dynamic(onnx_path, exported_path("onnx_int8", pt_path), weight_type=QuantType.QUInt8)
+        return exported_path("onnx_int8", pt_path)
+    model = YOLO(pt_path)
+    if backend == "onnx":
+        #dynamic LETS ONE EXPORT TAKE ANY BATCH SIZE
+        return model.export(format="onnx", imgsz=image_size, dynamic=True, simplify=True)
+    options = {"int8": True, "data": calibration_data} if backend == "openvino_int8" else {}
+    if backend == "openvino_int8" and not calibration_data:
+        raise ValueError("openvino_int8 needs calibration images, set BEE_CALIBRATION_DATA to a dataset yaml")
+    return model.export(format="openvino", imgsz=image_size, dynamic=True, **options)
+
+
+#BGR ARRAY AS THE MODEL TAKES IT, None IF THE FILE IS MISSING OR NOT AN IMAGE
+def read_image(path):
+    return cv2.imread(path)
+
+
+#THE SAME FROM THE BYTES OF AN IMAGE FILE ALREADY READ
+def decode_image(data):
+    if not data:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def _boxes(result):
+    return (result.boxes.xyxy.cpu().numpy().astype(np.float32),
+            result.boxes.conf.cpu().numpy().astype(np.float32))
+
+
+#ONE MODEL CALL PER batch IMAGES
+def _predict(model, images, confidence, batch):
+    results = []
+    for start in range(0, len(images), batch):
+        results.extend(model.predict(images[start:start + batch], conf=confidence, imgsz=IMAGE_SIZE,
+                                     device="cpu", verbose=False))
+    return results
+
+
+#TOP-LEFT CORNERS OF THE TILES COVERING A length PIXEL SIDE, THE LAST ONE FLUSH WITH THE EDGE
+def _starts(length, tile, stride):
+    if length <= tile:
+        return [0]
+    starts = list(range(0, length - tile, stride))
+    return starts + [length - tile]
+
+
+def tiles(height, width, tile=TILE_SIZE, overlap=TILE_OVERLAP):
+    stride = max(1, int(tile * (1 - overlap)))
+    return [(x, y) for y in _starts(height, tile, stride) for x in _starts(width, tile, stride)]
+
+
+#GREEDY NON-MAXIMUM SUPPRESSION OVER ALL TILES OF AN IMAGE, KEEPS THE MOST CONFIDENT OF
+#OVERLAPPING BOXES. OVERLAP IS INTERSECTION OVER THE SMALLER BOX, NOT OVER THE UNION, SO THE
+#HALF OF A BEE SEEN AT A TILE EDGE IS DROPPED IN FAVOUR OF THE WHOLE BEE IN THE NEXT TILE
+def merge(boxes, scores, threshold=MERGE_THRESHOLD):
+    if len(boxes) == 0:
+        return boxes, scores
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = np.argsort(-scores)
+    keep = []
+    while len(order):
+        best, rest = order[0], order[1:]
+        keep.append(best)
+        width = np.clip(np.minimum(boxes[best, 2], boxes[rest, 2]) - np.maximum(boxes[best, 0], boxes[rest, 0]), 0, None)
+        height = np.clip(np.minimum(boxes[best, 3], boxes[rest, 3]) - np.maximum(boxes[best, 1], boxes[rest, 1]), 0, None)
+        smaller = np.maximum(np.minimum(areas[best], areas[rest]), 1e-6)
+        order = rest[width * height / smaller <= threshold]
+    keep = np.array(keep)
+    return boxes[keep], scores[keep]
+
+
+#TILES OF ALL images GO THROUGH THE MODEL TOGETHER, tile_batch PER CALL
+def detect_tiled(model, images, confidence=CONFIDENCE, tile=TILE_SIZE, overlap=TILE_OVERLAP,
+                 tile_batch=TILE_BATCH, threshold=MERGE_THRESHOLD):
+    crops, owners = [], []
+    for i, image in enumerate(images):
+        for x, y in tiles(image.shape[0], image.shape[1], tile, overlap):
+            crops.append(image[y:y + tile, x:x + tile])
+            owners.append((i, x, y))
+    found = [([], []) for _ in images]
+    for (i, x, y), result in zip(owners, _predict(model, crops, confidence, tile_batch)):
+        boxes, scores = _boxes(result)
+        found[i][0].append(boxes + np.array([x, y, x, y], dtype=np.float32))
+        found[i][1].append(scores)
+    return [merge(np.concatenate(boxes), np.concatenate(scores), threshold) for boxes, scores in found]
+
+
+#(xyxy boxes, confidences) PER IMAGE, TILED WHEN TILE_SIZE IS SET AND THE IMAGE IS LARGER THAN A TILE
+def detect(model, images, confidence=CONFIDENCE, tile=TILE_SIZE):
+    if tile > 0 and any(max(image.shape[:2]) > tile for image in images):
+        return detect_tiled(model, images, confidence, tile)
+    return [_boxes(result) for result in _predict(model, images, confidence, max(1, len(images)))]
+
+
+#count MODE: NUMBER OF BEES IN EACH IMAGE, ONE FORWARD PASS FOR THE WHOLE LIST (OR ITS TILES)
+def count(model, images, confidence=CONFIDENCE):
+    return [len(boxes) for boxes, _ in detect(model, images, confidence)]
+
+
+#FORGETS THE TRACKS OF THE PREVIOUS SEQUENCE, THE TRACKERS ARE KEPT
+def reset_tracks(model):
+    for tracker in getattr(getattr(model, "predictor", None), "trackers", None) or ():
+        tracker.reset()
+
+
+#track MODE: ONE FRAME OF A SEQUENCE, new_sequence STARTS FRESH TRACKS (FIRST FRAME OF A VIDEO)
+#RETURNS (track ids, xyxy boxes) AS NUMPY ARRAYS, ID -1 FOR A BOX THE TRACKER HAS NOT CONFIRMED
+#ALWAYS persist=True: ultralytics REGISTERS ITS TRACKER CALLBACK ON THE FIRST CALL ONLY, AND
+#REGISTERED WITH persist=False IT WOULD MAKE NEW TRACKERS (AND IDS) ON EVERY FRAME
+def track(model, frame, new_sequence=False, confidence=CONFIDENCE, tracker=TRACKER):
+    if new_sequence:
+        reset_tracks(model)
+    result = model.track(frame, persist=True, conf=confidence, tracker=tracker,
+                         imgsz=IMAGE_SIZE, device="cpu", verbose=False)[0]
+    boxes = result.boxes.xyxy.cpu().numpy()
+    if result.boxes.id is None:
+        return np.full(len(boxes), -1), boxes
+    return result.boxes.id.cpu().numpy().astype(int), boxes
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export the bee detection model for faster CPU inference")
+    parser.add_argument("--export", choices=BACKENDS[1:], action="append", required=True)
+    parser.add_argument("--model", default=MODEL_PATH)
+    parser.add_argument("--image-size", type=int, default=IMAGE_SIZE)
+    parser.add_argument("--data", default=CALIBRATION_DATA, help="dataset yaml to calibrate openvino_int8")
+    args = parser.parse_args(argv)
+    for backend in args.export:
+        print(f"Exported {backend}: {export_model(backend, args.model, args.image_size, args.data)}")
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
@@ -1,25 +1,15 @@
-from ultralytics import YOLO
-import supervision as sv
-import cv2
+import sys
+import detector
 
-model = YOLO('bee_detection_model.pt')
+#COUNTS THE BEES IN ONE IMAGE, i.e python main.py 2_2024-06-17_122920.jpg
+#count MODE IS A SINGLE FORWARD PASS, track MODE IS ONLY FOR FRAMES OF A VIDEO
+model = detector.load_model()
 
-# Read the image
-image = cv2.imread('2_2024-06-17_122920.jpg')
-
-# Remove or comment out the resizing step
-# resized_image = cv2.resize(image, (640, 640))
-
-# Pass the original image to the model
-result = model(image)[0]
-
-# If tracker is enabled
-result = model.track(image)[0]
-
-detections = sv.Detections.from_ultralytics(result)
+# Read the image, not resized: the model scales it to its own input size
+image = detector.read_image(sys.argv[1] if len(sys.argv) > 1 else '2_2024-06-17_122920.jpg')
 
 # Extract the number of detected bees
-num_bees = len(detections)
+num_bees = detector.count(model, [image])[0]
 
 # Print the count of detected bees
-print(f"Number of detected bees: {num_bees}")
\ No newline at end of file
+print(f"Number of detected bees: {num_bees}")
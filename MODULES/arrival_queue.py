@@ -0,0 +1,115 @@
+ #THIS FILE HOLDS THE QUEUE THAT SITS BETWEEN THE FILE SYSTEM WATCHER
+ #AND THE REGISTER_* HANDLERS. EVERY ARRIVING PATH IS RECORDED ONCE AND
+ #ONLY HANDED OVER WHEN THE PI HAS FINISHED WRITING IT.
+import os
+import time
+import threading
+import traceback
+
+
+class ArrivalQueue:
+    """Debounce file system events into exactly one hand-over per file.
+
+    A path is ready once its size and mtime have not changed for
+    `settle_seconds`, or straight away on the next poll after a close-write
+    event if the file has not changed since.
+    """
+
+    def __init__(self, handle, settle_seconds=3.0, poll_interval=0.5, prune_interval=30.0):
+        self.handle = handle
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.prune_interval = prune_interval
+        self._pending = {}  # path -> [size, mtime, stable_since]
+        self._in_flight = set()
+        self._handled = {}  # path -> (size, mtime) of files left behind after hand-over
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="arrival-queue", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._thread.join()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def add(self, path, closed=False):
+        now = time.monotonic()
+        with self._lock:
+            if path in self._in_flight:
+                return
+            entry = self._pending.get(path)
+            if entry is None:
+                self._pending[path] = [None, None, now]
+                entry = self._pending[path]
+            if closed:
+                #CLOSE-WRITE: THE WRITER IS DONE, NO NEED TO WAIT OUT THE SETTLE TIME
+                entry[2] = now - self.settle_seconds
+
+    def forget(self, path):
+        #HAND path OVER AGAIN EVEN IF IT IS UNCHANGED, i.e AFTER ANOTHER WATCHER LEFT IT BEHIND
+        #OR AFTER ITS HANDLER FAILED
+        with self._lock:
+            self._handled.pop(path, None)
+
+    def add_existing(self, folder):
+        #FILES THAT ARRIVED WHILE THE WATCHER WAS DOWN
+        for filename in sorted(os.listdir(folder)):
+            path = os.path.join(folder, filename)
+            if os.path.isfile(path):
+                self.add(path)
+
+    def _ready_paths(self):
+        now = time.monotonic()
+        ready = []
+        with self._lock:
+            for path, entry in list(self._pending.items()):
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    #MOVED AWAY OR DELETED BEFORE IT SETTLED
+                    del self._pending[path]
+                    continue
+                if entry[0] != st.st_size or entry[1] != st.st_mtime_ns:
+                    if entry[0] is not None:
+                        entry[2] = now
+                    entry[0], entry[1] = st.st_size, st.st_mtime_ns
+                if now - entry[2] >= self.settle_seconds:
+                    del self._pending[path]
+                    if self._handled.get(path) == (st.st_size, st.st_mtime_ns):
+                        #LATE EVENT FOR A FILE ALREADY HANDED OVER
+                        continue
+                    #RECORDED BEFORE THE HAND-OVER, SO A forget() FROM A FAILED HANDLER ALWAYS COMES AFTER IT
+                    self._handled[path] = (st.st_size, st.st_mtime_ns)
+                    self._in_flight.add(path)
+                    ready.append(path)
+        return ready
+
+    def _prune_handled(self):
+        #FORGET HANDED-OVER FILES THAT HAVE SINCE BEEN MOVED OR DELETED
+        with self._lock:
+            for path in list(self._handled):
+                if not os.path.exists(path):
+                    del self._handled[path]
+
+    def _run(self):
+        last_prune = time.monotonic()
+        while not self._stopping.is_set():
+            for path in self._ready_paths():
+                try:
+                    self.handle(path)
+                except Exception:
+                    traceback.print_exc()
+                    self.forget(path)
+                finally:
+                    with self._lock:
+                        self._in_flight.discard(path)
+            if time.monotonic() - last_prune >= self.prune_interval:
+                self._prune_handled()
+                last_prune = time.monotonic()
+            self._stopping.wait(self.poll_interval)
@@ -0,0 +1,199 @@
+ #THIS FILE RUNS THE MEDIA WATCHER AS A SINGLE ASYNCIO SERVICE, AN ALTERNATIVE
+ #TO THE ARRIVAL QUEUE + PER-KIND WORKER POOLS IN register_media.py.
+ #FILE SYSTEM EVENTS GO INTO AN ASYNC QUEUE, UPLOADS SETTLE AS TASKS INSTEAD OF
+ #POLLED ENTRIES, AND EVERY SETTLED FILE GOES THROUGH THE SAME
+ #register_media.dispatch() AS THE THREADED WATCHER, ON ONE SHARED EXECUTOR.
+ #START IT WITH: python async_ingest.py
+import os
+import time
+import signal
+import asyncio
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from watchdog.observers import Observer
+import register_media
+import ingest_metrics
+import media_batcher
+
+
+class _EventBridge:
+    #GIVES register_media.Handler THE add() IT EXPECTS, HOPPING FROM THE OBSERVER THREAD ONTO THE LOOP
+    def __init__(self, loop, service):
+        self.loop = loop
+        self.service = service
+
+    def add(self, path, closed=False):
+        self.loop.call_soon_threadsafe(self.service.add, path, closed)
+
+
+class AsyncIngestService:
+    """Ingest arriving files with bounded concurrency on one event loop.
+
+    Settled files are handed to register_media.dispatch() on a pool of
+    `workers` threads. Only the oldest waiting file of each (kind, hive)
+    lane is offered to a worker, so files of one kind from one hive are
+    still handled in arrival order while other hives go ahead. A media
+    file whose row waits for its batched insert holds no thread; its
+    move is a separate executor call once the row is committed.
+    """
+
+    def __init__(self, folder, settle_seconds=3.0, poll_interval=0.5, workers=16):
+        self.folder = folder
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="async-ingest")
+        self._settling = {}  # path -> {"closed": bool}
+        self._in_flight = set()
+        self._lanes = {}     # (kind, hive_id) -> deque of paths waiting behind the one running
+        self._finishing = set()  # tasks running the later steps of files
+        self._queue = None
+        self._stopping = None
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._pool, func, *args)
+
+    def add(self, path, closed=False):
+        state = self._settling.get(path)
+        if state is not None:
+            state["closed"] = state["closed"] or closed
+            return
+        if path in self._in_flight:
+            return
+        self._settling[path] = {"closed": closed}
+        asyncio.get_running_loop().create_task(self._settle(path))
+
+    async def _settle(self, path):
+        #SAME RULE AS ArrivalQueue: SIZE AND MTIME UNCHANGED FOR settle_seconds, OR A CLOSE-WRITE
+        state = self._settling[path]
+        last = None
+        stable_since = time.monotonic()
+        try:
+            while True:
+                try:
+                    st = os.stat(path)
+                except FileNotFoundError:
+                    return
+                now = time.monotonic()
+                if state["closed"]:
+                    state["closed"] = False
+                    stable_since = min(stable_since, now - self.settle_seconds)
+                signature = (st.st_size, st.st_mtime_ns)
+                if last is not None and signature != last:
+                    stable_since = now
+                last = signature
+                if now - stable_since >= self.settle_seconds:
+                    break
+                await asyncio.sleep(self.poll_interval)
+        finally:
+            del self._settling[path]
+        self._ready(path)
+
+    def _ready(self, path):
+        #SAME AS IngestDispatcher: ONLY THE HEAD OF A (kind, hive_id) LANE IS QUEUED FOR A WORKER,
+        #THE REST WAIT IN THE LANE SO A BURST FROM ONE HIVE DOES NOT TIE UP EVERY WORKER
+        self._in_flight.add(path)
+        lane = register_media.classify_path(path)
+        waiting = self._lanes.get(lane)
+        if waiting is not None:
+            waiting.append(path)
+            return
+        self._lanes[lane] = deque()
+        self._queue.put_nowait((lane, path))
+
+    def _next_in_lane(self, lane):
+        waiting = self._lanes[lane]
+        if waiting:
+            self._queue.put_nowait((lane, waiting.popleft()))
+        else:
+            del self._lanes[lane]
+
+    async def _finish(self, path, step):
+        #LATER STEPS OF A FILE, i.e THE MOVE ONCE ITS BATCHED ROW IS COMMITTED. NO THREAD
+        #WAITS FOR THE COMMIT, EACH STEP GOES TO THE EXECUTOR ONCE ITS FUTURE IS DONE
+        try:
+            while step is not None:
+                try:
+                    await asyncio.wrap_future(step.future)
+                except Exception:
+                    pass  # then() RAISES IT AGAIN, WITH THE FILE'S BOOKKEEPING
+                step = await self._run(step.then, step.future)
+        except Exception:
+            traceback.print_exc()
+        finally:
+            self._in_flight.discard(path)
+
+    async def _worker(self):
+        while True:
+            lane, path = await self._queue.get()
+            step = None
+            try:
+                step = await self._run(register_media.dispatch_path, path)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                #THE LANE MOVES ON ONCE THE ROW IS QUEUED, ROWS STILL REACH THE BATCHER IN ARRIVAL ORDER
+                self._next_in_lane(lane)
+                self._queue.task_done()
+            if step is None:
+                self._in_flight.discard(path)
+                continue
+            task = asyncio.get_running_loop().create_task(self._finish(path, step))
+            self._finishing.add(task)
+            task.add_done_callback(self._finishing.discard)
+
+    def stop(self):
+        self._stopping.set()
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        self._queue = asyncio.Queue()
+        self._stopping = asyncio.Event()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+        ingest_metrics.gauge("ingest_arrival_pending", "Files waiting for their upload to settle", lambda: len(self._settling))
+        ingest_metrics.gauge("ingest_dispatch_pending", "Files queued or being ingested", lambda: len(self._in_flight))
+        ingest_metrics.gauge("ingest_batch_pending", "Media rows waiting for the next batched insert", media_batcher.pending)
+
+        await self._run(register_media.recover_journal)
+
+        observer = Observer()
+        observer.schedule(register_media.Handler(_EventBridge(loop, self)), self.folder, recursive=False)
+        observer.start()
+
+        #BACKLOG: FILES OLDER THAN THE SETTLE TIME ARE TREATED AS COMPLETE STRAIGHT AWAY
+        cutoff = time.time() - self.settle_seconds
+        for filename in sorted(os.listdir(self.folder)):
+            path = os.path.join(self.folder, filename)
+            if os.path.isfile(path):
+                self.add(path, closed=os.path.getmtime(path) < cutoff)
+
+        #ONE TASK PER THREAD, FILES BEYOND THAT WAIT IN THE QUEUE RATHER THAN ON THE EXECUTOR
+        tasks = [loop.create_task(self._worker()) for _ in range(self.workers)]
+        print("LISTENING STARTED (asyncio)")
+        try:
+            await self._stopping.wait()
+        finally:
+            observer.stop()
+            observer.join()
+            print("DRAINING PENDING FILES")
+            await self._queue.join()
+            await asyncio.gather(*self._finishing)
+            for task in tasks:
+                task.cancel()
+            self._pool.shutdown(wait=True)
+
+
+def main(folder=register_media.folder_to_track, settle_seconds=register_media.settle_seconds):
+    service = AsyncIngestService(
+        folder,
+        settle_seconds=settle_seconds,
+        workers=int(os.getenv("ASYNC_INGEST_WORKERS", "16")),
+    )
+    ingest_metrics.serve_from_env()
+    asyncio.run(service.run())
+
+
+if __name__ == "__main__":
+    main()
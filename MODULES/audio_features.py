@@ -0,0 +1,141 @@
+ #THIS FILE EXTRACTS FEATURES FROM A HIVE .wav WHILE IT IS INGESTED, READING IT IN
+ #CHUNKS SO MEMORY STAYS BOUNDED WHATEVER THE RECORDING LENGTH. PER FRAME IT KEEPS AN
+ #AMPLITUDE ENVELOPE VALUE, THE ENERGY OF EACH FREQUENCY BAND AND THE DOMINANT
+ #FREQUENCY, SAVED AS A SMALL .npz SIDECAR NEXT TO THE RECORDING, AND WRITES ONE
+ #SUMMARY ROW PER RECORDING TO hive_audio_features.
+import os
+import json
+import wave
+import numpy as np
+import db_pool
+import media_store
+
+#SAMPLES PER ANALYSIS FRAME (ONE ENVELOPE VALUE / SPECTRUM EACH) AND FRAMES READ PER CHUNK
+FRAME_SIZE = int(os.getenv("AUDIO_FRAME_SIZE", "4096"))
+CHUNK_FRAMES = int(os.getenv("AUDIO_CHUNK_FRAMES", "64"))
+
+#BAND EDGES IN Hz, COLONY SOUND SITS MOSTLY BETWEEN 100 AND 600 Hz
+BAND_EDGES = tuple(float(edge) for edge in os.getenv("AUDIO_BAND_EDGES_HZ", "0,100,200,300,400,500,600,1000,2000,4000").split(","))
+
+#PCM SAMPLE WIDTH (BYTES) -> NUMPY TYPE AND FULL SCALE
+_PCM = {1: (np.uint8, 128.0), 2: (np.int16, 32768.0), 4: (np.int32, 2147483648.0)}
+
+
+def _to_mono(raw, width, channels):
+    if width == 3:
+        #24 BIT: PAD EACH SAMPLE TO 32 BITS ON THE LOW SIDE
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3)
+        padded = np.zeros((len(b), 4), dtype=np.uint8)
+        padded[:, 1:] = b
+        samples = padded.view("<i4").ravel().astype(np.float32) / 2147483648.0
+    else:
+        dtype, scale = _PCM[width]
+        samples = np.frombuffer(raw, dtype=np.dtype(dtype).newbyteorder("<")).astype(np.float32)
+        if width == 1:
+            samples -= 128.0
+        samples /= scale
+    return samples.reshape(-1, channels).mean(axis=1)
+
+
+#YIELDS BLOCKS OF WHOLE FRAMES, SHAPE (n, FRAME_SIZE), AS MONO float32 IN [-1, 1]
+#THE LAST PARTIAL FRAME IS ZERO PADDED
+def frames(reader, frame_size=FRAME_SIZE, chunk_frames=CHUNK_FRAMES):
+    width, channels = reader.getsampwidth(), reader.getnchannels()
+    if width not in _PCM and width != 3:
+        raise ValueError(f"Unsupported sample width: {width} bytes")
+    leftover = np.zeros(0, dtype=np.float32)
+    while True:
+        raw = reader.readframes(frame_size * chunk_frames)
+        if not raw:
+            break
+        samples = np.concatenate((leftover, _to_mono(raw, width, channels)))
+        whole = len(samples) // frame_size * frame_size
+        leftover = samples[whole:]
+        if whole:
+            yield samples[:whole].reshape(-1, frame_size)
+    if len(leftover):
+        yield np.pad(leftover, (0, frame_size - len(leftover)))[np.newaxis, :]
+
+
+def analyse(filepath, frame_size=FRAME_SIZE, edges=BAND_EDGES):
+    with wave.open(filepath, "rb") as reader:
+        sample_rate, channels, n_frames = reader.getframerate(), reader.getnchannels(), reader.getnframes()
+        freqs = np.fft.rfftfreq(frame_size, d=1.0 / sample_rate)
+        bounds = np.searchsorted(freqs, edges)
+        window = np.hanning(frame_size).astype(np.float32)
+
+        envelope, dominant, bands = [], [], []
+        spectrum_sum = np.zeros(len(freqs))
+        square_sum, peak = 0.0, 0.0
+        for block in frames(reader, frame_size):
+            envelope.append(np.sqrt(np.mean(block ** 2, axis=1)))
+            square_sum += float(np.sum(block.astype(np.float64) ** 2))
+            peak = max(peak, float(np.abs(block).max()))
+
+            power = np.abs(np.fft.rfft(block * window, axis=1)) ** 2 / frame_size
+            spectrum_sum += power.sum(axis=0)
+            #BIN 0 IS DC, LEFT OUT OF THE DOMINANT FREQUENCY
+            dominant.append(freqs[np.argmax(power[:, 1:], axis=1) + 1])
+            cumulative = np.concatenate((np.zeros((len(power), 1)), np.cumsum(power, axis=1)), axis=1)
+            bands.append(cumulative[:, bounds[1:]] - cumulative[:, bounds[:-1]])
+
+    if not envelope:
+        raise ValueError(f"{filepath} has no samples")
+    band_frames = np.concatenate(bands).astype(np.float32)
+    return {
+        "sample_rate": sample_rate,
+        "channels": channels,
+        "duration": n_frames / sample_rate,
+        "frame_rate": sample_rate / frame_size,
+        "envelope": np.concatenate(envelope).astype(np.float32),
+        "dominant_frequency": np.concatenate(dominant).astype(np.float32),
+        "band_frames": band_frames,
+        "band_edges": np.asarray(edges, dtype=np.float32),
+        "rms": (square_sum / (n_frames or 1)) ** 0.5,
+        "peak_amplitude": peak,
+        "spectral_peak": float(freqs[np.argmax(spectrum_sum[1:]) + 1]),
+        "band_energies": {f"{lo:g}-{hi:g}": float(e) for lo, hi, e in zip(edges, edges[1:], band_frames.sum(axis=0))},
+    }
+
+
+#WRITES THE SIDECAR UNDER A TEMPORARY NAME FIRST SO READERS NEVER SEE HALF A FILE
+def write_sidecar(features, dest):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    partial = dest + ".part"
+    with open(partial, "wb") as file_obj:
+        np.savez_compressed(file_obj, frame_rate=features["frame_rate"], envelope=features["envelope"],
+                            dominant_frequency=features["dominant_frequency"],
+                            band_energies=features["band_frames"], band_edges=features["band_edges"])
+    os.replace(partial, dest)
+
+
+#ANALYSES source, WRITES ITS SIDECAR UNDER destination_folder, RETURNS THE SUMMARY ROW
+def extract(name, filename, source_folder, destination_folder):
+    features = analyse(os.path.join(source_folder, filename))
+    sidecar = media_store.sidecar_path(filename, ".npz", name)
+    write_sidecar(features, os.path.join(destination_folder, *sidecar.split("/")))
+    return (name.hive_id, media_store.relative_path(filename, name), sidecar, features["sample_rate"],
+            features["channels"], features["duration"], features["rms"], features["peak_amplitude"],
+            features["spectral_peak"], json.dumps(features["band_energies"]), name.timestamp)
+
+
+#path IS UNIQUE, A RE-INGESTED FILE REPLACES ITS OLD SUMMARY
+def insert_query():
+    return ("INSERT INTO hive_audio_features"
+            "(hive_id, path, sidecar, sample_rate, channels, duration, rms, peak_amplitude, "
+            "dominant_frequency, band_energies, created_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE sidecar = VALUES(sidecar), sample_rate = VALUES(sample_rate), "
+            "channels = VALUES(channels), duration = VALUES(duration), rms = VALUES(rms), "
+            "peak_amplitude = VALUES(peak_amplitude), dominant_frequency = VALUES(dominant_frequency), "
+            "band_energies = VALUES(band_energies), created_at = VALUES(created_at)")
+
+
+def insert_features(row):
+    mydb = db_pool.get_connection()
+    mycursor = mydb.cursor()
+    try:
+        mycursor.execute(insert_query(), row)
+        mydb.commit()
+    finally:
+        mydb.close()
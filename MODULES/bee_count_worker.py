@@ -0,0 +1,286 @@
+ #THIS FILE FILLS hive_photos.detected_bees. IT LOADS THE BEE DETECTION MODEL ONCE,
+ #TAKES THE PHOTOS THAT HAVE NO COUNT YET IN ID ORDER, READS THE NEXT IMAGES IN A
+ #THREAD POOL WHILE THE MODEL WORKS ON THE CURRENT BATCH AND WRITES THE COUNTS OF A
+ #WHOLE BATCH IN ONE UPDATE. THE LAST ID HANDLED IS KEPT IN A CHECKPOINT FILE SO A
+ #RESTART CARRIES ON WHERE IT STOPPED.
+ #RUN: python bee_count_worker.py             (KEEPS COUNTING NEW PHOTOS)
+ #     python bee_count_worker.py --backfill  (COUNTS THE PHOTOS STORED BEFORE, THEN EXITS)
+import os
+import sys
+import json
+import time
+import argparse
+import traceback
+from collections import deque, Counter
+from concurrent.futures import ThreadPoolExecutor
+import db_pool
+import ingest_ledger
+import register_hiveimages
+import detection_cache
+from BeeDetection import detector
+
+#IMAGES PER MODEL CALL, THREADS READING IMAGES AHEAD, ROWS FETCHED PER QUERY
+BATCH_SIZE = int(os.getenv("BEE_BATCH_SIZE", "8"))
+PREFETCH_WORKERS = int(os.getenv("BEE_PREFETCH_WORKERS", "4"))
+PAGE_SIZE = int(os.getenv("BEE_PAGE_SIZE", "256"))
+
+#HOW OFTEN NEW PHOTOS ARE LOOKED FOR, AND FOR HOW MANY POLLS A PHOTO WHOSE FILE IS
+#NOT IN PLACE YET (ROW COMMITTED, MOVE STILL RUNNING) IS WAITED FOR BEFORE IT IS SKIPPED
+POLL_SECONDS = float(os.getenv("BEE_POLL_SECONDS", "30"))
+MISSING_RETRIES = int(os.getenv("BEE_MISSING_RETRIES", "10"))
+
+CHECKPOINT_PATH = os.path.join(ingest_ledger.STATE_DIR, "bee_count_checkpoint.json")
+
+
+#{"live": last id counted by the live worker, "backfill": last id reached by the backfill}
+def read_checkpoint(path=CHECKPOINT_PATH):
+    try:
+        with open(path) as file_obj:
+            return json.load(file_obj)
+    except FileNotFoundError:
+        return {}
+
+
+#THE LIVE WORKER AND A BACKFILL MAY RUN AT THE SAME TIME, EACH ONLY CHANGES ITS OWN KEY
+def write_checkpoint(key, last_id, path=CHECKPOINT_PATH):
+    state = read_checkpoint(path)
+    state[key] = last_id
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.{os.getpid()}.part"
+    with open(partial, "w") as file_obj:
+        json.dump(state, file_obj)
+    os.replace(partial, path)
+
+
+def image_path(path):
+    #path IS 2/2024/06/<file>.jpg, OR THE BARE FILE NAME FOR ROWS NOT RESHARDED YET
+    return os.path.join(register_hiveimages.folder_destination, *path.split("/"))
+
+
+#(id, path) OF THE NEXT PHOTOS AFTER after_id, ONLY THOSE WITHOUT A COUNT UNLESS recount
+def fetch_rows(after_id, limit=PAGE_SIZE, recount=False):
+    mydb = db_pool.get_connection()
+    mycursor = mydb.cursor()
+    try:
+        uncounted = "" if recount else " AND detected_bees IS NULL"
+        mycursor.execute(f"SELECT id, path FROM hive_photos WHERE id > %s{uncounted} ORDER BY id LIMIT %s",
+                         (after_id, limit))
+        return mycursor.fetchall()
+    finally:
+        mydb.close()
+
+
+def max_id():
+    mydb = db_pool.get_connection()
+    mycursor = mydb.cursor()
+    try:
+        mycursor.execute("SELECT COALESCE(MAX(id), 0) FROM hive_photos")
+        return mycursor.fetchone()[0]
+    finally:
+        mydb.close()
+
+
+#ONE UPDATE FOR THE WHOLE BATCH: SET detected_bees = CASE id WHEN .. THEN .. END WHERE id IN (..)
+def update_query(size):
+    return ("UPDATE hive_photos SET detected_bees = CASE id " + "WHEN %s THEN %s " * size +
+            "END WHERE id IN (" + ", ".join(["%s"] * size) + ")")
+
+
+def write_counts(counts):
+    if not counts:
+        return
+    data = [value for pair in counts for value in pair] + [row_id for row_id, _ in counts]
+    mydb = db_pool.get_connection()
+    mycursor = mydb.cursor()
+    try:
+        mycursor.execute(update_query(len(counts)), data)
+        mydb.commit()
+    finally:
+        mydb.close()
+
+
+class BeeCounter:
+    """Counts bees in hive_photos rows, batch by batch.
+
+    count_rows() takes rows in id order; once it returns every row up to
+    the id it returns has its count stored and can go in the checkpoint.
+    Photos whose detections are in the detection cache skip decoding and
+    the model; pass use_cache=False to always run the model.
+    """
+
+    def __init__(self, model=None, batch_size=BATCH_SIZE, prefetch_workers=PREFETCH_WORKERS, use_cache=True):
+        self.model = model if model is not None else detector.load_model()
+        self.batch_size = batch_size
+        self.cache = detection_cache.DetectionCache(self.model) if use_cache else None
+        self._pool = ThreadPoolExecutor(max_workers=max(1, prefetch_workers), thread_name_prefix="bee-prefetch")
+        self._lookahead = max(batch_size, prefetch_workers) * 2
+        self._missing = Counter()
+        self.counted = 0
+        self.skipped = 0
+
+    #(content hash, image, cached detections), ONE OF THE LAST TWO IS None, OR None IF UNREADABLE
+    def _load(self, path):
+        try:
+            with open(path, "rb") as file_obj:
+                data = file_obj.read()
+        except OSError:
+            return None
+        digest = detection_cache.content_hash(data)
+        cached = self.cache.get(digest) if self.cache is not None else None
+        if cached is not None:
+            return digest, None, cached
+        image = detector.decode_image(data)
+        return (digest, image, None) if image is not None else None
+
+    #YIELDS (id, path, _load() result) IN ORDER, READING UP TO _lookahead IMAGES AHEAD
+    def _decoded(self, rows):
+        rows = iter(rows)
+        pending = deque()
+        while True:
+            while len(pending) < self._lookahead:
+                row = next(rows, None)
+                if row is None:
+                    break
+                row_id, path = row
+                pending.append((row_id, path, self._pool.submit(self._load, image_path(path))))
+            if not pending:
+                return
+            row_id, path, future = pending.popleft()
+            yield row_id, path, future.result()
+
+    #IN LIVE MODE THE PAGE STOPS AT THE FIRST PHOTO WHOSE FILE HAS NOT ARRIVED YET
+    def _ready(self, rows):
+        for i, (row_id, path) in enumerate(rows):
+            if os.path.exists(image_path(path)):
+                continue
+            self._missing[row_id] += 1
+            if self._missing[row_id] <= MISSING_RETRIES:
+                return rows[:i]
+            del self._missing[row_id]
+        return rows
+
+    #RUNS THE MODEL ON batch; IF IT FAILS EACH PHOTO IS TRIED ON ITS OWN AND THE ONES THE MODEL
+    #CANNOT HANDLE ARE LEFT OUT, SO ONE BAD IMAGE DOES NOT STOP THE WORKER. (batch entry, detections) PAIRS
+    def _run_model(self, batch, floor):
+        try:
+            return list(zip(batch, detector.detect(self.model, [image for _, _, image in batch], confidence=floor)))
+        except Exception:
+            if len(batch) == 1:
+                print(f"Not counting photo {batch[0][0]}: the model failed on it")
+                traceback.print_exc()
+                self.skipped += 1
+                return []
+        return [pair for entry in batch for pair in self._run_model([entry], floor)]
+
+    #DETECTIONS OF THE PHOTOS IN batch, DOWN TO THE CACHE'S MINIMUM CONFIDENCE, INTO counts
+    def _detect(self, batch, counts):
+        floor = self.cache.min_confidence if self.cache is not None else detector.CONFIDENCE
+        for (row_id, digest, _), (boxes, scores) in self._run_model(batch, floor):
+            if self.cache is not None:
+                #COUNTED FROM WHAT WAS STORED SO A LATER RECOUNT FROM THE CACHE GIVES THE SAME NUMBER
+                boxes, scores = self.cache.put(digest, boxes, scores)
+            counts.append((row_id, detection_cache.bee_count(boxes, scores)))
+        batch.clear()
+
+    def _write(self, counts):
+        write_counts(counts)
+        self.counted += len(counts)
+        counts.clear()
+
+    #COUNTS AND STORES rows, RETURNS THE LAST ID HANDLED (None IF NONE WAS)
+    def count_rows(self, rows, wait_for_files=False):
+        if wait_for_files:
+            rows = self._ready(rows)
+        batch, counts, last = [], [], None
+        for row_id, path, loaded in self._decoded(rows):
+            last = row_id
+            if loaded is None:
+                print(f"Not counting photo {row_id}: cannot read {path}")
+                self.skipped += 1
+                continue
+            digest, image, cached = loaded
+            if cached is not None:
+                counts.append((row_id, detection_cache.bee_count(*cached)))
+            else:
+                batch.append((row_id, digest, image))
+            if len(batch) >= self.batch_size:
+                self._detect(batch, counts)
+            if len(counts) >= self.batch_size:
+                self._write(counts)
+        if batch:
+            self._detect(batch, counts)
+        if counts:
+            self._write(counts)
+        return last
+
+    def close(self):
+        self._pool.shutdown()
+
+
+#COUNTS NEW PHOTOS FOREVER, STARTING AFTER THE CHECKPOINT
+#ON THE VERY FIRST START ONLY PHOTOS STORED FROM NOW ON, OLDER ONES ARE FOR --backfill
+def run_live(counter):
+    after = read_checkpoint().get("live")
+    if after is None:
+        after = max_id()
+        write_checkpoint("live", after)
+    while True:
+        try:
+            rows = fetch_rows(after)
+            last = counter.count_rows(rows, wait_for_files=True) if rows else None
+        except Exception:
+            #i.e THE DATABASE IS DOWN: THE CHECKPOINT STAYS, THE SAME PHOTOS ARE TRIED AT THE NEXT POLL
+            traceback.print_exc()
+            time.sleep(POLL_SECONDS)
+            continue
+        if last is not None:
+            after = last
+            write_checkpoint("live", after)
+            print(f"Counted bees up to photo {last} ({counter.counted} photos, {counter.skipped} not counted)")
+        if len(rows) < PAGE_SIZE or last is None:
+            time.sleep(POLL_SECONDS)
+
+
+#WALKS THE WHOLE TABLE ONCE, RESUMING FROM ITS OWN CHECKPOINT
+def run_backfill(counter, from_id=None, recount=False):
+    after = from_id if from_id is not None else read_checkpoint().get("backfill", 0)
+    started = time.monotonic()
+    while True:
+        rows = fetch_rows(after, recount=recount)
+        if not rows:
+            break
+        after = counter.count_rows(rows)
+        write_checkpoint("backfill", after)
+        rate = counter.counted / max(time.monotonic() - started, 1e-9)
+        cache = f", {counter.cache.hits} from the detection cache" if counter.cache is not None else ""
+        print(f"Backfill at photo {after}: {counter.counted} counted{cache}, {counter.skipped} not counted, {rate:.1f} photos/s")
+    print(f"Backfill done: {counter.counted} photos counted")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill hive_photos.detected_bees with the bee detection model")
+    parser.add_argument("--backfill", action="store_true", help="count the photos stored before, then exit")
+    parser.add_argument("--from-id", type=int, help="backfill from this photo id instead of the checkpoint")
+    parser.add_argument("--recount", action="store_true", help="backfill photos that already have a count too")
+    parser.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    parser.add_argument("--no-cache", action="store_true", help="run the model even for photos in the detection cache")
+    args = parser.parse_args(argv)
+
+    counter = BeeCounter(batch_size=args.batch_size, use_cache=not args.no_cache)
+    try:
+        if args.backfill:
+            run_backfill(counter, args.from_id, args.recount)
+        else:
+            run_live(counter)
+    finally:
+        counter.close()
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,60 @@
+ #THIS FILE DESCRIBES EVERY SENSOR CSV STREAM THE PIS UPLOAD: WHICH FILE NAMES BELONG
+ #TO IT, WHICH TABLES ITS ROWS GO TO AND WHICH CSV COLUMN (PARSED AS WHAT) FILLS EACH
+ #TABLE COLUMN. register_hivetemp_hivehumidity CHECKS AND LOADS ANY OF THEM THE SAME
+ #WAY, SO A NEW STREAM ONLY NEEDS AN ENTRY IN STREAMS BELOW.
+from collections import namedtuple
+
+#name: TABLE COLUMN, index: CSV COLUMN, type: int, float, datetime OR text (SEE csv_validation)
+Column = namedtuple("Column", "name index type")
+Target = namedtuple("Target", "table columns")
+Stream = namedtuple("Stream", "name prefix targets")
+
+#EVERY STREAM HAS THE READING TIME IN ITS FIRST COLUMN
+CREATED_AT = Column("created_at", 0, "datetime")
+
+
+def _record(table, index, type_):
+    return Target(table, (Column("record", index, type_), CREATED_AT))
+
+
+STREAMS = (
+    #power_<hive>.csv: [time and date, battery percent, battery voltage]
+    Stream("power", "power_", (
+        Target("hive_battery", (Column("percent", 1, "float"), Column("voltage", 2, "float"), CREATED_AT)),
+    )),
+    #voc_<hive>.csv: [time and date, VOC]
+    Stream("voc", "voc_", (
+        _record("hive_vocs", 1, "float"),
+    )),
+    #<hive>.csv: [time and date, temperature (C), humidity, CO2, weight]
+    #TEMPERATURE AND HUMIDITY ARE STORED AS TEXT, i.e 27.3*2*23.9 (SEVERAL PROBES IN ONE READING)
+    #NO PREFIX, KEEP IT LAST SO PREFIXED STREAMS ARE MATCHED FIRST
+    Stream("sensor", "", (
+        _record("hive_temperatures", 1, "text"),
+        _record("hive_humidity", 2, "text"),
+        _record("hive_carbondioxide", 3, "float"),
+        _record("hive_weights", 4, "float"),
+    )),
+)
+
+
+#(stream, hive_id) OF A CSV FILE NAME, None IF NO STREAM TAKES IT
+def match(filename):
+    if not filename.endswith(".csv"):
+        return None
+    stem = filename[:-len(".csv")]
+    for stream in STREAMS:
+        if stem.startswith(stream.prefix):
+            hive_id = stem[len(stream.prefix):]
+            #HIVE IDS ARE NUMBERS, SO power.csv IS NOT THE SENSOR CSV OF A HIVE CALLED "power"
+            if hive_id.isdigit():
+                return stream, hive_id
+    return None
+
+
+def columns_of(stream):
+    return sorted({column.index for target in stream.targets for column in target.columns})
+
+
+def width(stream):
+    return max(columns_of(stream)) + 1
@@ -0,0 +1,190 @@
+ #THIS FILE CHECKS SENSOR CSV ROWS BEFORE THEY ARE LOADED. THE CSV IS READ IN CHUNKS
+ #AND EVERY COLUMN OF A CHUNK IS PARSED AT ONCE WITH NUMPY: COLUMN COUNT, TIMESTAMP AND
+ #NUMBERS. ROWS THAT FAIL ARE WRITTEN, WITH THE REASON, TO A QUARANTINE CSV UNDER
+ #QUARANTINE_DIR INSTEAD OF REACHING THE DATABASE, SO ONE BAD LINE NEITHER FAILS A
+ #BATCH NOR GETS LOST.
+import os
+import re
+import csv
+import time
+from itertools import islice
+import numpy as np
+import csv_streams
+import ingest_ledger
+import ingest_metrics
+
+QUARANTINE_DIR = os.getenv("SENSOR_QUARANTINE_DIR", os.path.join(ingest_ledger.STATE_DIR, "quarantine"))
+
+#CSV ROWS CHECKED PER CHUNK
+CHUNK_ROWS = int(os.getenv("SENSOR_VALIDATION_CHUNK", "10000"))
+
+#SHORTEST TIMESTAMP ACCEPTED, numpy WOULD OTHERWISE READ "2024" AS 2024-01-01
+_MIN_DATETIME_LENGTH = len("2024-04-03")
+
+
+class Quarantine:
+    """Collects the rejected rows of one CSV in <QUARANTINE_DIR>/<name>.<time>.rejected.csv.
+
+    The file is only created once a row is rejected; each line is
+    (line number, reason, original fields...).
+    """
+
+    def __init__(self, filename, stream, folder=QUARANTINE_DIR):
+        self.filename = filename
+        self.stream = stream
+        self.folder = folder
+        self.path = None
+        self.count = 0
+        self._handle = None
+        self._writer = None
+
+    def reject(self, line_number, reason, fields):
+        if self._handle is None:
+            os.makedirs(self.folder, exist_ok=True)
+            stem = os.path.splitext(self.filename)[0]
+            self.path = os.path.join(self.folder, f"{stem}.{time.strftime('%Y%m%d-%H%M%S')}.rejected.csv")
+            self._handle = open(self.path, "a", newline="")
+            self._writer = csv.writer(self._handle, lineterminator="\n")
+        self._writer.writerow(["" if line_number is None else line_number, reason, *fields])
+        self.count += 1
+
+    #FORGETS WHAT WAS REJECTED SO FAR, FOR A FILE THAT IS READ AGAIN FROM THE START
+    def reset(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+            os.remove(self.path)
+        self.path = None
+        self.count = 0
+
+    def close(self):
+        if self._handle is not None:
+            self._handle.close()
+            self._handle = None
+            ingest_metrics.inc("ingest_rows_quarantined_total", self.count, stream=self.stream)
+            print(f"Quarantined {self.count} rows of {self.filename} in {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _to_float(values):
+    parsed = values.astype(np.float64)
+    #MySQL FLOAT COLUMNS CANNOT HOLD nan OR inf
+    return parsed, np.isfinite(parsed)
+
+
+def _to_int(values):
+    return values.astype(np.int64), np.ones(len(values), dtype=bool)
+
+
+#UTC OFFSET AT THE END OF A TIMESTAMP, i.e +03:00, -0500 OR Z
+_OFFSET = re.compile(r"(?<=\d)(?:Z|[+-]\d{2}:?\d{2})$")
+
+
+#THE PIS WRITE LOCAL TIME, AN OFFSET IS DROPPED SO THE WALL-CLOCK TIME IS STORED AS WRITTEN.
+#numpy WOULD CONVERT IT TO UTC (WITH A WARNING PER CHUNK) AND SHIFT THE STORED TIME
+def _strip_offsets(values):
+    #THE DATE TAKES THE FIRST 10 CHARACTERS, A + OR - AFTER IT CAN ONLY START AN OFFSET
+    offset = np.char.endswith(values, "Z") | (np.char.rfind(values, "+") >= 10) | (np.char.rfind(values, "-") >= 10)
+    if not offset.any():
+        return values
+    values = values.astype(object)
+    values[offset] = [_OFFSET.sub("", value) for value in values[offset]]
+    return values.astype(str)
+
+
+#numpy ONLY CHECKS THE TIMESTAMP, THE STRING ITSELF IS LOADED SO FRACTIONAL SECONDS ARE KEPT AS WRITTEN
+def _to_datetime(values):
+    values = _strip_offsets(values)
+    parsed = values.astype("datetime64[us]")
+    ok = ~np.isnat(parsed) & (np.char.str_len(values) >= _MIN_DATETIME_LENGTH)
+    return values, ok
+
+
+def _to_text(values):
+    return values, np.char.str_len(values) > 0
+
+
+#WHOLE COLUMN AT ONCE: (parsed values, mask of the values that are valid)
+#RAISES ValueError IF ANY VALUE DOES NOT PARSE AT ALL
+VECTOR_PARSERS = {
+    "float": _to_float,
+    "int": _to_int,
+    "datetime": _to_datetime,
+    "text": _to_text,
+}
+
+
+#PARSES ONE COLUMN OF A CHUNK: (values as a list, mask of the valid ones)
+def parse_column(type_, raw):
+    values = np.char.strip(np.asarray(raw, dtype=str))
+    try:
+        parsed, ok = VECTOR_PARSERS[type_](values)
+        return parsed.tolist(), ok
+    except ValueError:
+        pass
+    #SOME VALUE IN THIS CHUNK IS BROKEN, FIND IT ONE VALUE AT A TIME
+    parsed, ok = [], np.ones(len(values), dtype=bool)
+    for i, value in enumerate(values.tolist()):
+        try:
+            chunk, valid = VECTOR_PARSERS[type_](np.asarray([value]))
+            parsed.append(chunk.tolist()[0])
+            ok[i] = valid[0]
+        except ValueError:
+            parsed.append(None)
+            ok[i] = False
+    return parsed, ok
+
+
+#YIELDS LISTS OF (line number, row) OF AT MOST size ROWS
+def chunks(filepath, size=CHUNK_ROWS):
+    with open(filepath, newline="") as file_obj:
+        rows = enumerate(csv.reader(file_obj), 1)
+        while True:
+            chunk = list(islice(rows, size))
+            if not chunk:
+                return
+            yield chunk
+
+
+#YIELDS LISTS OF VALID RECORDS, ONE (hive_id, column values...) TUPLE PER TARGET TABLE EACH,
+#EVERY OTHER ROW GOES TO quarantine
+def validate(stream, filepath, hive_id, quarantine, chunk_rows=CHUNK_ROWS):
+    columns = {}
+    for target in stream.targets:
+        for column in target.columns:
+            columns.setdefault(column.index, column)
+    expected = csv_streams.width(stream)
+
+    for chunk in chunks(filepath, chunk_rows):
+        lengths = np.fromiter((len(row) for _, row in chunk), dtype=np.int64, count=len(chunk))
+        long_enough = lengths >= expected
+        rows = [row for (_, row), ok in zip(chunk, long_enough) if ok]
+        reasons = [None] * len(rows)
+
+        parsed = {}
+        for index, column in columns.items():
+            parsed[index], ok = parse_column(column.type, [row[index] for row in rows])
+            for i in np.flatnonzero(~ok):
+                if reasons[i] is None:
+                    reasons[i] = f"{column.name} (column {index + 1}): not a valid {column.type} {rows[i][index]!r}"
+
+        #BACK TO WHOLE-CHUNK POSITIONS TO QUARANTINE IN FILE ORDER
+        kept = iter(range(len(rows)))
+        valid = []
+        for (line_number, row), ok in zip(chunk, long_enough):
+            if not ok:
+                quarantine.reject(line_number, f"expected {expected} columns, got {len(row)}", row)
+                continue
+            i = next(kept)
+            if reasons[i] is not None:
+                quarantine.reject(line_number, reasons[i], row)
+                continue
+            valid.append(tuple((hive_id,) + tuple(parsed[column.index][i] for column in target.columns)
+                               for target in stream.targets))
+        if valid:
+            yield valid
@@ -0,0 +1,170 @@
+ #THIS FILE HOLDS THE MYSQL CONNECTION POOL SHARED BY ALL REGISTER_* MODULES.
+ #DATABASE DETAILS COME FROM THE ENVIRONMENT (DB_HOST, DB_PORT, DB_DATABASE,
+ #DB_USERNAME, DB_PASSWORD) OR, FAILING THAT, FROM THE LARAVEL .env FILE.
+import os
+import time
+import queue
+import tempfile
+import threading
+import mysql.connector
+from mysql.connector import errors
+
+ENV_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, ".env")
+
+#THE ONLY DIRECTORY LOAD DATA LOCAL INFILE MAY READ FROM
+LOCAL_INFILE_DIR = os.getenv("LOAD_DATA_STAGING_DIR", os.path.join(tempfile.gettempdir(), "ademnea_load_data"))
+
+
+def read_env_file(path):
+    values = {}
+    try:
+        with open(path) as env_file:
+            for line in env_file:
+                line = line.strip()
+                if not line or line.startswith("#") or "=" not in line:
+                    continue
+                key, value = line.split("=", 1)
+                values[key.strip()] = value.strip().strip('"').strip("'")
+    except FileNotFoundError:
+        pass
+    return values
+
+
+def load_config():
+    env_file = read_env_file(os.getenv("ADEMNEA_ENV_FILE", ENV_FILE))
+
+    def setting(key, default):
+        return os.getenv(key, env_file.get(key, default))
+
+    return {
+        "host": setting("DB_HOST", "localhost"),
+        "port": int(setting("DB_PORT", "3306")),
+        "user": setting("DB_USERNAME", "root"),
+        "password": setting("DB_PASSWORD", ""),
+        "database": setting("DB_DATABASE", "ademnea"),
+        "allow_local_infile_in_path": LOCAL_INFILE_DIR,
+    }
+
+
+class PooledConnection:
+    """A checked-out connection; close() hands it back to the pool."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if self._conn is None:
+            return
+        conn, self._conn = self._conn, None
+        self._pool._release(conn)
+
+    def __del__(self):
+        #A HANDLER THAT RAISED BEFORE close() MUST NOT LEAK ITS POOL SLOT
+        self.close()
+
+
+class ConnectionPool:
+    """Blocking pool of at most `size` MySQL connections.
+
+    Idle connections are pinged (and reconnected) before reuse once they
+    have been idle for longer than `health_check_after` seconds.
+    """
+
+    def __init__(self, size, config, health_check_after=30.0, connect_attempts=3, timeout=None):
+        self.config = config
+        self.health_check_after = health_check_after
+        self.connect_attempts = connect_attempts
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+
+    def _connect(self):
+        for attempt in range(1, self.connect_attempts + 1):
+            try:
+                return mysql.connector.connect(**self.config)
+            except errors.Error:
+                if attempt == self.connect_attempts:
+                    raise
+                time.sleep(attempt)
+
+    def _healthy(self, conn, idle_since):
+        if time.monotonic() - idle_since < self.health_check_after:
+            return conn
+        try:
+            conn.ping(reconnect=True, attempts=self.connect_attempts, delay=1)
+            return conn
+        except errors.Error:
+            try:
+                conn.close()
+            except errors.Error:
+                pass
+            return self._connect()
+
+    def get_connection(self):
+        if not self._slots.acquire(timeout=self.timeout):
+            raise errors.PoolError("No database connection became free in time")
+        try:
+            try:
+                conn, idle_since = self._idle.get_nowait()
+                conn = self._healthy(conn, idle_since)
+            except queue.Empty:
+                conn = self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+        return PooledConnection(self, conn)
+
+    def _release(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            self._idle.put((conn, time.monotonic()))
+        except errors.Error:
+            #BROKEN CONNECTION, DROP IT, THE NEXT CHECKOUT OPENS A NEW ONE
+            try:
+                conn.close()
+            except errors.Error:
+                pass
+        finally:
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                conn.close()
+            except errors.Error:
+                pass
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool(
+                size=int(os.getenv("DB_POOL_SIZE", "8")),
+                config=load_config(),
+                health_check_after=float(os.getenv("DB_POOL_HEALTH_CHECK_AFTER", "30")),
+            )
+        return _pool
+
+
+def get_connection():
+    return get_pool().get_connection()
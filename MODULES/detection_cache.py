@@ -0,0 +1,87 @@
+ #THIS FILE KEEPS THE RAW BEE DETECTIONS (BOXES AND CONFIDENCES) OF EVERY PHOTO THE MODEL
+ #HAS SEEN, ONE SMALL .npz PER PHOTO, KEYED BY THE PHOTO'S CONTENT HASH UNDER A FOLDER PER
+ #MODEL VERSION AND DETECTION SETTINGS. DETECTIONS ARE KEPT DOWN TO MIN_CONFIDENCE, SO A
+ #COUNT WITH ANY HIGHER BEE_CONFIDENCE OR ANOTHER BEE_MIN_BOX_AREA IS WORKED OUT FROM THE
+ #CACHE WITHOUT RUNNING THE MODEL AGAIN, i.e python bee_count_worker.py --backfill --recount
+import os
+import json
+import hashlib
+import numpy as np
+import ingest_ledger
+from BeeDetection import detector
+
+CACHE_DIR = os.getenv("BEE_CACHE_DIR", os.path.join(ingest_ledger.STATE_DIR, "detections"))
+
+#LOWEST CONFIDENCE KEPT, COUNTS CAN USE ANY THRESHOLD FROM HERE UP
+MIN_CONFIDENCE = float(os.getenv("BEE_CACHE_MIN_CONFIDENCE", "0.05"))
+
+#COUNTING RULE: BOXES SMALLER THAN THIS (PIXELS) ARE NOT COUNTED AS BEES
+MIN_BOX_AREA = float(os.getenv("BEE_MIN_BOX_AREA", "0"))
+
+
+#EVERYTHING THE RAW DETECTIONS DEPEND ON; THE COUNTING RULE IS LEFT OUT ON PURPOSE
+def settings(model, min_confidence=MIN_CONFIDENCE):
+    return {
+        "model": model.bee_version,
+        "image_size": detector.IMAGE_SIZE,
+        "tile_size": detector.TILE_SIZE,
+        "tile_overlap": detector.TILE_OVERLAP if detector.TILE_SIZE else None,
+        "merge_threshold": detector.MERGE_THRESHOLD if detector.TILE_SIZE else None,
+        "min_confidence": min_confidence,
+    }
+
+
+def content_hash(data):
+    #SAME DIGEST AS ingest_ledger.file_digest() OF THE FILE
+    return hashlib.blake2b(data, digest_size=20).hexdigest()
+
+
+#COUNT OF ONE PHOTO FROM ITS DETECTIONS
+def bee_count(boxes, scores, confidence=detector.CONFIDENCE, min_area=MIN_BOX_AREA):
+    keep = scores >= confidence
+    if min_area > 0:
+        keep &= (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]) >= min_area
+    return int(np.count_nonzero(keep))
+
+
+class DetectionCache:
+    """Raw detections of one model and detection settings, by image content hash."""
+
+    def __init__(self, model, folder=CACHE_DIR, min_confidence=MIN_CONFIDENCE):
+        self.settings = settings(model, min_confidence)
+        self.min_confidence = min_confidence
+        key = hashlib.blake2b(json.dumps(self.settings, sort_keys=True).encode(), digest_size=8).hexdigest()
+        self.folder = os.path.join(folder, key)
+        os.makedirs(self.folder, exist_ok=True)
+        #SAYS WHAT THE FOLDER HOLDS, FOR WHOEVER CLEANS UP OLD MODEL VERSIONS
+        with open(os.path.join(self.folder, "settings.json"), "w") as file_obj:
+            json.dump(self.settings, file_obj, indent=2)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, digest):
+        return os.path.join(self.folder, digest[:2], f"{digest}.npz")
+
+    #(boxes, scores) OR None
+    def get(self, digest):
+        try:
+            with np.load(self._path(digest)) as cached:
+                found = cached["boxes"].astype(np.float32), cached["scores"].astype(np.float32)
+        except (FileNotFoundError, ValueError, KeyError, OSError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return found
+
+    #BOXES ROUNDED TO WHOLE PIXELS (uint16), CONFIDENCES AS float16: A FEW BYTES PER BEE
+    #RETURNS THE DETECTIONS AS get() WILL GIVE THEM BACK
+    def put(self, digest, boxes, scores):
+        boxes = np.clip(np.rint(boxes), 0, 65535).astype(np.uint16)
+        scores = scores.astype(np.float16)
+        path = self._path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        partial = f"{path}.{os.getpid()}.part"
+        with open(partial, "wb") as file_obj:
+            np.savez_compressed(file_obj, boxes=boxes, scores=scores)
+        os.replace(partial, path)
+        return boxes.astype(np.float32), scores.astype(np.float32)
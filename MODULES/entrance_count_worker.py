@@ -0,0 +1,303 @@
+ #THIS FILE FILLS hive_entrance_bee_counts FROM THE HIVE ENTRANCE VIDEOS. EACH VIDEO IS
+ #READ FRAME BY FRAME (NEVER WHOLE INTO MEMORY), ONLY BEE_VIDEO_SAMPLE_FPS FRAMES A
+ #SECOND ARE LOOKED AT, AND OF THOSE ONLY THE ONES A CHEAP PIXEL DIFFERENCE SAYS HAVE
+ #CHANGED GO THROUGH THE MODEL. THE MODEL TRACKS THE BEES AND EVERY TRACK CROSSING THE
+ #ENTRANCE LINE COUNTS ONCE; ONE ROW PER BEE_VIDEO_INTERVAL_SECONDS OF VIDEO IS WRITTEN.
+ #RUN: python entrance_count_worker.py             (KEEPS COUNTING NEW VIDEOS)
+ #     python entrance_count_worker.py --backfill  (COUNTS THE VIDEOS STORED BEFORE, THEN EXITS)
+import os
+import sys
+import time
+import argparse
+import traceback
+from datetime import datetime, timedelta
+import cv2
+import numpy as np
+import db_pool
+import ingest_ledger
+import register_hivevideos
+import bee_count_worker
+from BeeDetection import detector
+
+#FRAMES A SECOND LOOKED AT, LENGTH OF ONE COUNT ROW IN SECONDS OF VIDEO
+SAMPLE_FPS = float(os.getenv("BEE_VIDEO_SAMPLE_FPS", "5"))
+INTERVAL_SECONDS = float(os.getenv("BEE_VIDEO_INTERVAL_SECONDS", "60"))
+
+#MOTION GATE: FRAMES ARE COMPARED AT THIS WIDTH IN GREY, A PIXEL HAS CHANGED WHEN IT MOVED
+#MORE THAN PIXEL_DELTA GREY LEVELS, A FRAME WHEN MORE THAN MOTION_FRACTION OF ITS PIXELS DID
+MOTION_WIDTH = int(os.getenv("BEE_MOTION_WIDTH", "160"))
+PIXEL_DELTA = int(os.getenv("BEE_MOTION_PIXEL_DELTA", "15"))
+MOTION_FRACTION = float(os.getenv("BEE_MOTION_FRACTION", "0.002"))
+
+#ENTRANCE LINE AS x1,y1,x2,y2 IN FRACTIONS OF THE FRAME, A HORIZONTAL LINE ACROSS THE MIDDLE BY DEFAULT
+#GOING FROM x1,y1 TO x2,y2, A BEE CROSSING TO THE RIGHT-HAND SIDE (IMAGE Y POINTS DOWN) COUNTS AS GOING IN
+ENTRANCE_LINE = tuple(float(v) for v in os.getenv("BEE_ENTRANCE_LINE", "0,0.5,1,0.5").split(","))
+
+PAGE_SIZE = int(os.getenv("BEE_VIDEO_PAGE_SIZE", "16"))
+POLL_SECONDS = float(os.getenv("BEE_POLL_SECONDS", "30"))
+MISSING_RETRIES = int(os.getenv("BEE_MISSING_RETRIES", "10"))
+
+CHECKPOINT_PATH = os.path.join(ingest_ledger.STATE_DIR, "entrance_count_checkpoint.json")
+
+
+class MotionGate:
+    """Says whether a frame differs enough from the last frame that went through the model.
+
+    Comparing with the last frame let through, not the previous sample,
+    keeps a bee crawling slowly from being missed a little at a time.
+    """
+
+    def __init__(self, width=MOTION_WIDTH, pixel_delta=PIXEL_DELTA, fraction=MOTION_FRACTION):
+        self.width = width
+        self.pixel_delta = pixel_delta
+        self.fraction = fraction
+        self._reference = None
+
+    def changed(self, frame):
+        height = max(1, frame.shape[0] * self.width // frame.shape[1])
+        small = cv2.cvtColor(cv2.resize(frame, (self.width, height), interpolation=cv2.INTER_AREA), cv2.COLOR_BGR2GRAY)
+        if self._reference is not None:
+            moved = np.count_nonzero(cv2.absdiff(small, self._reference) > self.pixel_delta)
+            if moved <= self.fraction * small.size:
+                return False
+        self._reference = small
+        return True
+
+
+class LineCounter:
+    """Counts tracks whose box centre crosses the entrance line, in both directions."""
+
+    def __init__(self, line, width, height):
+        x1, y1, x2, y2 = line
+        self._start = np.array([x1 * width, y1 * height])
+        self._direction = np.array([(x2 - x1) * width, (y2 - y1) * height])
+        self._side = {}  # track id -> side of the line it was last seen on
+        self.inward = 0
+        self.outward = 0
+
+    #SIDE OF THE LINE OF EACH POINT: SIGN OF THE CROSS PRODUCT
+    def _sides(self, centres):
+        offset = centres - self._start
+        return np.sign(self._direction[0] * offset[:, 1] - self._direction[1] * offset[:, 0])
+
+    #RETURNS THE CROSSINGS SEEN IN THIS FRAME
+    def update(self, ids, boxes):
+        if not len(boxes):
+            return 0
+        centres = np.column_stack(((boxes[:, 0] + boxes[:, 2]) / 2, (boxes[:, 1] + boxes[:, 3]) / 2))
+        crossed = 0
+        for track_id, side in zip(ids, self._sides(centres)):
+            if track_id < 0 or side == 0:
+                continue
+            before = self._side.get(track_id)
+            self._side[track_id] = side
+            if before is not None and before != side:
+                crossed += 1
+                if side > 0:
+                    self.inward += 1
+                else:
+                    self.outward += 1
+        return crossed
+
+
+#YIELDS (seconds into the video, frame) OF SAMPLE_FPS FRAMES A SECOND, ONE FRAME IN MEMORY AT A TIME
+#SKIPPED FRAMES ARE ONLY grab()BED, NEVER CONVERTED TO AN IMAGE
+def sampled_frames(path, sample_fps=SAMPLE_FPS):
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"cannot open {path}")
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or 25.0
+        step = max(1, int(round(fps / sample_fps)))
+        index = 0
+        while True:
+            if index % step:
+                if not capture.grab():
+                    return
+            else:
+                ok, frame = capture.read()
+                if not ok:
+                    return
+                yield index / fps, frame
+            index += 1
+    finally:
+        capture.release()
+
+
+#CROSSINGS PER INTERVAL OF ONE VIDEO: ({interval index: crossings}, stats)
+def count_video(model, path, sample_fps=SAMPLE_FPS, interval=INTERVAL_SECONDS, line=ENTRANCE_LINE):
+    gate = MotionGate()
+    counter = None
+    counts = {}
+    sampled = inferred = 0
+    seconds = 0.0
+    for seconds, frame in sampled_frames(path, sample_fps):
+        sampled += 1
+        counts.setdefault(int(seconds // interval), 0)
+        if not gate.changed(frame):
+            continue
+        if counter is None:
+            counter = LineCounter(line, frame.shape[1], frame.shape[0])
+        ids, boxes = detector.track(model, frame, new_sequence=inferred == 0)
+        inferred += 1
+        counts[int(seconds // interval)] += counter.update(ids, boxes)
+    return counts, {
+        "sampled": sampled,
+        "inferred": inferred,
+        "duration": seconds,
+        "inward": counter.inward if counter else 0,
+        "outward": counter.outward if counter else 0,
+    }
+
+
+def video_path(path):
+    return os.path.join(register_hivevideos.folder_destination, *path.split("/"))
+
+
+def _as_datetime(value):
+    return value if isinstance(value, datetime) else datetime.fromisoformat(str(value))
+
+
+#(id, path, hive_id, created_at) OF THE NEXT VIDEOS AFTER after_id
+def fetch_videos(after_id, limit=PAGE_SIZE):
+    mydb = db_pool.get_connection()
+    mycursor = mydb.cursor()
+    try:
+        mycursor.execute("SELECT id, path, hive_id, created_at FROM hive_videos WHERE id > %s ORDER BY id LIMIT %s",
+                         (after_id, limit))
+        return mycursor.fetchall()
+    finally:
+        mydb.close()
+
+
+def max_id():
+    mydb = db_pool.get_connection()
+    mycursor = mydb.cursor()
+    try:
+        mycursor.execute("SELECT COALESCE(MAX(id), 0) FROM hive_videos")
+        return mycursor.fetchone()[0]
+    finally:
+        mydb.close()
+
+
+#ALL INTERVALS OF ONE VIDEO IN ONE MULTI-ROW INSERT, REPLACING THE ROWS AN EARLIER RUN OVER
+#THE SAME VIDEO WROTE, SO A VIDEO COUNTED TWICE (i.e AFTER A CRASH) IS NOT COUNTED DOUBLE.
+#ROWS ARE KEYED BY hive_video_id, OTHER VIDEOS OF THE HIVE OVERLAPPING IN TIME ARE LEFT ALONE
+def write_counts(video_id, hive_id, started_at, counts, interval=INTERVAL_SECONDS):
+    if not counts:
+        return
+    rows = []
+    for index in sorted(counts):
+        at = (started_at + timedelta(seconds=index * interval)).strftime("%Y-%m-%d %H:%M:%S")
+        rows.append((counts[index], hive_id, video_id, at, at))
+    mydb = db_pool.get_connection()
+    mycursor = mydb.cursor()
+    try:
+        mycursor.execute("DELETE FROM hive_entrance_bee_counts WHERE hive_video_id = %s", (video_id,))
+        mycursor.executemany("INSERT INTO hive_entrance_bee_counts(detected_bees, hive_id, hive_video_id, created_at, updated_at) "
+                             "VALUES (%s, %s, %s, %s, %s)", rows)
+        mydb.commit()
+    except Exception:
+        mydb.rollback()
+        raise
+    finally:
+        mydb.close()
+
+
+class EntranceCounter:
+    """Counts bees crossing the entrance in hive_videos rows, one video at a time."""
+
+    def __init__(self, model=None):
+        self.model = model if model is not None else detector.load_model()
+        self._missing = {}
+        self.videos = 0
+
+    #FALSE WHILE THE FILE OF A JUST COMMITTED ROW IS STILL BEING MOVED
+    def _ready(self, row_id, path, wait_for_files):
+        if not wait_for_files or os.path.exists(video_path(path)):
+            return True
+        self._missing[row_id] = self._missing.get(row_id, 0) + 1
+        if self._missing[row_id] <= MISSING_RETRIES:
+            return False
+        del self._missing[row_id]
+        return True
+
+    #COUNTS AND STORES rows, RETURNS THE LAST ID HANDLED (None IF NONE WAS)
+    def count_rows(self, rows, wait_for_files=False):
+        last = None
+        for row_id, path, hive_id, created_at in rows:
+            if not self._ready(row_id, path, wait_for_files):
+                break
+            last = row_id
+            started = time.perf_counter()
+            try:
+                counts, stats = count_video(self.model, video_path(path))
+            except Exception as e:
+                print(f"Not counting video {row_id}: {e}")
+                continue
+            write_counts(row_id, hive_id, _as_datetime(created_at), counts)
+            self.videos += 1
+            gated = 1 - stats["inferred"] / stats["sampled"] if stats["sampled"] else 0.0
+            print(f"Video {row_id} ({path}): {stats['inward']} in, {stats['outward']} out over {stats['duration']:.0f}s, "
+                  f"{stats['inferred']}/{stats['sampled']} frames through the model ({gated:.0%} gated), "
+                  f"{time.perf_counter() - started:.1f}s")
+        return last
+
+
+#COUNTS NEW VIDEOS FOREVER, STARTING AFTER THE CHECKPOINT
+#ON THE VERY FIRST START ONLY VIDEOS STORED FROM NOW ON, OLDER ONES ARE FOR --backfill
+def run_live(counter):
+    after = bee_count_worker.read_checkpoint(CHECKPOINT_PATH).get("live")
+    if after is None:
+        after = max_id()
+        bee_count_worker.write_checkpoint("live", after, CHECKPOINT_PATH)
+    while True:
+        try:
+            rows = fetch_videos(after)
+            last = counter.count_rows(rows, wait_for_files=True) if rows else None
+        except Exception:
+            #i.e THE DATABASE IS DOWN: THE CHECKPOINT STAYS, THE SAME VIDEOS ARE TRIED AT THE NEXT POLL
+            #(write_counts() REPLACES A VIDEO'S ROWS, SO ONE COUNTED TWICE IS NOT DOUBLED)
+            traceback.print_exc()
+            time.sleep(POLL_SECONDS)
+            continue
+        if last is not None:
+            after = last
+            bee_count_worker.write_checkpoint("live", after, CHECKPOINT_PATH)
+        if len(rows) < PAGE_SIZE or last is None:
+            time.sleep(POLL_SECONDS)
+
+
+#WALKS THE WHOLE TABLE ONCE, RESUMING FROM ITS OWN CHECKPOINT
+def run_backfill(counter, from_id=None):
+    after = from_id if from_id is not None else bee_count_worker.read_checkpoint(CHECKPOINT_PATH).get("backfill", 0)
+    while True:
+        rows = fetch_videos(after)
+        if not rows:
+            break
+        after = counter.count_rows(rows)
+        bee_count_worker.write_checkpoint("backfill", after, CHECKPOINT_PATH)
+    print(f"Backfill done: {counter.videos} videos counted")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fill hive_entrance_bee_counts from the hive entrance videos")
+    parser.add_argument("--backfill", action="store_true", help="count the videos stored before, then exit")
+    parser.add_argument("--from-id", type=int, help="backfill from this video id instead of the checkpoint")
+    args = parser.parse_args(argv)
+
+    counter = EntranceCounter()
+    if args.backfill:
+        run_backfill(counter, args.from_id)
+    else:
+        run_live(counter)
+
+
+if __name__ == "__main__":
+    try:
+        main()
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
@@ -0,0 +1,307 @@
+ #THIS FILE LETS SEVERAL WATCHER PROCESSES, ON ONE OR MORE MACHINES, SHARE ONE ARRIVAL
+ #FOLDER BY SPLITTING IT BY HIVE. EVERY PROCESS KEEPS A HEARTBEAT FILE IN THE LEASE
+ #DIRECTORY, RENDEZVOUS HASHING OVER THE LIVE PROCESSES SAYS WHICH ONE SHOULD OWN EACH
+ #HIVE, AND A LEASE FILE PER HIVE MAKES SURE ONLY ONE PROCESS HANDLES IT AT A TIME.
+ #WHEN A PROCESS STOPS HEARTBEATING ITS LEASES GO STALE AND THE NEW OWNERS TAKE THEM
+ #OVER, FIRST FINISHING WHAT IT LEFT HALF DONE. A HIVE ONLY CHANGES HANDS WHEN NONE OF
+ #ITS FILES IS RUNNING, SO FILES OF ONE HIVE ARE STILL HANDLED IN ORDER.
+ #START EACH PROCESS WITH: python register_media.py --partitioned
+ #THE LEASE DIRECTORY (INGEST_LEASE_DIR) MUST BE ON STORAGE ALL PROCESSES SHARE. INGEST_STATE_DIR
+ #MUST NOT BE: ITS LEDGER, JOURNAL AND SPILL QUEUE ARE SQLITE FILES IN WAL MODE, WHICH DOES NOT
+ #WORK OVER A NETWORK FILESYSTEM, SO EACH MACHINE KEEPS ITS OWN ON LOCAL DISK. A WATCHER THAT
+ #CRASHED FINISHES ITS OWN HALF-DONE FILES FROM ITS JOURNAL WHEN IT RESTARTS. UNTIL THEN THE
+ #NEW OWNER OF ITS HIVES HANDLES WHATEVER IT LEFT IN THE ARRIVAL FOLDER WITHOUT SEEING ITS
+ #LEDGER: A MEDIA FILE WHOSE ROW IS ALREADY IN THE DATABASE IS ONLY MOVED, NOT INSERTED AGAIN
+ #(SEE media_batcher.row_exists).
+import os
+import json
+import time
+import socket
+import hashlib
+import threading
+import traceback
+from collections import Counter
+import ingest_ledger
+from ingest_dispatcher import Pending
+
+LEASE_DIR = os.getenv("INGEST_LEASE_DIR", os.path.join(ingest_ledger.STATE_DIR, "leases"))
+WORKER_ID = os.getenv("INGEST_WORKER_ID", f"{socket.gethostname()}-{os.getpid()}")
+
+#HOW OFTEN HEARTBEATS/LEASES ARE RENEWED AND HOW OLD THEY MAY GET BEFORE THEIR HOLDER COUNTS AS DEAD
+HEARTBEAT_SECONDS = float(os.getenv("INGEST_HEARTBEAT_SECONDS", "5"))
+LEASE_TTL = float(os.getenv("INGEST_LEASE_TTL", "30"))
+
+
+#FILESYSTEMS SQLITE'S WAL MODE DOES NOT WORK ON
+NETWORK_FILESYSTEMS = ("nfs", "nfs4", "cifs", "smb3", "smbfs", "fuse.sshfs", "glusterfs", "ceph", "9p")
+
+
+#TYPE OF THE FILESYSTEM path IS ON, FROM /proc/mounts (None WHERE THERE IS NO /proc)
+def filesystem_of(path):
+    path = os.path.realpath(path)
+    found, found_type = "", None
+    try:
+        with open("/proc/mounts") as mounts:
+            for line in mounts:
+                fields = line.split()
+                if len(fields) < 3:
+                    continue
+                mount_point = fields[1].replace("\\040", " ")
+                inside = path == mount_point or path.startswith(mount_point.rstrip("/") + "/")
+                if inside and len(mount_point) > len(found):
+                    found, found_type = mount_point, fields[2]
+    except OSError:
+        return None
+    return found_type
+
+
+#LEASE FILE NAME OF A HIVE, FILES WITHOUT A HIVE (i.e UNSUPPORTED FILES) SHARE ONE LEASE
+def hive_key(hive_id):
+    return "_" if hive_id is None else str(hive_id)
+
+
+#RENDEZVOUS (HIGHEST RANDOM WEIGHT) HASHING: WHEN A WORKER JOINS OR LEAVES ONLY ITS OWN HIVES MOVE
+def owner_of(key, workers):
+    return max(workers, key=lambda worker: hashlib.blake2b(f"{worker}/{key}".encode(), digest_size=8).digest(),
+               default=None)
+
+
+class HivePartition:
+    """Decides which hives this process handles and keeps their leases.
+
+    Use it as the Handler's queue (add() only lets owned hives through),
+    wrap the dispatcher's handler with wrap(), and start() the balancer.
+    `on_acquire(key)` runs when a hive is taken over, before any of its
+    files are queued; `classify(path)` returns (kind, hive_id).
+    """
+
+    def __init__(self, folder, queue, classify, on_acquire=None, lease_dir=LEASE_DIR, worker_id=WORKER_ID,
+                 heartbeat=HEARTBEAT_SECONDS, ttl=LEASE_TTL):
+        self.folder = folder
+        self.queue = queue
+        self.classify = classify
+        self.on_acquire = on_acquire
+        self.worker_id = worker_id
+        self.heartbeat = heartbeat
+        self.ttl = ttl
+        self._workers_dir = os.path.join(lease_dir, "workers")
+        self._hives_dir = os.path.join(lease_dir, "hives")
+        os.makedirs(self._workers_dir, exist_ok=True)
+        os.makedirs(self._hives_dir, exist_ok=True)
+        os.makedirs(ingest_ledger.STATE_DIR, exist_ok=True)
+        if filesystem_of(ingest_ledger.STATE_DIR) in NETWORK_FILESYSTEMS:
+            print(f"WARNING: INGEST_STATE_DIR {ingest_ledger.STATE_DIR} is on a network filesystem, "
+                  f"keep it on local disk and share only INGEST_LEASE_DIR")
+        self._held = set()
+        self._busy = Counter()  # key -> files of that hive running now
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="hive-partition", daemon=True)
+
+    # --- ownership -------------------------------------------------------------------------
+
+    def _key_of(self, path):
+        return hive_key(self.classify(path)[1])
+
+    def owns(self, key):
+        with self._lock:
+            return key in self._held
+
+    def held(self):
+        with self._lock:
+            return len(self._held)
+
+    #WATCHER EVENTS OF HIVES OWNED ELSEWHERE ARE DROPPED, THEIR OWNER SEES THEM OR RESCANS
+    def add(self, path, closed=False):
+        if self.owns(self._key_of(path)):
+            self.queue.add(path, closed)
+
+    #RUNS handle(path) ONLY WHILE THE HIVE IS STILL HELD, THE HIVE CANNOT BE RELEASED MEANWHILE
+    def wrap(self, handle):
+        def handle_owned(path):
+            key = self._key_of(path)
+            with self._lock:
+                if key not in self._held:
+                    print(f"Leaving {os.path.basename(path)}: hive {key} is now handled by another watcher")
+                    return
+                self._busy[key] += 1
+            return self._hold(key, handle, path)
+        return handle_owned
+
+    def _hold(self, key, step, *args):
+        #RUNS ONE STEP OF A FILE OF HIVE key, WHICH STAYS BUSY UNTIL ITS LAST STEP (SEE ingest_dispatcher.Pending)
+        try:
+            result = step(*args)
+        except BaseException:
+            self._done(key)
+            raise
+        if result is None:
+            self._done(key)
+            return None
+        return Pending(result.future, lambda future: self._hold(key, result.then, future))
+
+    def _done(self, key):
+        with self._lock:
+            self._busy[key] -= 1
+            if not self._busy[key]:
+                del self._busy[key]
+
+    # --- files -------------------------------------------------------------------------------
+
+    def _heartbeat_path(self):
+        return os.path.join(self._workers_dir, f"{self.worker_id}.alive")
+
+    def _lease_path(self, key):
+        return os.path.join(self._hives_dir, f"{key}.lease")
+
+    def _fresh(self, path, now):
+        try:
+            return now - os.stat(path).st_mtime < self.ttl
+        except FileNotFoundError:
+            return False
+
+    def live_workers(self):
+        now = time.time()
+        workers = []
+        for entry in os.scandir(self._workers_dir):
+            if entry.name.endswith(".alive") and self._fresh(entry.path, now):
+                workers.append(entry.name[:-len(".alive")])
+        if self.worker_id not in workers:
+            workers.append(self.worker_id)
+        return workers
+
+    def _read_lease(self, path):
+        try:
+            with open(path) as lease:
+                return json.load(lease).get("worker")
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _create_lease(self, key):
+        fd = os.open(self._lease_path(key), os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+        with os.fdopen(fd, "w") as lease:
+            json.dump({"worker": self.worker_id, "host": socket.gethostname(), "pid": os.getpid()}, lease)
+
+    def try_acquire(self, key, live):
+        path = self._lease_path(key)
+        try:
+            self._create_lease(key)
+            return True
+        except FileExistsError:
+            pass
+        holder = self._read_lease(path)
+        if holder == self.worker_id:
+            return True  # ours from before a restart under the same INGEST_WORKER_ID
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            return False
+        if holder in live and time.time() - st.st_mtime < self.ttl:
+            return False
+        #STALE: MOVE IT ASIDE (ONLY ONE PROCESS'S RENAME SUCCEEDS), THEN CREATE OURS
+        aside = f"{path}.{self.worker_id}.stale"
+        try:
+            os.rename(path, aside)
+        except FileNotFoundError:
+            return False
+        moved = os.stat(aside)
+        if (moved.st_ino, moved.st_mtime) != (st.st_ino, st.st_mtime):
+            #SOMEONE ELSE TOOK IT OVER IN BETWEEN, PUT THEIR FRESH LEASE BACK
+            try:
+                os.link(aside, path)
+            except FileExistsError:
+                pass
+            os.remove(aside)
+            return False
+        os.remove(aside)
+        print(f"Taking over hive {key} from {holder or 'an unknown watcher'}")
+        try:
+            self._create_lease(key)
+            return True
+        except FileExistsError:
+            return False
+
+    def release(self, key):
+        path = self._lease_path(key)
+        if self._read_lease(path) == self.worker_id:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    # --- balancing ---------------------------------------------------------------------------
+
+    def _pending_files(self):
+        files = {}
+        for entry in sorted(os.scandir(self.folder), key=lambda entry: entry.name):
+            if entry.is_file():
+                files.setdefault(self._key_of(entry.path), []).append(entry.path)
+        return files
+
+    def balance(self):
+        now = time.time()
+        with open(self._heartbeat_path(), "a"):
+            os.utime(self._heartbeat_path(), (now, now))
+        with self._lock:
+            held = set(self._held)
+        for key in held:
+            try:
+                os.utime(self._lease_path(key), (now, now))
+            except FileNotFoundError:
+                pass
+
+        live = self.live_workers()
+        files = self._pending_files()
+
+        #HIVES THAT SHOULD NOW BE SOMEONE ELSE'S ARE HANDED BACK ONCE NONE OF THEIR FILES IS RUNNING
+        for key in held:
+            if self._read_lease(self._lease_path(key)) != self.worker_id:
+                #TAKEN OVER WHILE THIS PROCESS WAS STALLED PAST THE TTL
+                with self._lock:
+                    self._held.discard(key)
+                print(f"Lost the lease of hive {key}")
+            elif owner_of(key, live) != self.worker_id:
+                with self._lock:
+                    if self._busy[key]:
+                        continue
+                    self._held.discard(key)
+                self.release(key)
+                print(f"Handed hive {key} over")
+
+        for key, paths in files.items():
+            if key not in held and owner_of(key, live) == self.worker_id and self.try_acquire(key, live):
+                if self.on_acquire is not None:
+                    self.on_acquire(key)
+                with self._lock:
+                    self._held.add(key)
+                for path in paths:
+                    self.queue.forget(path)
+            if self.owns(key):
+                #RESCAN, FILE SYSTEM EVENTS ARE NOT RAISED FOR FILES WRITTEN FROM OTHER MACHINES
+                for path in paths:
+                    self.queue.add(path)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.balance()
+            except Exception:
+                traceback.print_exc()
+            self._stopping.wait(self.heartbeat)
+
+    def start(self):
+        self.balance()
+        self._thread.start()
+
+    def stop(self):
+        #CALLED AFTER THE DISPATCHER HAS DRAINED, EVERY LEASE CAN GO
+        self._stopping.set()
+        self._thread.join()
+        with self._lock:
+            held, self._held = self._held, set()
+        for key in held:
+            self.release(key)
+        try:
+            os.remove(self._heartbeat_path())
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,384 @@
+ #THIS FILE BENCHMARKS THE MEDIA WATCHER BEFORE IT IS DEPLOYED. IT WRITES A BURST OF
+ #SYNTHETIC HIVE FILES (N HIVES x M FILES OF EACH KIND) INTO A TEMPORARY ARRIVAL FOLDER,
+ #INGESTS THEM THROUGH register_media AGAINST A LOCAL SQLITE STAND-IN FOR MYSQL AND
+ #REPORTS FILES/S, ROWS/S AND p50/p95/p99 LATENCY FROM ARRIVAL TO DONE. i.e
+ #   python ingest_benchmark.py --hives 20 --files 10 --strategies serial,pooled,batched
+ #THE STAND-IN ADDS A FIXED DELAY PER STATEMENT/COMMIT (--db-latency-ms) AND PER NEW
+ #CONNECTION (--connect-ms) SO ROUND TRIPS COST SOMETHING, AS THEY DO WITH A REAL SERVER.
+ #FILES ARE HANDED STRAIGHT TO THE PIPELINE, THE ARRIVAL QUEUE SETTLE DELAY IS NOT MEASURED.
+ #THE STRATEGIES ONLY DIFFER IN WORKER POOLS, CONNECTION POOLING AND MEDIA ROW BATCHING;
+ #EVERY ONE OF THEM LOADS SENSOR CSVS THROUGH THE SAME BATCHED INSERTS.
+import os
+import re
+import io
+import sys
+import json
+import time
+import wave
+import queue
+import random
+import sqlite3
+import argparse
+import tempfile
+import threading
+import contextlib
+
+STRATEGIES = ("serial", "pooled", "batched")
+
+SCHEMA = (
+    "CREATE TABLE {media} (id INTEGER PRIMARY KEY, path TEXT, hive_id INTEGER, created_at TEXT, detected_bees INTEGER)",
+    "CREATE TABLE {sensor} (id INTEGER PRIMARY KEY, hive_id INTEGER, record REAL, created_at TEXT)",
+    "CREATE TABLE hive_vibration_features (id INTEGER PRIMARY KEY, hive_id INTEGER, path TEXT UNIQUE, sidecar TEXT,"
+    " sample_rate REAL, samples INTEGER, rms REAL, peak_frequency REAL, band_energies TEXT, created_at TEXT)",
+    "CREATE TABLE hive_audio_features (id INTEGER PRIMARY KEY, hive_id INTEGER, path TEXT UNIQUE, sidecar TEXT,"
+    " sample_rate INTEGER, channels INTEGER, duration REAL, rms REAL, peak_amplitude REAL,"
+    " dominant_frequency REAL, band_energies TEXT, created_at TEXT)",
+)
+MEDIA_TABLES = ("hive_photos", "hive_audios", "hive_videos", "hive_vibrations")
+SENSOR_TABLES = ("hive_temperatures", "hive_humidity", "hive_carbondioxide", "hive_weights")
+
+
+class StandInError(Exception):
+    def __init__(self, msg, errno=None):
+        super().__init__(msg)
+        self.errno = errno
+
+
+class _Cursor:
+    """Runs the pipeline's MySQL statements on SQLite."""
+
+    _upsert = re.compile(r"ON DUPLICATE KEY UPDATE (.*)$", re.S)
+
+    def __init__(self, conn, latency):
+        self._cursor = conn.cursor()
+        self._latency = latency
+        self.rowcount = 0
+
+    def _translate(self, query):
+        if query.startswith("LOAD DATA"):
+            #ER_NOT_ALLOWED_COMMAND, THE SENSOR LOADER FALLS BACK TO BATCHED INSERTS
+            raise StandInError("LOAD DATA is not supported by the SQLite stand-in", errno=1148)
+        match = self._upsert.search(query)
+        if match:
+            updates = re.sub(r"VALUES\((\w+)\)", r"excluded.\1", match.group(1))
+            query = query[:match.start()] + f"ON CONFLICT(path) DO UPDATE SET {updates}"
+        return query.replace("%s", "?")
+
+    def execute(self, query, data=()):
+        time.sleep(self._latency)
+        self._cursor.execute(self._translate(query), tuple(data))
+        self.rowcount = self._cursor.rowcount
+
+    def executemany(self, query, rows):
+        time.sleep(self._latency)
+        self._cursor.executemany(self._translate(query), [tuple(row) for row in rows])
+        self.rowcount = self._cursor.rowcount
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def close(self):
+        self._cursor.close()
+
+
+class _Connection:
+    def __init__(self, stand_in, conn):
+        self._stand_in = stand_in
+        self._conn = conn
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def cursor(self, **kwargs):
+        return _Cursor(self._conn, self._stand_in.latency)
+
+    def commit(self):
+        time.sleep(self._stand_in.latency)
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def ping(self, **kwargs):
+        pass
+
+    def is_connected(self):
+        return True
+
+    def close(self):
+        self._stand_in.release(self._conn)
+
+
+class SQLiteStandIn:
+    """Local database that db_pool.get_connection() is pointed at.
+
+    With `pooled` connections are reused like db_pool does, without it
+    every get_connection() pays `connect_latency`, like the old code that
+    opened a new MySQL connection per file.
+    """
+
+    def __init__(self, path, latency=0.001, connect_latency=0.005, pooled=True):
+        self.path = path
+        self.latency = latency
+        self.connect_latency = connect_latency
+        self.pooled = pooled
+        self._idle = queue.LifoQueue()
+        conn = sqlite3.connect(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        for table in MEDIA_TABLES:
+            conn.execute(SCHEMA[0].format(media=table))
+        for table in SENSOR_TABLES:
+            conn.execute(SCHEMA[1].format(sensor=table))
+        for statement in SCHEMA[2:]:
+            conn.execute(statement)
+        conn.commit()
+        conn.close()
+
+    def get_connection(self):
+        try:
+            conn = self._idle.get_nowait()
+        except queue.Empty:
+            time.sleep(self.connect_latency)
+            conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        return _Connection(self, conn)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        if self.pooled:
+            self._idle.put(conn)
+        else:
+            conn.close()
+
+    def row_count(self):
+        conn = sqlite3.connect(self.path)
+        try:
+            return sum(conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+                       for table in MEDIA_TABLES + SENSOR_TABLES)
+        finally:
+            conn.close()
+
+
+#SYNTHETIC FILES ---------------------------------------------------------------
+
+def _timestamp(base, i):
+    t = time.gmtime(base + i * 7)
+    return time.strftime("%Y-%m-%d_%H%M%S", t)
+
+
+def _write_random(path, size):
+    with open(path, "wb") as f:
+        f.write(os.urandom(size))
+
+
+def _write_wav(path, size, sample_rate=16000):
+    samples = max(size // 2, 1)
+    with wave.open(path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(sample_rate)
+        w.writeframes(os.urandom(samples * 2))
+
+
+def _write_vibration(path, rows):
+    with open(path, "w") as f:
+        f.write("Frequency_X,Amplitude_Y,FFT_Amplitude_Y\n")
+        f.writelines(f"{i},{random.uniform(-1, 1):.5f},{random.random():.5f}\n" for i in range(rows))
+
+
+def _write_sensor(path, rows, base):
+    with open(path, "w") as f:
+        for i in range(rows):
+            created = time.strftime("%Y-%m-%d %H:%M:%S", time.gmtime(base + i * 60))
+            f.write(f"{created},{random.uniform(20, 36):.2f},{random.uniform(40, 90):.2f},"
+                    f"{random.uniform(400, 2000):.0f},{random.uniform(10, 40):.2f}\n")
+
+
+#WRITES THE BURST AND RETURNS THE FILE NAMES IN ARRIVAL ORDER (HIVES INTERLEAVED)
+def generate(folder, args):
+    base = int(time.time()) - 86400 + random.randint(0, 3600)
+    names = []
+    for i in range(args.files):
+        stamp = _timestamp(base, i)
+        for hive in range(1, args.hives + 1):
+            if "image" in args.kinds:
+                names.append((f"{hive}_{stamp}.jpg", lambda p: _write_random(p, args.image_kb * 1024)))
+            if "audio" in args.kinds:
+                names.append((f"{hive}_{stamp}.wav", lambda p: _write_wav(p, args.audio_kb * 1024)))
+            if "video" in args.kinds:
+                names.append((f"{hive}_{stamp}.mp4", lambda p: _write_random(p, args.video_kb * 1024)))
+            if "vibration" in args.kinds:
+                names.append((f"vibration_{hive}_{stamp}.csv", lambda p: _write_vibration(p, args.vibration_rows)))
+    if "sensor" in args.kinds:
+        #ONE <hive>.csv PER HIVE, THE PIS UPLOAD A SINGLE ROLLING FILE
+        for hive in range(1, args.hives + 1):
+            names.append((f"{hive}.csv", lambda p: _write_sensor(p, args.sensor_rows, base)))
+    for filename, write in names:
+        write(os.path.join(folder, filename))
+    return [filename for filename, _ in names]
+
+
+#ONE RUN -----------------------------------------------------------------------
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def run(strategy, args, workdir):
+    import db_pool
+    import media_batcher
+    import register_media
+    import ingest_ledger
+    import ingest_journal
+    from ingest_dispatcher import IngestDispatcher, Pending, run_steps
+    from spill_queue import SpillQueue
+
+    root = tempfile.mkdtemp(prefix=f"{strategy}_", dir=workdir)
+    arrival = os.path.join(root, "arriving")
+    os.makedirs(arrival)
+    for module in (register_media.register_hiveimages, register_media.register_hiveaudios,
+                   register_media.register_hivevideos, register_media.register_hivevibration):
+        module.folder_destination = os.path.join(root, module.table)
+
+    #FRESH LEDGER/JOURNAL AND DATABASE PER RUN
+    ingest_ledger._conn = None
+    ingest_ledger.LEDGER_PATH = os.path.join(root, "ledger.sqlite3")
+    ingest_journal._conn = None
+    ingest_journal.JOURNAL_PATH = os.path.join(root, "journal.sqlite3")
+    stand_in = SQLiteStandIn(os.path.join(root, "db.sqlite3"), args.db_latency_ms / 1000,
+                             args.connect_ms / 1000, pooled=strategy != "serial")
+    db_pool.get_connection = stand_in.get_connection
+
+    if strategy == "batched":
+        media_batcher.WINDOW_SECONDS = args.batch_window_ms / 1000
+        media_batcher._batcher = media_batcher.MediaBatcher(window=media_batcher.WINDOW_SECONDS)
+    else:
+        media_batcher.WINDOW_SECONDS = 0
+
+    names = generate(arrival, args)
+    latencies = []
+    lock = threading.Lock()
+    arrived = {}
+
+    #A FILE'S LATENCY ENDS WITH ITS LAST STEP, i.e THE MOVE ONCE ITS BATCH HAS COMMITTED
+    def until_done(path, result):
+        if result is not None:
+            return Pending(result.future, lambda future: until_done(path, result.then(future)))
+        done = time.perf_counter()
+        with lock:
+            latencies.append(done - arrived[path])
+        return None
+
+    def handle(path):
+        return until_done(path, register_media.dispatch_path(path))
+
+    log = io.StringIO() if not args.verbose else sys.stdout
+    start = time.perf_counter()
+    #FILE i ARRIVES AT start + i / rate, ALL AT start FOR A BURST
+    for i, filename in enumerate(names):
+        arrived[os.path.join(arrival, filename)] = start + (i / args.rate if args.rate else 0)
+
+    def wait_for_arrival(path):
+        delay = arrived[path] - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+
+    with contextlib.redirect_stdout(log):
+        if strategy == "serial":
+            for filename in names:
+                path = os.path.join(arrival, filename)
+                wait_for_arrival(path)
+                run_steps(handle(path))
+        else:
+            dispatcher = IngestDispatcher(handle, register_media.classify_path,
+                                          spill=SpillQueue(os.path.join(root, "spill.sqlite3")))
+            for filename in names:
+                path = os.path.join(arrival, filename)
+                wait_for_arrival(path)
+                dispatcher.submit(path)
+            dispatcher.shutdown()
+    elapsed = time.perf_counter() - start
+
+    rows = stand_in.row_count()
+    return {
+        "strategy": strategy,
+        "files": len(names),
+        "rows": rows,
+        "seconds": elapsed,
+        "files_per_s": len(names) / elapsed,
+        "rows_per_s": rows / elapsed,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+        "left_behind": len(os.listdir(arrival)),
+    }
+
+
+def report(results):
+    header = f"{'strategy':<10}{'files':>7}{'rows':>9}{'seconds':>9}{'files/s':>10}{'rows/s':>11}" \
+             f"{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}"
+    print(header)
+    print("-" * len(header))
+    for r in results:
+        print(f"{r['strategy']:<10}{r['files']:>7}{r['rows']:>9}{r['seconds']:>9.2f}{r['files_per_s']:>10.1f}"
+              f"{r['rows_per_s']:>11.1f}{r['p50_ms']:>9.1f}{r['p95_ms']:>9.1f}{r['p99_ms']:>9.1f}")
+        if r["left_behind"]:
+            print(f"  {r['left_behind']} files were not ingested, rerun with --verbose to see why")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Synthetic upload-burst benchmark for the media watcher")
+    parser.add_argument("--hives", type=int, default=10)
+    parser.add_argument("--files", type=int, default=5, help="files of each kind per hive")
+    parser.add_argument("--kinds", default="image,audio,video,vibration,sensor")
+    parser.add_argument("--strategies", default=",".join(STRATEGIES),
+                        help="serial: one file at a time and a new connection per use, sensor CSVs "
+                             "are still inserted in batches; "
+                             "pooled: worker pools and pooled connections; "
+                             "batched: pooled plus batched media inserts")
+    parser.add_argument("--image-kb", type=int, default=200)
+    parser.add_argument("--audio-kb", type=int, default=320)
+    parser.add_argument("--video-kb", type=int, default=2048)
+    parser.add_argument("--vibration-rows", type=int, default=2000)
+    parser.add_argument("--sensor-rows", type=int, default=1440)
+    parser.add_argument("--rate", type=float, default=0, help="arrivals per second, 0 for one burst")
+    parser.add_argument("--db-latency-ms", type=float, default=1.0, help="added to every statement and commit")
+    parser.add_argument("--connect-ms", type=float, default=5.0, help="added to every new connection")
+    parser.add_argument("--batch-window-ms", type=float, default=50)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", action="store_true", help="print the results as JSON")
+    parser.add_argument("--verbose", action="store_true", help="show the pipeline's own output")
+    args = parser.parse_args(argv)
+    args.kinds = set(args.kinds.split(","))
+    args.strategies = [s for s in args.strategies.split(",") if s]
+    for strategy in args.strategies:
+        if strategy not in STRATEGIES:
+            parser.error(f"unknown strategy {strategy}, choose from {', '.join(STRATEGIES)}")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    with tempfile.TemporaryDirectory(prefix="ingest_benchmark_") as workdir:
+        #KEEP THE BENCHMARK AWAY FROM THE REAL STATE DIRECTORY, THUMBNAILS AND METRICS PORT
+        os.environ["INGEST_STATE_DIR"] = os.path.join(workdir, "state")
+        os.environ["DERIVATIVE_ROOT"] = os.path.join(workdir, "thumbs")
+        import media_derivatives
+        media_derivatives.submit = lambda *a, **k: False
+        results = [run(strategy, args, workdir) for strategy in args.strategies]
+    if args.json:
+        print(json.dumps(results, indent=2))
+    else:
+        report(results)
+
+
+if __name__ == "__main__":
+    main()
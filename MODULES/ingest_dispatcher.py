@@ -0,0 +1,191 @@
+ #THIS FILE RUNS THE REGISTER_* HANDLERS ON BOUNDED WORKER POOLS,
+ #ONE POOL PER MEDIA TYPE, SO A SLOW VIDEO MOVE DOES NOT HOLD UP CSVS
+ #AND IMAGES. FILES OF THE SAME TYPE FROM THE SAME HIVE STAY IN ORDER.
+import os
+import threading
+import traceback
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from spill_queue import SpillQueue
+
+#DEFAULT NUMBER OF WORKERS PER MEDIA TYPE, OVERRIDE WITH INGEST_WORKERS_<TYPE>
+DEFAULT_LIMITS = {
+    "audio": 2,
+    "video": 2,
+    "image": 4,
+    "vibration": 2,
+    "sensor": 2,
+    "other": 1,
+}
+
+
+#FILES HELD IN MEMORY BEFORE NEW ARRIVALS SPILL TO DISK, AND WHERE THE saturated SIGNAL
+#IS RAISED (DEFAULT 80% OF INGEST_MAX_PENDING)
+MAX_PENDING = int(os.getenv("INGEST_MAX_PENDING", "1000"))
+HIGH_WATERMARK = int(os.getenv("INGEST_HIGH_WATERMARK", "0"))
+
+
+#WHAT A HANDLER RETURNS WHEN ITS FILE IS NOT DONE YET: ONCE future IS DONE, then(future) RUNS
+#ON A WORKER AS THE NEXT STEP OF THE SAME FILE, AND MAY ITSELF RETURN A Pending
+Pending = namedtuple("Pending", "future then")
+
+
+#RUNS THE REMAINING STEPS OF A HANDLER'S RESULT ON THE CALLING THREAD, WAITING FOR EACH FUTURE
+def run_steps(result):
+    while result is not None:
+        result.future.result()
+        result = result.then(result.future)
+
+
+def limits_from_env():
+    return {kind: int(os.getenv(f"INGEST_WORKERS_{kind.upper()}", default))
+            for kind, default in DEFAULT_LIMITS.items()}
+
+
+class IngestDispatcher:
+    """Fan arrived files out to per-media-type thread pools.
+
+    `classify(path)` returns a (kind, hive_id) pair. Each (kind, hive_id)
+    lane starts one file at a time, the rest wait in arrival order. A
+    handler that returns a Pending (i.e a row waiting for its batch to
+    commit) lets the next file of its lane start, and its next step runs
+    on the same pool once the future is done, without holding a worker
+    meanwhile.
+    At most `max_pending` files are held in memory, later ones wait in an
+    on-disk SpillQueue until there is room. `saturated` is set while the
+    in-memory count is at or over `high_watermark`. `on_error(path)` is
+    called when `handle` raises.
+    """
+
+    def __init__(self, handle, classify, limits=None, max_pending=None, high_watermark=None, spill=None,
+                 on_error=None):
+        self.handle = handle
+        self.classify = classify
+        self.on_error = on_error
+        limits = limits or limits_from_env()
+        self._pools = {kind: ThreadPoolExecutor(max_workers=max(1, n), thread_name_prefix=f"ingest-{kind}")
+                       for kind, n in limits.items()}
+        self.max_pending = max(1, max_pending or MAX_PENDING)
+        self.high_watermark = min(high_watermark or HIGH_WATERMARK or self.max_pending * 4 // 5 or 1, self.max_pending)
+        self.saturated = threading.Event()
+        self._spill = spill if spill is not None else SpillQueue()
+        self._lanes = {}  # (kind, hive_id) -> deque of waiting paths
+        self._queued = set()  # paths held in memory, queued or running
+        self._outstanding = 0
+        self._closed = False
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+
+    def _pool_for(self, kind):
+        return self._pools.get(kind) or self._pools["other"]
+
+    def _admit(self, path):
+        #CALLED WITH THE LOCK HELD, RETURNS THE (lane, path) TO START NOW OR None IF IT HAS TO WAIT ITS TURN
+        lane = self.classify(path)
+        self._queued.add(path)
+        self._outstanding += 1
+        if lane in self._lanes:
+            self._lanes[lane].append(path)
+            return None
+        self._lanes[lane] = deque()
+        return lane, path
+
+    def _watermark(self):
+        #CALLED WITH THE LOCK HELD
+        if self._outstanding >= self.high_watermark:
+            if not self.saturated.is_set():
+                self.saturated.set()
+                print(f"Ingest backlog over its high watermark: {self._outstanding} files in memory, more spill to disk past {self.max_pending}")
+        elif self.saturated.is_set() and self._outstanding < self.high_watermark // 2 and not len(self._spill):
+            self.saturated.clear()
+            print("Ingest backlog drained")
+
+    def _start(self, started):
+        for lane, path in started:
+            self._pool_for(lane[0]).submit(self._run, lane, path)
+
+    def submit(self, path):
+        started = []
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("dispatcher is shut down")
+            if path in self._queued:
+                return
+            #ONCE FILES ARE SPILLED NEW ONES QUEUE BEHIND THEM, SO ARRIVAL ORDER HOLDS
+            if self._outstanding >= self.max_pending or len(self._spill):
+                self._spill.push(path)
+            else:
+                started.append(self._admit(path))
+            self._watermark()
+        self._start(item for item in started if item is not None)
+
+    def pending(self):
+        with self._lock:
+            return self._outstanding + len(self._spill)
+
+    def spilled(self):
+        return len(self._spill)
+
+    def _step(self, path, step):
+        #RUNS THE FIRST STEP (step None) OR THE NEXT ONE OF path, RETURNS ITS Pending OR None ONCE DONE
+        try:
+            return self.handle(path) if step is None else step.then(step.future)
+        except Exception:
+            traceback.print_exc()
+            if self.on_error is not None:
+                self.on_error(path)
+            return None
+
+    def _wait(self, lane, path, pending):
+        #THE CALLBACK RUNS ON WHATEVER THREAD COMPLETES THE FUTURE, THE STEP ITSELF GOES BACK TO THE POOL
+        pending.future.add_done_callback(lambda _: self._pool_for(lane[0]).submit(self._resume, lane, path, pending))
+
+    def _resume(self, lane, path, step):
+        pending = self._step(path, step)
+        if pending is not None:
+            self._wait(lane, path, pending)
+            return
+        self._finished(path)
+
+    def _run(self, lane, path):
+        pending = self._step(path, None)
+        started = []
+        with self._lock:
+            waiting = self._lanes[lane]
+            if waiting:
+                #RESUBMIT RATHER THAN LOOP SO OTHER HIVES GET A TURN ON THIS POOL
+                started.append((lane, waiting.popleft()))
+            else:
+                del self._lanes[lane]
+        self._start(started)
+        if pending is not None:
+            self._wait(lane, path, pending)
+            return
+        self._finished(path)
+
+    def _finished(self, path):
+        started = []
+        with self._lock:
+            self._outstanding -= 1
+            self._queued.discard(path)
+            while self._outstanding < self.max_pending:
+                spilled = self._spill.pop()
+                if spilled is None:
+                    break
+                started.append(self._admit(spilled))
+            self._watermark()
+            if self._outstanding == 0:
+                self._idle.notify_all()
+        self._start(item for item in started if item is not None)
+
+    def wait_idle(self, timeout=None):
+        with self._lock:
+            return self._idle.wait_for(lambda: self._outstanding == 0, timeout)
+
+    def shutdown(self):
+        #STOP ACCEPTING FILES, FINISH EVERYTHING ALREADY QUEUED, THEN STOP THE POOLS
+        with self._lock:
+            self._closed = True
+        self.wait_idle()
+        for pool in self._pools.values():
+            pool.shutdown(wait=True)
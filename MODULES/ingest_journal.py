@@ -0,0 +1,72 @@
+ #THIS FILE KEEPS A WRITE-AHEAD JOURNAL OF EVERY FILE BEING INGESTED.
+ #EACH ENTRY GOES intent -> inserting (NO ROW FOR IT YET, THIS ATTEMPT WRITES ONE)
+ #-> committed (DB ROW WRITTEN) -> moved (FILE OUT OF THE ARRIVAL FOLDER) AND IS
+ #DELETED ONCE THE FILE IS FULLY HANDLED. A FILE WHOSE ROW ALREADY EXISTED SKIPS inserting.
+ #ENTRIES STILL PRESENT AT STARTUP ARE WORK A CRASH INTERRUPTED.
+import os
+import time
+import sqlite3
+import threading
+from ingest_ledger import STATE_DIR
+
+JOURNAL_PATH = os.path.join(STATE_DIR, "journal.sqlite3")
+
+INTENT = "intent"
+INSERTING = "inserting"
+COMMITTED = "committed"
+MOVED = "moved"
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _connection():
+    global _conn
+    if _conn is None:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        _conn = sqlite3.connect(JOURNAL_PATH, check_same_thread=False)
+        _conn.row_factory = sqlite3.Row
+        _conn.execute("PRAGMA journal_mode=WAL")
+        #EVERY STEP MUST SURVIVE A POWER CUT, NOT JUST A PROCESS CRASH
+        _conn.execute("PRAGMA synchronous=FULL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS journal ("
+            " path TEXT PRIMARY KEY,"
+            " kind TEXT NOT NULL,"
+            " hive_id TEXT,"
+            " content_hash TEXT,"
+            " stage TEXT NOT NULL,"
+            " updated_at REAL NOT NULL)"
+        )
+        _conn.commit()
+    return _conn
+
+
+def begin(path, kind, hive_id, content_hash):
+    with _lock:
+        conn = _connection()
+        conn.execute(
+            "INSERT OR REPLACE INTO journal(path, kind, hive_id, content_hash, stage, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (path, kind, None if hive_id is None else str(hive_id), content_hash, INTENT, time.time()),
+        )
+        conn.commit()
+
+
+def mark(path, stage):
+    #NO-OP FOR FILES REGISTERED OUTSIDE dispatch(), THEY HAVE NO ENTRY
+    with _lock:
+        conn = _connection()
+        conn.execute("UPDATE journal SET stage = ?, updated_at = ? WHERE path = ?", (stage, time.time(), path))
+        conn.commit()
+
+
+def finish(path):
+    with _lock:
+        conn = _connection()
+        conn.execute("DELETE FROM journal WHERE path = ?", (path,))
+        conn.commit()
+
+
+def unfinished():
+    with _lock:
+        return [dict(row) for row in _connection().execute("SELECT * FROM journal ORDER BY updated_at")]
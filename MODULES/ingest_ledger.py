@@ -0,0 +1,61 @@
+ #THIS FILE KEEPS A LOCAL SQLITE LEDGER OF EVERY FILE ALREADY INGESTED,
+ #KEYED BY HIVE ID, FILE NAME AND CONTENT HASH, SO RE-UPLOADED FILES ARE
+ #SKIPPED WITHOUT ASKING MYSQL.
+import os
+import time
+import hashlib
+import sqlite3
+import threading
+
+STATE_DIR = os.getenv("INGEST_STATE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ingest_state"))
+LEDGER_PATH = os.path.join(STATE_DIR, "ledger.sqlite3")
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _connection():
+    global _conn
+    if _conn is None:
+        os.makedirs(STATE_DIR, exist_ok=True)
+        _conn = sqlite3.connect(LEDGER_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute("PRAGMA synchronous=NORMAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS ingested ("
+            " hive_id TEXT NOT NULL,"
+            " filename TEXT NOT NULL,"
+            " content_hash TEXT NOT NULL,"
+            " kind TEXT,"
+            " ingested_at REAL NOT NULL,"
+            " PRIMARY KEY (hive_id, filename, content_hash))"
+        )
+        _conn.commit()
+    return _conn
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def seen(hive_id, filename, content_hash):
+    with _lock:
+        row = _connection().execute(
+            "SELECT 1 FROM ingested WHERE hive_id = ? AND filename = ? AND content_hash = ?",
+            (str(hive_id), filename, content_hash),
+        ).fetchone()
+    return row is not None
+
+
+def record(hive_id, filename, content_hash, kind=None):
+    with _lock:
+        conn = _connection()
+        conn.execute(
+            "INSERT OR IGNORE INTO ingested(hive_id, filename, content_hash, kind, ingested_at) VALUES (?, ?, ?, ?, ?)",
+            (str(hive_id), filename, content_hash, kind, time.time()),
+        )
+        conn.commit()
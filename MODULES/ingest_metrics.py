@@ -0,0 +1,141 @@
+ #THIS FILE KEEPS COUNTERS AND LATENCY HISTOGRAMS FOR THE MEDIA WATCHER,
+ #PER MEDIA KIND AND PER HIVE, AND SERVES THEM IN PROMETHEUS TEXT FORMAT ON
+ #http://127.0.0.1:<INGEST_METRICS_PORT>/metrics
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+#LATENCY BUCKET UPPER BOUNDS IN SECONDS
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_counters = {}    # (name, labels) -> value
+_histograms = {}  # (name, labels) -> [bucket counts..., over the last bucket, sum, count]
+_gauges = {}      # name -> (help, callable)
+_help = {
+    "ingest_files_total": "Files handled by the media watcher, by outcome",
+    "ingest_rows_total": "Rows written by the sensor CSV loader",
+    "ingest_rows_quarantined_total": "Sensor CSV rows set aside in the quarantine folder",
+    "ingest_seconds": "Time spent per ingestion stage",
+    "derivatives_total": "Thumbnails and video posters made, by outcome",
+}
+
+
+def _labels(**labels):
+    return tuple(sorted((k, "" if v is None else str(v)) for k, v in labels.items()))
+
+
+def inc(name, amount=1, **labels):
+    key = (name, _labels(**labels))
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+
+def observe(name, seconds, **labels):
+    key = (name, _labels(**labels))
+    with _lock:
+        hist = _histograms.get(key)
+        if hist is None:
+            hist = _histograms[key] = [0] * (len(BUCKETS) + 3)
+        hist[bisect.bisect_left(BUCKETS, seconds)] += 1
+        hist[-2] += seconds
+        hist[-1] += 1
+
+
+@contextmanager
+def timed(stage, kind, hive_id):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("ingest_seconds", time.perf_counter() - start, stage=stage, kind=kind, hive=hive_id)
+
+
+def gauge(name, help_text, read):
+    #read() IS CALLED AT SCRAPE TIME, i.e A QUEUE'S CURRENT LENGTH
+    with _lock:
+        _gauges[name] = (help_text, read)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+def render():
+    lines = []
+    with _lock:
+        counters = sorted(_counters.items())
+        histograms = sorted((k, list(v)) for k, v in _histograms.items())
+        gauges = sorted(_gauges.items())
+
+    seen = set()
+    for (name, labels), value in counters:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {_help.get(name, name)}")
+            lines.append(f"# TYPE {name} counter")
+        lines.append(f"{name}{_format_labels(labels)} {value}")
+
+    for (name, labels), hist in histograms:
+        if name not in seen:
+            seen.add(name)
+            lines.append(f"# HELP {name} {_help.get(name, name)}")
+            lines.append(f"# TYPE {name} histogram")
+        cumulative = 0
+        for bound, count in zip(BUCKETS, hist):
+            cumulative += count
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', str(bound))])} {cumulative}")
+        cumulative += hist[len(BUCKETS)]
+        lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {cumulative}")
+        lines.append(f"{name}_sum{_format_labels(labels)} {hist[-2]}")
+        lines.append(f"{name}_count{_format_labels(labels)} {hist[-1]}")
+
+    for name, (help_text, read) in gauges:
+        try:
+            value = read()
+        except Exception:
+            continue
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} gauge")
+        lines.append(f"{name} {value}")
+
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host="127.0.0.1"):
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="ingest-metrics", daemon=True).start()
+    return server
+
+
+def serve_from_env():
+    port = int(os.getenv("INGEST_METRICS_PORT", "9108"))
+    if port > 0:
+        return serve(port, os.getenv("INGEST_METRICS_HOST", "127.0.0.1"))
+    return None
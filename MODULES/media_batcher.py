@@ -0,0 +1,155 @@
+ #THIS FILE COLLECTS THE hive_photos/hive_audios/hive_videos/hive_vibrations
+ #ROWS OF FILES ARRIVING AT ABOUT THE SAME TIME AND WRITES EACH TABLE WITH ONE
+ #MULTI-ROW INSERT AND ONE COMMIT. submit() RETURNS A FUTURE THAT RESOLVES ONCE
+ #THE BATCH IS COMMITTED; THE DISPATCHER MOVES THE FILE AS A LATER STEP, SO NO
+ #WORKER WAITS OUT THE WINDOW AND A BATCH CAN HOLD FAR MORE ROWS THAN THERE ARE WORKERS.
+import os
+import time
+import threading
+import traceback
+from concurrent.futures import Future
+import db_pool
+import media_store
+
+#HOW LONG A BATCH STAYS OPEN AND HOW BIG IT MAY GET, A WINDOW OF 0 INSERTS EACH ROW ON ITS OWN
+WINDOW_SECONDS = float(os.getenv("MEDIA_BATCH_WINDOW_MS", "50")) / 1000
+MAX_ROWS = int(os.getenv("MEDIA_BATCH_MAX_ROWS", "500"))
+
+
+def insert_query(table):
+    return f"INSERT INTO {table}(path, hive_id, created_at) VALUES (%s, %s, %s)"
+
+
+#TRUE IF table ALREADY HAS A ROW FOR THIS FILE. THE LEDGER ONLY KNOWS THE FILES OF THIS
+#MACHINE, THIS ALSO CATCHES FILES ANOTHER WATCHER (OR THE WATCHER BEFORE THE LEDGER) STORED
+#OLDER ROWS HOLD THE BARE FILE NAME, NEWER ONES THE SHARDED PATH
+def row_exists(table, name, filename):
+    mydb = db_pool.get_connection()
+    mycursor = mydb.cursor()
+    try:
+        mycursor.execute(f"SELECT COUNT(*) FROM {table} WHERE path IN (%s, %s) AND hive_id = %s",
+                         (filename, media_store.relative_path(filename, name), name.hive_id))
+        return mycursor.fetchone()[0] > 0
+    finally:
+        mydb.close()
+
+
+#WRITES (table, data) ROWS IN ONE TRANSACTION, RETURNS ONE COMMITTED FLAG PER ROW
+def write_rows(rows):
+    by_table = {}
+    for table, data in rows:
+        by_table.setdefault(table, []).append(data)
+
+    mydb = db_pool.get_connection()
+    mycursor = mydb.cursor()
+    try:
+        try:
+            for table, table_rows in by_table.items():
+                mycursor.executemany(insert_query(table), table_rows)
+            mydb.commit()
+            return [True] * len(rows)
+        except Exception as e:
+            # A rejected row fails its whole statement, retry row by row
+            print(f"Batched insert of {len(rows)} media rows failed ({e}), retrying row by row")
+            mydb.rollback()
+            committed = []
+            for table, data in rows:
+                try:
+                    mycursor.execute(insert_query(table), data)
+                    committed.append(True)
+                except Exception as row_error:
+                    print(f"Rolling back {table} row {data}: {row_error}")
+                    committed.append(False)
+            mydb.commit()
+            return committed
+    finally:
+        mydb.close()
+
+
+class MediaBatcher:
+    """Group rows from concurrent register_* calls into batched inserts.
+
+    A batch is written `window` seconds after its first row arrives or as
+    soon as it holds `max_rows` rows, whichever comes first.
+    """
+
+    def __init__(self, window=WINDOW_SECONDS, max_rows=MAX_ROWS):
+        self.window = window
+        self.max_rows = max_rows
+        self._pending = []  # (table, data, future)
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name="media-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, table, data):
+        future = Future()
+        with self._cond:
+            self._pending.append((table, data, future))
+            if len(self._pending) == 1 or len(self._pending) >= self.max_rows:
+                self._cond.notify()
+        return future
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _next_batch(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._pending)
+            deadline = time.monotonic() + self.window
+            while len(self._pending) < self.max_rows:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            batch = self._pending[:self.max_rows]
+            del self._pending[:self.max_rows]
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                committed = write_rows([(table, data) for table, data, _ in batch])
+                for (_, _, future), ok in zip(batch, committed):
+                    future.set_result(ok)
+            except Exception as e:
+                traceback.print_exc()
+                for _, _, future in batch:
+                    future.set_exception(e)
+
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def get_batcher():
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = MediaBatcher()
+        return _batcher
+
+
+def pending():
+    return 0 if _batcher is None else _batcher.pending()
+
+
+#A FUTURE THAT IS ALREADY DONE, FOR ROWS THAT NEED NO WRITE
+def done(result):
+    future = Future()
+    future.set_result(result)
+    return future
+
+
+#QUEUES ONE MEDIA ROW WITHOUT WAITING, THE FUTURE RESOLVES TO TRUE ONCE IT IS COMMITTED
+#WITH A WINDOW OF 0 THE ROW IS WRITTEN RIGHT AWAY AND THE FUTURE IS ALREADY DONE
+def submit(table, data):
+    if WINDOW_SECONDS <= 0:
+        return done(write_rows([(table, data)])[0])
+    return get_batcher().submit(table, data)
+
+
+#INSERTS ONE MEDIA ROW, RETURNS TRUE ONCE IT IS COMMITTED
+def insert(table, data):
+    return submit(table, data).result()
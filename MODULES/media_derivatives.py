@@ -0,0 +1,236 @@
+ #THIS FILE MAKES THE SMALL WEB COPIES OF INGESTED MEDIA IN THE BACKGROUND:
+ #RESIZED jpg/webp THUMBNAILS OF HIVE IMAGES AND A KEYFRAME POSTER (PLUS AN OPTIONAL
+ #LOW BITRATE PREVIEW) OF HIVE VIDEOS, UNDER public/hivethumbs/<image|video>/<shard>/.
+ #register_hiveimages/videos HAND FILES OVER AFTER THEIR MOVE AND NEVER WAIT ON IT.
+ #WORK ALREADY DONE FOR THE SAME FILE CONTENT IS SKIPPED.
+ #RUN THIS FILE DIRECTLY TO BACKFILL DERIVATIVES FOR FILES INGESTED BEFORE.
+ #NEEDS Pillow FOR IMAGES AND ffmpeg FOR VIDEOS, WITHOUT THEM THAT KIND IS SKIPPED
+import os
+import sys
+import time
+import queue
+import shutil
+import sqlite3
+import threading
+import traceback
+import subprocess
+import ingest_ledger
+import ingest_metrics
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional
+    Image = None
+
+DERIVATIVE_ROOT = os.getenv("DERIVATIVE_ROOT", r"/var/www/html/ademnea_website/public/hivethumbs")
+WORKERS = int(os.getenv("DERIVATIVE_WORKERS", "2"))
+QUEUE_SIZE = int(os.getenv("DERIVATIVE_QUEUE_SIZE", "1000"))
+
+#LONGEST SIDE OF EACH IMAGE THUMBNAIL, WIDTH OF THE VIDEO POSTER
+THUMB_SIZES = tuple(int(size) for size in os.getenv("DERIVATIVE_THUMB_SIZES", "320,960").split(","))
+POSTER_WIDTH = int(os.getenv("DERIVATIVE_POSTER_WIDTH", "640"))
+VIDEO_PREVIEW = os.getenv("DERIVATIVE_VIDEO_PREVIEW", "0") == "1"
+FFMPEG = os.getenv("FFMPEG", "ffmpeg")
+
+STATE_PATH = os.path.join(ingest_ledger.STATE_DIR, "derivatives.sqlite3")
+
+_conn = None
+_lock = threading.Lock()
+
+
+def _connection():
+    global _conn
+    if _conn is None:
+        os.makedirs(ingest_ledger.STATE_DIR, exist_ok=True)
+        _conn = sqlite3.connect(STATE_PATH, check_same_thread=False)
+        _conn.execute("PRAGMA journal_mode=WAL")
+        _conn.execute(
+            "CREATE TABLE IF NOT EXISTS derived ("
+            " output TEXT PRIMARY KEY,"
+            " content_hash TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        _conn.commit()
+    return _conn
+
+
+#TRUE IF output WAS MADE FROM A SOURCE WITH THIS content_hash AND IS STILL ON DISK
+def is_done(output, content_hash):
+    with _lock:
+        row = _connection().execute("SELECT content_hash FROM derived WHERE output = ?", (output,)).fetchone()
+    return row is not None and row[0] == content_hash and os.path.exists(output)
+
+
+def mark_done(output, content_hash):
+    with _lock:
+        conn = _connection()
+        conn.execute("INSERT OR REPLACE INTO derived(output, content_hash, created_at) VALUES (?, ?, ?)",
+                     (output, content_hash, time.time()))
+        conn.commit()
+
+
+#OUTPUT PATH FOR ONE DERIVATIVE, i.e hivethumbs/image/2/2024/06/2_2024-06-17_122920_320.webp
+def output_path(kind, relative_path, suffix):
+    stem = os.path.splitext(relative_path)[0]
+    return os.path.join(DERIVATIVE_ROOT, kind, *f"{stem}_{suffix}".split("/"))
+
+
+#EVERY DERIVATIVE A FILE SHOULD HAVE
+def outputs(kind, relative_path):
+    if kind == "image":
+        return [output_path("image", relative_path, f"{size}.{extension}")
+                for size in THUMB_SIZES for extension in ("jpg", "webp")]
+    return [output_path("video", relative_path, "poster.jpg")] + \
+        ([output_path("video", relative_path, "preview.mp4")] if VIDEO_PREVIEW else [])
+
+
+def _image_thumbnails(src, relative_path):
+    with Image.open(src) as original:
+        #LETS THE JPEG DECODER SCALE DOWN WHILE DECODING INSTEAD OF DECODING FULL SIZE
+        original.draft("RGB", (max(THUMB_SIZES), max(THUMB_SIZES)))
+        original = original.convert("RGB")
+        for size in THUMB_SIZES:
+            thumb = original.copy()
+            thumb.thumbnail((size, size))
+            for extension, fmt, options in (("jpg", "JPEG", {"quality": 80, "optimize": True}),
+                                            ("webp", "WEBP", {"quality": 75, "method": 4})):
+                yield output_path("image", relative_path, f"{size}.{extension}"), \
+                    (lambda partial, thumb=thumb, fmt=fmt, options=options: thumb.save(partial, fmt, **options))
+
+
+def _ffmpeg(args):
+    subprocess.run([FFMPEG, "-y", "-loglevel", "error", *args], check=True,
+                   stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+
+
+def _video_derivatives(src, relative_path):
+    #-skip_frame nokey DECODES KEYFRAMES ONLY, THE FIRST ONE BECOMES THE POSTER
+    yield output_path("video", relative_path, "poster.jpg"), lambda partial: _ffmpeg([
+        "-skip_frame", "nokey", "-i", src, "-frames:v", "1", "-vsync", "0",
+        "-vf", f"scale={POSTER_WIDTH}:-2", "-q:v", "4", "-f", "image2", partial])
+    if VIDEO_PREVIEW:
+        yield output_path("video", relative_path, "preview.mp4"), lambda partial: _ffmpeg([
+            "-i", src, "-an", "-vf", "scale=-2:360", "-c:v", "libx264", "-preset", "veryfast",
+            "-crf", "32", "-movflags", "+faststart", "-f", "mp4", partial])
+
+
+def available(kind):
+    if kind == "image":
+        return Image is not None
+    if kind == "video":
+        return shutil.which(FFMPEG) is not None
+    return False
+
+
+#MAKES EVERY MISSING DERIVATIVE OF ONE FILE, EACH WRITTEN TO A .part FILE AND RENAMED INTO PLACE
+def derive(kind, src, relative_path):
+    content_hash = ingest_ledger.file_digest(src)
+    if all(is_done(output, content_hash) for output in outputs(kind, relative_path)):
+        return 0
+    jobs = _image_thumbnails(src, relative_path) if kind == "image" else _video_derivatives(src, relative_path)
+    made = 0
+    for output, write in jobs:
+        if is_done(output, content_hash):
+            continue
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        partial = output + ".part"
+        try:
+            write(partial)
+            os.replace(partial, output)
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+        mark_done(output, content_hash)
+        made += 1
+    return made
+
+
+class DerivativeWorker:
+    """Bounded background pool making derivatives of moved media files.
+
+    submit() never blocks: when `queue_size` files are already waiting the
+    file is left for the backfill run instead of stalling ingestion.
+    """
+
+    def __init__(self, workers=WORKERS, queue_size=QUEUE_SIZE):
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._warned = set()
+        self._threads = [threading.Thread(target=self._run, name=f"derivatives-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, kind, src, relative_path):
+        if not available(kind):
+            if kind not in self._warned:
+                self._warned.add(kind)
+                print(f"Not making {kind} derivatives: {'Pillow' if kind == 'image' else FFMPEG} not available")
+            return False
+        try:
+            self._queue.put_nowait((kind, src, relative_path))
+        except queue.Full:
+            ingest_metrics.inc("derivatives_total", kind=kind, result="dropped")
+            return False
+        return True
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def join(self):
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            kind, src, relative_path = self._queue.get()
+            try:
+                made = derive(kind, src, relative_path)
+                ingest_metrics.inc("derivatives_total", made, kind=kind, result="made")
+            except Exception as e:
+                print(f"Derivatives of {relative_path} failed: {e}")
+                ingest_metrics.inc("derivatives_total", kind=kind, result="failed")
+            finally:
+                self._queue.task_done()
+
+
+_worker = None
+_worker_lock = threading.Lock()
+
+
+def get_worker():
+    global _worker
+    with _worker_lock:
+        if _worker is None:
+            _worker = DerivativeWorker()
+            ingest_metrics.gauge("derivatives_pending", "Files waiting for thumbnails/posters", _worker.pending)
+        return _worker
+
+
+#QUEUES THE DERIVATIVES OF A FILE NOW STORED AT destination_folder/relative_path
+def submit(kind, destination_folder, relative_path):
+    return get_worker().submit(kind, os.path.join(destination_folder, *relative_path.split("/")), relative_path)
+
+
+#WALKS THE IMAGE AND VIDEO FOLDERS AND MAKES WHATEVER IS MISSING
+def backfill():
+    import register_hiveimages
+    import register_hivevideos
+    worker = get_worker()
+    for kind, folder, extension in (("image", register_hiveimages.folder_destination, ".jpg"),
+                                    ("video", register_hivevideos.folder_destination, ".mp4")):
+        for root, _, files in os.walk(folder):
+            for filename in files:
+                if not filename.endswith(extension):
+                    continue
+                relative = os.path.relpath(os.path.join(root, filename), folder).replace(os.sep, "/")
+                while worker.pending() >= QUEUE_SIZE:
+                    time.sleep(0.1)
+                worker.submit(kind, os.path.join(root, filename), relative)
+    worker.join()
+
+
+if __name__ == "__main__":
+    try:
+        backfill()
+    except Exception:
+        traceback.print_exc()
+        sys.exit(1)
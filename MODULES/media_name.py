@@ -0,0 +1,89 @@
+ #THIS FILE PARSES THE NAMES THE PIS GIVE THEIR MEDIA FILES, i.e
+ #2_1986-09-25_174530.006.jpg OR vibration_2_1986-09-25_174530.csv,
+ #INTO HIVE ID, TIMESTAMP, MEDIA KIND AND EXTENSION IN ONE PASS.
+ #RUN THIS FILE DIRECTLY FOR A MICRO-BENCHMARK AGAINST THE OLD PARSING.
+import re
+import sys
+import timeit
+from collections import namedtuple
+from datetime import datetime
+
+#POSITIONAL GROUPS: vibration prefix, hive id, date, hour, minute, second, .fraction, extension
+NAME_PATTERN = re.compile(
+    r"(?:(vibration)_)?"
+    r"(\d+)_"
+    r"(\d{4}-\d{2}-\d{2})_"
+    r"(\d{2})(\d{2})(\d{2})(\.\d{1,6})?"
+    r"\.(jpg|wav|mp4|csv)"
+)
+
+KINDS = {"jpg": "image", "wav": "audio", "mp4": "video"}
+
+
+class MediaName(namedtuple("MediaName", "hive_id created_at kind extension")):
+    __slots__ = ()
+
+    #created_at AS THE DATABASE GETS IT, i.e 1986-09-25 17:45:30.006, WITH EVERY DIGIT OF THE FRACTION
+    @property
+    def timestamp(self):
+        if self.created_at.microsecond:
+            return self.created_at.isoformat(sep=" ", timespec="microseconds").rstrip("0")
+        return self.created_at.isoformat(sep=" ", timespec="seconds")
+
+
+#MEDIA KIND FROM THE PREFIX AND EXTENSION ALONE, None FOR ANY OTHER FILE (i.e SENSOR CSVS),
+#THE REST OF THE NAME IS ONLY CHECKED BY parse()
+def kind_of(filename):
+    extension = filename.rpartition(".")[2]
+    if extension == "csv":
+        return "vibration" if filename.startswith("vibration_") else None
+    return KINDS.get(extension)
+
+
+def parse(filename):
+    match = NAME_PATTERN.fullmatch(filename)
+    if match is None:
+        raise ValueError(f"Unrecognised media file name: {filename}")
+    vibration, hive_id, date, hour, minute, second, fraction, extension = match.groups()
+    if vibration:
+        if extension != "csv":
+            raise ValueError(f"Vibration file is not a csv: {filename}")
+        kind = "vibration"
+    elif extension == "csv":
+        raise ValueError(f"CSV without a media prefix: {filename}")
+    else:
+        kind = KINDS[extension]
+    try:
+        #ONE fromisoformat() CALL IS CHEAPER THAN AN int() PER FIELD, THE FRACTION IS PADDED TO
+        #THE 6 DIGITS OLDER PYTHONS NEED
+        created_at = datetime.fromisoformat(f"{date} {hour}:{minute}:{second}{fraction.ljust(7, '0') if fraction else ''}")
+    except ValueError as e:
+        raise ValueError(f"Invalid timestamp in {filename}: {e}") from None
+    return MediaName(int(hive_id), created_at, kind, extension)
+
+
+#THE PARSING register_media.reconstruct AND THE reg() FUNCTIONS USED TO DO, KEPT FOR THE BENCHMARK
+def _legacy_parse(filename):
+    old_str = filename.split("_")[2]
+    new_str = ""
+    for i in range(0, len(old_str)):
+        if(i == 2 or i == 4):
+           new_str = new_str + ":"
+           new_str = new_str + old_str[i]
+        else:
+           new_str = new_str + old_str[i]
+    name = filename.split("_")[0] + "_" + filename.split("_")[1] + " " + new_str
+    hive_id = name.split("_")[0]
+    created_at = name.split(".jpg")[0].split("_")[1]
+    return hive_id, created_at
+
+
+def benchmark(number=200000):
+    filename = "2_1986-09-25_174530.006.jpg"
+    for label, func in (("legacy split/concat", _legacy_parse), ("compiled parser", parse)):
+        seconds = min(timeit.repeat(lambda: func(filename), number=number, repeat=5))
+        print(f"{label:>20}: {seconds / number * 1e6:.2f} us per name")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
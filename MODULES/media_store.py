@@ -0,0 +1,59 @@
+ #THIS FILE DECIDES WHERE MEDIA FILES LIVE UNDER public/hive* AND MOVES THEM THERE.
+ #FILES ARE SHARDED AS <hive_id>/<year>/<month>/<filename> SO NO SINGLE DIRECTORY
+ #GROWS WITHOUT BOUND. THE DB path COLUMN HOLDS THIS RELATIVE PATH, WHICH THE
+ #WEBSITE PREFIXES WITH THE FOLDER NAME, i.e hiveimage/2/2024/06/2_2024-06-17_122920.jpg
+import os
+import shutil
+import media_name
+
+COPY_CHUNK = 1024 * 1024
+
+
+#RELATIVE PATH OF A FILE INSIDE ITS DESTINATION FOLDER, ALWAYS WITH / SEPARATORS
+def relative_path(filename, name=None):
+    name = name or media_name.parse(filename)
+    return f"{name.hive_id}/{name.created_at:%Y}/{name.created_at:%m}/{filename}"
+
+
+#RELATIVE PATH OF A FILE DERIVED FROM filename, i.e ITS .npy SIDECAR, NEXT TO IT IN THE SAME SHARD
+def sidecar_path(filename, extension, name=None):
+    return os.path.splitext(relative_path(filename, name))[0] + extension
+
+
+#THE (path, hive_id, created_at) ROW register_* MODULES INSERT FOR A MEDIA FILE
+def media_row(name, filename):
+    return (relative_path(filename, name), name.hive_id, name.timestamp)
+
+
+def _fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+#MOVES src TO dest. A RENAME WHEN BOTH ARE ON ONE DEVICE, OTHERWISE A STREAMED
+#COPY TO A TEMPORARY NAME, FSYNC, RENAME INTO PLACE AND ONLY THEN UNLINK src
+def move_file(src, dest):
+    dest_dir = os.path.dirname(dest)
+    os.makedirs(dest_dir, exist_ok=True)
+    if os.stat(src).st_dev == os.stat(dest_dir).st_dev:
+        os.replace(src, dest)
+        return
+    partial = dest + ".part"
+    with open(src, "rb") as source, open(partial, "wb") as target:
+        shutil.copyfileobj(source, target, COPY_CHUNK)
+        target.flush()
+        os.fsync(target.fileno())
+    shutil.copystat(src, partial)
+    os.replace(partial, dest)
+    _fsync_dir(dest_dir)
+    os.unlink(src)
+
+
+#MOVES AN ARRIVED FILE INTO ITS SHARD UNDER destination_folder
+def store(filename, source_folder, destination_folder, name=None):
+    dest = os.path.join(destination_folder, *relative_path(filename, name).split("/"))
+    move_file(os.path.join(source_folder, filename), dest)
+    return dest
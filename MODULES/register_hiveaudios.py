@@ -1,44 +1,69 @@
-import shutil
-import register_media
+import os
+import media_batcher
+import media_name
+import media_store
+import ingest_journal
+import ingest_metrics
+import audio_features
 
-def insert_audio(audio, filename):
+#name IS THE PARSED media_name.MediaName OF filename, src THE ARRIVED FILE (ITS JOURNAL KEY)
+#RETURNS A FUTURE THAT RESOLVES TO TRUE ONCE THE ROW IS COMMITTED
+def insert_audio(name, filename, src):
 
-    mydb = register_media.database_connection() #connecting to db
-    mycursor = mydb.cursor() #the cursor helps us execute our queries
+    #ALREADY STORED, i.e BY THE WATCHER THAT HELD THIS HIVE BEFORE, ONLY THE FILE IS LEFT TO MOVE
+    if media_batcher.row_exists("hive_audios", name, filename):
+            print(f"Skipping insertion: {filename} already exists in hive_audios.")
+            return media_batcher.done(True)
 
-    #EXTRACTING DB DETAILS FROM NAME
-    hive_id = audio.split("_")[0]
-    created_at_withID = audio.split(".wav")[0]
-    created_at = created_at_withID.split("_")[1]
+    #FROM HERE ON A ROW FOR THIS PATH IS THIS ATTEMPT'S, recover_journal() MAY DELETE IT
+    ingest_journal.mark(src, ingest_journal.INSERTING)
 
     #DB INSERTION
-    query = "INSERT INTO hive_audios(path, hive_id, created_at) VALUES (%s, %s, %s)"
-    data  = (filename, hive_id, created_at)
+    data  = media_store.media_row(name, filename)
 
-    try:
-    # Executing the SQL command
-        mycursor.execute(query, data)
-    # Commit the changes in the database
-        mydb.commit()
-    except:
-    # Rolling back in case of error
-        mydb.rollback()
-    # Closing the connection
-    mydb.close()
+    # Batched with the rows of other files arriving at the same time,
+    # the caller does not wait for the commit
+    return media_batcher.submit("hive_audios", data)
 
 
+#ENVELOPE, BAND ENERGIES AND DOMINANT FREQUENCY GO TO A .npz SIDECAR AND A SUMMARY ROW
+#A WAV THAT CANNOT BE DECODED IS STILL REGISTERED, JUST WITHOUT FEATURES
+#ONLY CALLED ONCE THE hive_audios ROW IS COMMITTED AND THE WAV IS IN ITS SHARD, THE
+#SUMMARY ROW IS KEYED BY THE SAME path SO A REPLAY REPLACES IT INSTEAD OF ADDING ONE
+def store_features(name, filename, source_folder):
+        try:
+            with ingest_metrics.timed("features", "audio", name.hive_id):
+                row = audio_features.extract(name, filename, source_folder, folder_destination)
+                audio_features.insert_features(row)
+        except Exception as e:
+            print(f"No features for {filename}: {e}")
+
 #This function will transfer incoming files to another folder 
-def reg(filename, source_folder):
-        audio = filename
-        filename = register_media.reconstruct(filename) 
-        insert_audio(filename, audio) #insert audio path into DB 
+def transfer(filename, source_folder):
+        return media_store.store(filename, source_folder, folder_destination)
 
-        #TRANSFER TO ANOTHER FOLDER 
-        src = source_folder + '/' + audio
-        new_dest = folder_destination + '/' + audio
-        shutil.move(src, new_dest)
+#FIRST STEP OF A FILE: HANDS ITS ROW TO THE BATCHER AND RETURNS THE FUTURE OF THE COMMIT
+def submit(filename, source_folder):
+        src = source_folder + '/' + filename
+        return insert_audio(media_name.parse(filename), filename, src) #insert audio path into DB
 
-folder_destination = r"/var/www/html/ademnea_website/public/hiveaudio"
+#SECOND STEP, ONCE THE ROW IS COMMITTED: MOVES THE FILE OUT OF THE ARRIVAL FOLDER
+def store(filename, source_folder, committed):
+        src = source_folder + '/' + filename
+        name = media_name.parse(filename)
+        if not committed:
+            #NO ROW: THE FILE STAYS IN THE ARRIVAL FOLDER AND ITS JOURNAL ENTRY AT inserting
+            raise RuntimeError(f"{table} row of {filename} was not committed")
+        ingest_journal.mark(src, ingest_journal.COMMITTED)
 
+        with ingest_metrics.timed("move", "audio", name.hive_id):
+            dest = transfer(filename, source_folder)
+        ingest_journal.mark(src, ingest_journal.MOVED)
+        store_features(name, filename, os.path.dirname(dest))
+        return committed
 
+def reg(filename, source_folder):
+        return store(filename, source_folder, submit(filename, source_folder).result())
 
+table = "hive_audios"
+folder_destination = r"/var/www/html/ademnea_website/public/hiveaudio"
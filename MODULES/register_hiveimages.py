@@ -1,56 +1,58 @@
-import shutil
-import register_media
-
-def insert_photo(photo, filename):
-
-    mydb = register_media.database_connection() #connecting to db
-    mycursor = mydb.cursor() #the cursor helps us execute our queries
-
-    #EXTRACTING DB DETAILS FROM NAME
-    hive_id = photo.split("_")[0]
-    created_at_withID = photo.split(".jpg")[0]
-    created_at = created_at_withID.split("_")[1]
-
-    # Check if this photo already exists
-    check_query = "SELECT COUNT(*) FROM hive_photos WHERE path = %s AND hive_id = %s"
-    check_data = (filename, hive_id)
-    mycursor.execute(check_query, check_data)
-    exists = mycursor.fetchone()[0]
-
-    if exists > 0:
+import media_batcher
+import media_name
+import media_store
+import ingest_journal
+import ingest_metrics
+import media_derivatives
+
+#name IS THE PARSED media_name.MediaName OF filename, src THE ARRIVED FILE (ITS JOURNAL KEY)
+#RETURNS A FUTURE THAT RESOLVES TO TRUE ONCE THE ROW IS COMMITTED
+def insert_photo(name, filename, src):
+
+    # Check if this photo already exists, the ingest ledger catches most
+    # re-uploads before this, this covers photos ingested before the ledger
+    # or by the watcher that held this hive before
+    if media_batcher.row_exists("hive_photos", name, filename):
             print(f"Skipping insertion: {filename} already exists in hive_photos.")
-            mydb.close()
-            return
+            return media_batcher.done(True)
 
-    #DB INSERTION
-    query = "INSERT INTO hive_photos(path, hive_id, created_at) VALUES (%s, %s, %s)"
-    data  = (filename, hive_id, created_at)
+    #FROM HERE ON A ROW FOR THIS PATH IS THIS ATTEMPT'S, recover_journal() MAY DELETE IT
+    ingest_journal.mark(src, ingest_journal.INSERTING)
 
-
-    # Check again inside transaction to prevent race conditions
-    mycursor.execute(check_query, check_data)
-    exists = mycursor.fetchone()[0]
-
-    try:
-    # Executing the SQL command
-        mycursor.execute(query, data)
-    # Commit the changes in the database
-        mydb.commit()
-    except:
-    # Rolling back in case of error
-        mydb.rollback()
-    # Closing the connection
-    mydb.close()
+    #DB INSERTION
+    data  = media_store.media_row(name, filename)
+
+    # Batched with the rows of other files arriving at the same time,
+    # the caller does not wait for the commit
+    return media_batcher.submit("hive_photos", data)
+
+#TRANSFER TO ANOTHER FOLDER
+def transfer(filename, source_folder):
+        media_store.store(filename, source_folder, folder_destination)
+        #THUMBNAILS/POSTER ARE MADE IN THE BACKGROUND, NOT WAITED FOR
+        media_derivatives.submit("image", folder_destination, media_store.relative_path(filename))
+
+#FIRST STEP OF A FILE: HANDS ITS ROW TO THE BATCHER AND RETURNS THE FUTURE OF THE COMMIT
+def submit(filename, source_folder):
+        src = source_folder + '/' + filename
+        return insert_photo(media_name.parse(filename), filename, src) #insert image path into DB
+
+#SECOND STEP, ONCE THE ROW IS COMMITTED: MOVES THE FILE OUT OF THE ARRIVAL FOLDER
+def store(filename, source_folder, committed):
+        src = source_folder + '/' + filename
+        name = media_name.parse(filename)
+        if not committed:
+            #NO ROW: THE FILE STAYS IN THE ARRIVAL FOLDER AND ITS JOURNAL ENTRY AT inserting
+            raise RuntimeError(f"{table} row of {filename} was not committed")
+        ingest_journal.mark(src, ingest_journal.COMMITTED)
+
+        with ingest_metrics.timed("move", "image", name.hive_id):
+            transfer(filename, source_folder)
+        ingest_journal.mark(src, ingest_journal.MOVED)
+        return committed
 
 def reg(filename, source_folder):
+        return store(filename, source_folder, submit(filename, source_folder).result())
 
-        photo = filename
-        filename = register_media.reconstruct(filename)
-        insert_photo(filename, photo) #insert image path into DB
-
-        #TRANSFER TO ANOTHER FOLDER
-        src = source_folder + '/' + photo
-        new_dest = folder_destination + '/' + photo
-        shutil.move(src, new_dest)
-
+table = "hive_photos"
 folder_destination = r"/var/www/html/ademnea_website/public/hiveimage"
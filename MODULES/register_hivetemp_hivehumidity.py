@@ -1,57 +1,200 @@
 import os
 import csv
+import time
+import shutil
+import tempfile
+import db_pool
+import csv_streams
+import csv_validation
 import register_media
+import ingest_journal
+import ingest_metrics
 import traceback
 
-#inserts temperatures and humidities into database
-def insert_parameters(filename, folder_to_track):
+#ROWS SENT PER MULTI-ROW INSERT, OVERRIDE WITH SENSOR_BATCH_SIZE
+BATCH_SIZE = int(os.getenv('SENSOR_BATCH_SIZE', '1000'))
 
-    mydb = register_media.database_connection() #connecting to db 
-    mycursor = mydb.cursor() #the cursor helps us execute our queries
+#CSVS AT LEAST THIS BIG (BYTES) GO THROUGH LOAD DATA LOCAL INFILE, 0 TURNS IT OFF
+LOAD_DATA_THRESHOLD = int(os.getenv('SENSOR_LOAD_DATA_THRESHOLD', str(8 * 1024 * 1024)))
 
-    #EXTRACTING DB DETAILS FROM NAME(hiveid.csv)
-    hive_id = filename.split(".")[0]
-    filepath = folder_to_track + '/' + filename
+#SERVER/CLIENT ERRORS MEANING LOCAL INFILE IS NOT ALLOWED AT ALL
+#1148 ER_NOT_ALLOWED_COMMAND, 3948 ER_CLIENT_LOCAL_FILES_DISABLED, 2068 CR_LOAD_DATA_LOCAL_INFILE_REJECTED
+LOAD_DATA_REFUSED = (1148, 3948, 2068)
+load_data_allowed = True
 
-    #DB INSERTION
-    with open(filepath) as file_obj:
-    # Create reader object by passing the file 
-    # object to reader method
-        reader_obj = csv.reader(file_obj)
-        for row in reader_obj:
-           #row contains data in this format [time and date, temperature (C), humidity, CO2, weight]
-            query1 = "INSERT INTO hive_temperatures(hive_id, record, created_at) VALUES(%s, %s, %s)"
-            data1  = (hive_id, row[1], row[0])
-            
-            query2 = "INSERT INTO hive_humidity(hive_id, record, created_at) VALUES(%s, %s, %s)"
-            data2  = (hive_id, row[2], row[0])
-
-            query3 = "INSERT INTO hive_carbondioxide(hive_id, record, created_at) VALUES(%s, %s, %s)"
-            data3  = (hive_id, row[3], row[0])
-
-            query4 = "INSERT INTO hive_weights(hive_id, record, created_at) VALUES(%s, %s, %s)"
-            data4  = (hive_id, row[4], row[0])
+def insert_query(target):
+    names = ", ".join(["hive_id"] + [column.name for column in target.columns])
+    return f"INSERT INTO {target.table}({names}) VALUES({', '.join(['%s'] * (len(target.columns) + 1))})"
 
-            try:
-            # Executing the SQL command
-                mycursor.execute(query1, data1)
-                mycursor.execute(query2, data2)
-                mycursor.execute(query3, data3)
-                mycursor.execute(query4, data4)
-
-            # Commit the changes in the database
-                mydb.commit()
-            except:
-            # Rolling back in case of error
-                mydb.rollback()
-            # Closing the connection
+def load_data_query(target):
+    names = ", ".join(["hive_id"] + [column.name for column in target.columns])
+    return (f"LOAD DATA LOCAL INFILE %s INTO TABLE {target.table} "
+            "FIELDS TERMINATED BY ',' OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' "
+            f"LINES TERMINATED BY '\\n' ({names})")
+
+#STREAMS THE CSV INTO ONE STAGING FILE PER TABLE, RETURNS {table: staging path}
+def split_records(stream, filepath, hive_id, quarantine):
+    os.makedirs(db_pool.LOCAL_INFILE_DIR, exist_ok=True)
+    staging, handles, writers = {}, [], []
+    try:
+        for target in stream.targets:
+            fd, path = tempfile.mkstemp(prefix=f"{target.table}_{hive_id}_", suffix=".csv", dir=db_pool.LOCAL_INFILE_DIR)
+            staging[target.table] = path
+            handle = os.fdopen(fd, "w", newline="")
+            handles.append(handle)
+            writers.append(csv.writer(handle, lineterminator="\n"))
+        for records in csv_validation.validate(stream, filepath, hive_id, quarantine):
+            for record in records:
+                for writer, values in zip(writers, record):
+                    writer.writerow(values)
+    except Exception:
+        remove_staging(staging)
+        raise
+    finally:
+        for handle in handles:
+            handle.close()
+    return staging
+
+def remove_staging(staging):
+    for path in staging.values():
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+#LOAD DATA LOCAL INFILE OF EACH STAGING FILE, ALL TABLES OF THE STREAM IN ONE TRANSACTION
+def load_records(stream, filepath, hive_id, quarantine):
+    global load_data_allowed
+    staging = split_records(stream, filepath, hive_id, quarantine)
+    mydb = register_media.database_connection()
+    mycursor = mydb.cursor()
+    try:
+        loaded = {}
+        for target in stream.targets:
+            mycursor.execute(load_data_query(target), (staging[target.table],))
+            loaded[target.table] = mycursor.rowcount
+        mydb.commit()
+        for table, count in loaded.items():
+            ingest_metrics.inc("ingest_rows_total", count, table=table, path="load_data")
+    except Exception as e:
+        mydb.rollback()
+        if getattr(e, "errno", None) in LOAD_DATA_REFUSED:
+            print("LOAD DATA LOCAL INFILE is not allowed, using batched inserts from now on")
+            load_data_allowed = False
+        raise
+    finally:
         mydb.close()
+        remove_staging(staging)
 
-def reg(filename, folder_to_track):
+def use_load_data(filepath):
+    return load_data_allowed and LOAD_DATA_THRESHOLD > 0 and os.path.getsize(filepath) >= LOAD_DATA_THRESHOLD
+
+#ONE MULTI-ROW INSERT PER FULL BATCH OF A TABLE WHILE THE CSV IS READ, NOTHING IS COMMITTED HERE
+#chunks ARE LISTS OF RECORDS AS YIELDED BY csv_validation.validate, RETURNS {table: rows sent}
+def insert_batches(mycursor, stream, chunks, batch_size=BATCH_SIZE):
+    batches = [[] for _ in stream.targets]
+    sent = {target.table: 0 for target in stream.targets}
+
+    def flush(target, batch):
+        mycursor.executemany(insert_query(target), batch)
+        sent[target.table] += len(batch)
+        batch.clear()
+
+    for records in chunks:
+        for record in records:
+            for target, batch, values in zip(stream.targets, batches, record):
+                batch.append(values)
+                if len(batch) >= batch_size:
+                    flush(target, batch)
+    for target, batch in zip(stream.targets, batches):
+        if batch:
+            flush(target, batch)
+    return sent
+
+#ROW BY ROW, ROWS THE DATABASE STILL REJECTS GO TO THE QUARANTINE FILE
+def insert_rows(mycursor, stream, chunks, quarantine):
+    for records in chunks:
+        for record in records:
+            for target, data in zip(stream.targets, record):
+                try:
+                    mycursor.execute(insert_query(target), data)
+                except Exception as e:
+                    quarantine.reject(None, f"{target.table} rejected the row: {e}", data)
+
+#inserts the rows of any csv_streams stream (sensor, power, voc) into database
+#the whole file goes in as one transaction, large files through LOAD DATA
+#rows that fail validation are quarantined, every valid row is loaded
+def insert_parameters(filename, folder_to_track, batch_size=BATCH_SIZE):
+
+    #EXTRACTING DB DETAILS FROM NAME(hiveid.csv, power_hiveid.csv, ...)
+    matched = csv_streams.match(filename)
+    if matched is None:
+        raise ValueError(f"{filename} does not belong to any CSV stream")
+    stream, hive_id = matched
+    filepath = folder_to_track + '/' + filename
+
+    with csv_validation.Quarantine(filename, stream.name) as quarantine:
+        if use_load_data(filepath):
+            try:
+                load_records(stream, filepath, hive_id, quarantine)
+                return
+            except Exception as e:
+                print(f"LOAD DATA of {filename} failed ({e}), falling back to batched inserts")
+                quarantine.reset()
+
+        mydb = register_media.database_connection() #connecting to db
+        mycursor = mydb.cursor() #the cursor helps us execute our queries
+
+        try:
+            sent = insert_batches(mycursor, stream, csv_validation.validate(stream, filepath, hive_id, quarantine), batch_size)
+            mydb.commit()
+            for table, count in sent.items():
+                ingest_metrics.inc("ingest_rows_total", count, table=table, path="batched")
+        except Exception as e:
+            # A row the database rejects fails its whole batch, retry the file row by row
+            print(f"Bulk insert of {filename} failed ({e}), retrying row by row")
+            mydb.rollback()
+            quarantine.reset()
+            insert_rows(mycursor, stream, csv_validation.validate(stream, filepath, hive_id, quarantine), quarantine)
+            mydb.commit()
+        finally:
+            mydb.close()
+
+#A CSV THAT COULD NOT BE LOADED AT ALL IS KEPT WHOLE IN THE QUARANTINE FOLDER INSTEAD OF DELETED
+def quarantine_file(filename, folder_to_track):
+    os.makedirs(csv_validation.QUARANTINE_DIR, exist_ok=True)
+    stem = os.path.splitext(filename)[0]
+    dest = os.path.join(csv_validation.QUARANTINE_DIR, f"{stem}.{time.strftime('%Y%m%d-%H%M%S')}.csv")
+    shutil.move(folder_to_track + '/' + filename, dest)
+    print(f"Kept {filename} as {dest}")
+
+#DELETE THE CSV
+def transfer(filename, folder_to_track):
+    os.remove(folder_to_track + '/' + filename)
+
+#DB STEP OF reg(), A FILE THAT FAILS IS LOGGED AND QUARANTINED AFTERWARDS
+def insert(filename, folder_to_track):
     try:
-        insert_parameters(filename, folder_to_track) 
+        insert_parameters(filename, folder_to_track)
+        return True
     except:
         traceback.print_exc()
-    os.remove(folder_to_track + '/' + filename)  #DELETE THE CSV
+        return False
 
+def reg(filename, folder_to_track):
+    src = folder_to_track + '/' + filename
+    hive_id = register_media.hive_of(filename, "sensor")
+    with ingest_metrics.timed("db_insert", "sensor", hive_id):
+        committed = insert(filename, folder_to_track)
+    if committed:
+        ingest_journal.mark(src, ingest_journal.COMMITTED)
+    with ingest_metrics.timed("move", "sensor", hive_id):
+        if committed:
+            transfer(filename, folder_to_track)
+        else:
+            quarantine_file(filename, folder_to_track)
+    ingest_journal.mark(src, ingest_journal.MOVED)
+    return committed
 
+#ROWS GO TO SEVERAL TABLES KEYED BY TIME, NOT BY FILE, SO THEY CANNOT BE ROLLED BACK BY PATH
+table = None
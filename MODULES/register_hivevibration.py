@@ -1,46 +1,68 @@
-import shutil
-import register_media
+import os
+import media_batcher
+import media_name
+import media_store
+import ingest_journal
+import ingest_metrics
+import vibration_features
 
-def insert_vibration(csv, filename):
-    
-    mydb = register_media.database_connection()  # connecting to db
-    mycursor = mydb.cursor()  # the cursor helps us execute our queries
+#name IS THE PARSED media_name.MediaName OF filename, src THE ARRIVED FILE (ITS JOURNAL KEY)
+#RETURNS A FUTURE THAT RESOLVES TO TRUE ONCE THE ROW IS COMMITTED
+def insert_vibration(name, filename, src):
 
-    # EXTRACTING DB DETAILS FROM NAME
-    hive_id = csv.split("_")[0]
-    created_at_withID = csv.split(".csv")[0]
-    created_at = created_at_withID.split("_")[1]
+    #ALREADY STORED, i.e BY THE WATCHER THAT HELD THIS HIVE BEFORE, ONLY THE FILE IS LEFT TO MOVE
+    if media_batcher.row_exists("hive_vibrations", name, filename):
+            print(f"Skipping insertion: {filename} already exists in hive_vibrations.")
+            return media_batcher.done(True)
+
+    #FROM HERE ON A ROW FOR THIS PATH IS THIS ATTEMPT'S, recover_journal() MAY DELETE IT
+    ingest_journal.mark(src, ingest_journal.INSERTING)
 
     # DB INSERTION
-    query = "INSERT INTO hive_vibrations(path, hive_id, created_at) VALUES (%s, %s, %s)"
-    data = (filename, hive_id, created_at)
+    data  = media_store.media_row(name, filename)
+
+    # Batched with the rows of other files arriving at the same time,
+    # the caller does not wait for the commit
+    return media_batcher.submit("hive_vibrations", data)
 
+# PARSE THE CSV ONCE INTO A .npy SIDECAR AND STORE ITS SPECTRAL FEATURES
+# A CSV THAT CANNOT BE PARSED IS STILL REGISTERED, JUST WITHOUT FEATURES
+# ONLY CALLED ONCE THE hive_vibrations ROW IS COMMITTED AND THE CSV IS IN ITS SHARD, THE
+# FEATURE ROW IS KEYED BY THE SAME path SO A REPLAY REPLACES IT INSTEAD OF ADDING ONE
+def store_features(name, filename, source_folder):
     try:
-        # Executing the SQL command
-        mycursor.execute(query, data)
-        # Commit the changes in the database
-        mydb.commit()
-    except:
-        # Rolling back in case of error
-        mydb.rollback()
-    # Closing the connection
-    mydb.close()
+        with ingest_metrics.timed("features", "vibration", name.hive_id):
+            row = vibration_features.extract(name, filename, source_folder, folder_destination)
+            vibration_features.insert_features(row)
+    except Exception as e:
+        print(f"No features for {filename}: {e}")
 
-def reg(filename, source_folder):
+# TRANSFER TO ANOTHER FOLDER
+def transfer(filename, source_folder):
+    return media_store.store(filename, source_folder, folder_destination)
+
+#FIRST STEP OF A FILE: HANDS ITS ROW TO THE BATCHER AND RETURNS THE FUTURE OF THE COMMIT
+def submit(filename, source_folder):
+    src = source_folder + '/' + filename
+    return insert_vibration(media_name.parse(filename), filename, src) #insert csv path into DB
 
-    csv = filename
-    parts = filename.split("_")
-    if len(parts) < 4:
-        print("Error: Filename format is incorrect.")
-        return
-    transformed_filename = "_".join(parts[1:])
-    
-    filename = register_media.reconstruct(transformed_filename)  # Assuming this function reconstructs the path as needed
-    insert_vibration(filename, csv)  # insert csv path into DB
-
-    # TRANSFER TO ANOTHER FOLDER
-    src = source_folder + '/' + csv
-    new_dest = folder_destination + '/' + csv
-    shutil.move(src, new_dest)
+#SECOND STEP, ONCE THE ROW IS COMMITTED: MOVES THE FILE OUT OF THE ARRIVAL FOLDER
+def store(filename, source_folder, committed):
+    src = source_folder + '/' + filename
+    name = media_name.parse(filename)
+    if not committed:
+        #NO ROW: THE FILE STAYS IN THE ARRIVAL FOLDER AND ITS JOURNAL ENTRY AT inserting
+        raise RuntimeError(f"{table} row of {filename} was not committed")
+    ingest_journal.mark(src, ingest_journal.COMMITTED)
+
+    with ingest_metrics.timed("move", "vibration", name.hive_id):
+        dest = transfer(filename, source_folder)
+    ingest_journal.mark(src, ingest_journal.MOVED)
+    store_features(name, filename, os.path.dirname(dest))
+    return committed
+
+def reg(filename, source_folder):
+    return store(filename, source_folder, submit(filename, source_folder).result())
 
+table = "hive_vibrations"
 folder_destination = r"/var/www/html/ademnea_website/public/hivevibration"
@@ -1,40 +1,56 @@
-import shutil
-import register_media
+import media_batcher
+import media_name
+import media_store
+import ingest_journal
+import ingest_metrics
+import media_derivatives
 
-def insert_video(video, filename):
-    
-    mydb = register_media.database_connection() #connecting to db
-    mycursor = mydb.cursor() #the cursor helps us execute our queries
+#name IS THE PARSED media_name.MediaName OF filename, src THE ARRIVED FILE (ITS JOURNAL KEY)
+#RETURNS A FUTURE THAT RESOLVES TO TRUE ONCE THE ROW IS COMMITTED
+def insert_video(name, filename, src):
 
-    #EXTRACTING DB DETAILS FROM NAME
-    hive_id = video.split("_")[0]
-    created_at_withID = video.split(".mp4")[0]
-    created_at = created_at_withID.split("_")[1]
+    #ALREADY STORED, i.e BY THE WATCHER THAT HELD THIS HIVE BEFORE, ONLY THE FILE IS LEFT TO MOVE
+    if media_batcher.row_exists("hive_videos", name, filename):
+            print(f"Skipping insertion: {filename} already exists in hive_videos.")
+            return media_batcher.done(True)
+
+    #FROM HERE ON A ROW FOR THIS PATH IS THIS ATTEMPT'S, recover_journal() MAY DELETE IT
+    ingest_journal.mark(src, ingest_journal.INSERTING)
 
     #DB INSERTION
-    query = "INSERT INTO hive_videos(path, hive_id, created_at) VALUES (%s, %s, %s)"
-    data  = (filename, hive_id, created_at)
-
-    try:
-    # Executing the SQL command
-        mycursor.execute(query, data)
-    # Commit the changes in the database
-        mydb.commit()
-    except:
-    # Rolling back in case of error
-        mydb.rollback()
-    # Closing the connection
-    mydb.close()
+    data  = media_store.media_row(name, filename)
+
+    # Batched with the rows of other files arriving at the same time,
+    # the caller does not wait for the commit
+    return media_batcher.submit("hive_videos", data)
+
+#TRANSFER TO ANOTHER FOLDER
+def transfer(filename, source_folder):
+        media_store.store(filename, source_folder, folder_destination)
+        #THUMBNAILS/POSTER ARE MADE IN THE BACKGROUND, NOT WAITED FOR
+        media_derivatives.submit("video", folder_destination, media_store.relative_path(filename))
+
+#FIRST STEP OF A FILE: HANDS ITS ROW TO THE BATCHER AND RETURNS THE FUTURE OF THE COMMIT
+def submit(filename, source_folder):
+        src = source_folder + '/' + filename
+        return insert_video(media_name.parse(filename), filename, src) #insert video path into DB
+
+#SECOND STEP, ONCE THE ROW IS COMMITTED: MOVES THE FILE OUT OF THE ARRIVAL FOLDER
+def store(filename, source_folder, committed):
+        src = source_folder + '/' + filename
+        name = media_name.parse(filename)
+        if not committed:
+            #NO ROW: THE FILE STAYS IN THE ARRIVAL FOLDER AND ITS JOURNAL ENTRY AT inserting
+            raise RuntimeError(f"{table} row of {filename} was not committed")
+        ingest_journal.mark(src, ingest_journal.COMMITTED)
+
+        with ingest_metrics.timed("move", "video", name.hive_id):
+            transfer(filename, source_folder)
+        ingest_journal.mark(src, ingest_journal.MOVED)
+        return committed
 
 def reg(filename, source_folder):
+        return store(filename, source_folder, submit(filename, source_folder).result())
 
-        video = filename
-        filename = register_media.reconstruct(filename) 
-        insert_video(filename, video) #insert video path into DB 
-
-        #TRANSFER TO ANOTHER FOLDER 
-        src = source_folder + '/' + video
-        new_dest = folder_destination + '/' + video
-        shutil.move(src, new_dest)
-
+table = "hive_videos"
 folder_destination = r"/var/www/html/ademnea_website/public/hivevideo"
@@ -1,8 +1,16 @@
  #THIS FILE CONTAINS COMMON FUNCTIONS REQUIRED 
  #IN REGISTER_HIVEMEDIA FILES(media = audios, images, videos)
 import os
+import sys
 import time
-import mysql.connector
+import db_pool
+import ingest_ledger
+import ingest_journal
+import ingest_metrics
+import media_batcher
+import media_name
+import media_store
+import csv_streams
 from watchdog.observers import Observer
 from watchdog.events import FileSystemEventHandler
 import register_hiveaudios
@@ -10,95 +18,269 @@ import register_hiveimages
 import register_hivevideos
 import register_hivetemp_hivehumidity
 import register_hivevibration
+from arrival_queue import ArrivalQueue
+from ingest_dispatcher import IngestDispatcher, Pending
+from hive_partition import HivePartition
 
 
-#CONNECTION TO DB, CORRECT DATABASE DETAILS HAVE TO BE PASSED AT THIS POINT
+#CONNECTION TO DB, TAKEN FROM THE SHARED POOL. DATABASE DETAILS ARE READ FROM
+#THE ENVIRONMENT OR THE LARAVEL .env FILE, SEE db_pool.py
+#CALLING close() ON THE CONNECTION RETURNS IT TO THE POOL
 def database_connection():
-    mydb = mysql.connector.connect(host='localhost', user='root', password='W1m3@-d6p@55', db='ademnea')
-    return mydb
+    return db_pool.get_connection()
 
-#FUNCTION RECONSTRUCTS THE FILE NAME
-#i.e 2_1986-09-25_174530.006.jpg to 2_1986-09-25 17:45:30.006.jpg
-#THIS ALLOWS US EXTRACT TIMESTAMPS MORE EASILY
-def reconstruct(str):
-    old_str = str.split("_")[2]
-    new_str = ""
+#WORKS OUT WHICH REGISTER_* MODULE A FILE BELONGS TO FROM ITS NAME
+def media_kind(filename):
+    kind = media_name.kind_of(filename)
+    if kind is not None:
+        return kind
+    #<hive>.csv, power_<hive>.csv, voc_<hive>.csv ..., SEE csv_streams.STREAMS
+    if filename.endswith(".csv") and csv_streams.match(filename) is not None:
+        return "sensor"
+    return None
 
-    for i in range(0, len(old_str)):
-        if(i == 2 or i == 4):
-           new_str =  new_str + ":"
-           new_str = new_str + old_str[i]
-        else:
-           new_str =  new_str + old_str[i]
+#HIVE ID FROM THE FILE NAME, i.e 2_1986-09-25_174530.006.jpg, vibration_2_..., 2.csv, power_2.csv
+#None WHEN THE NAME DOES NOT PARSE
+def hive_of(filename, kind):
+    if kind == "sensor":
+        matched = csv_streams.match(filename)
+        return matched[1] if matched is not None else None
+    if kind in ("audio", "video", "image", "vibration"):
+        try:
+            return str(media_name.parse(filename).hive_id)
+        except ValueError:
+            return None
+    return None
 
-    return str.split("_")[0] + "_" + str.split("_")[1] + " " + new_str 
+def classify_path(path):
+    filename = os.path.basename(path)
+    kind = media_kind(filename)
+    return (kind or "other"), hive_of(filename, kind)
 
+#MEDIA FILES WHOSE NAME HAS NO HIVE ID OR TIMESTAMP CANNOT BE STORED, THEY ARE KEPT HERE
+BAD_NAME_DIR = os.getenv("INGEST_BAD_NAME_DIR", os.path.join(ingest_ledger.STATE_DIR, "bad_names"))
+
+#MOVES A MEDIA FILE WITH AN UNPARSEABLE NAME OUT OF THE ARRIVAL FOLDER, BEFORE ANY JOURNAL
+#ENTRY IS MADE, SO IT IS NOT RETRIED (AND FAILED) AGAIN AT EVERY START. TRUE IF IT WAS
+def set_aside_bad_name(filename, folder, kind):
+    if kind == "sensor":
+        return False
+    try:
+        media_name.parse(filename)
+        return False
+    except ValueError as e:
+        os.makedirs(BAD_NAME_DIR, exist_ok=True)
+        media_store.move_file(os.path.join(folder, filename), os.path.join(BAD_NAME_DIR, filename))
+        print(f"Kept {filename} in {BAD_NAME_DIR}: {e}")
+        ingest_metrics.inc("ingest_files_total", kind=kind, hive=None, result="bad_name")
+        return True
+
+#REGISTER_* MODULE, LOG LINE AND DESTINATION FOLDER OF EACH MEDIA KIND
+HANDLERS = {
+    "audio": (register_hiveaudios, "Handling audio", "Transferred {} to hiveaudio folder"),
+    "video": (register_hivevideos, "Handling video", "Transferred {} to hivevideo folder"),
+    "image": (register_hiveimages, "Handling image", "Transferred {} to hiveimage folder"),
+    "vibration": (register_hivevibration, "Handling Vibration CSV", "Inserted Vibration CSV {} into DB"),
+    "sensor": (register_hivetemp_hivehumidity, "Handling sensor CSV", "Inserted sensor CSV {} into DB"),
+}
+
+#HANDS ONE ARRIVED FILE TO THE MATCHING REGISTER_* MODULE
+#FILES ALREADY IN THE INGEST LEDGER ARE DROPPED BEFORE ANY DB OR DISK WORK
+#MEDIA FILES RETURN A Pending ONCE THEIR ROW IS QUEUED FOR THE NEXT BATCHED INSERT, THE
+#DISPATCHER RUNS THE MOVE WHEN THE ROW IS COMMITTED (ingest_dispatcher.run_steps() FOR ANY OTHER CALLER)
+def dispatch(filename, folder):
+    print()
+    print()
+    print(f"Received {filename}")  # Print received filename
+    kind = media_kind(filename)
+    if kind is None:
+        print(f"Handling of {filename} file type not yet supported")
+        ingest_metrics.inc("ingest_files_total", kind="other", hive=None, result="unsupported")
+        return None
+
+    if set_aside_bad_name(filename, folder, kind):
+        return None
+
+    module, handling, handled = HANDLERS[kind]
+    path = os.path.join(folder, filename)
+    hive_id = hive_of(filename, kind)
+    started = time.perf_counter()
+    digest = ingest_ledger.file_digest(path)
+    if ingest_ledger.seen(hive_id, filename, digest):
+        print(f"Skipping {filename}: already ingested")
+        os.remove(path)
+        ingest_metrics.inc("ingest_files_total", kind=kind, hive=hive_id, result="duplicate")
+        ingest_metrics.observe("ingest_seconds", time.perf_counter() - started, stage="total", kind=kind, hive=hive_id)
+        return None
+
+    print(f"{handling}: {filename}")
+    ingest_journal.begin(path, kind, hive_id, digest)
+    submit = getattr(module, "submit", None)
+    if submit is None:
+        #SENSOR CSVS ARE LOADED IN ONE STEP
+        return finish(filename, folder, kind, hive_id, digest, started, lambda: module.reg(filename, folder))
+    inserting = run_step(filename, kind, hive_id, started, lambda: submit(filename, folder))
+
+    def store(future):
+        ingest_metrics.observe("ingest_seconds", time.perf_counter() - started, stage="db_insert", kind=kind, hive=hive_id)
+        return finish(filename, folder, kind, hive_id, digest, started,
+                      lambda: module.store(filename, folder, future.result()))
+    return Pending(inserting, store)
+
+#RUNS ONE STEP OF A FILE, A FAILURE IS COUNTED AND RAISED ON SO THE ARRIVAL QUEUE HANDS THE FILE
+#OVER AGAIN AT ITS NEXT EVENT. THE JOURNAL ENTRY STAYS, recover_journal() SORTS IT OUT AT THE NEXT START
+def run_step(filename, kind, hive_id, started, step):
+    try:
+        return step()
+    except Exception as e:
+        print(f"Error registering {kind} {filename}: {e}")
+        ingest_metrics.inc("ingest_files_total", kind=kind, hive=hive_id, result="failed")
+        ingest_metrics.observe("ingest_seconds", time.perf_counter() - started, stage="total", kind=kind, hive=hive_id)
+        raise
+
+#LAST STEP OF A FILE: step STORES IT, THEN THE JOURNAL, LEDGER AND METRICS ARE UPDATED
+def finish(filename, folder, kind, hive_id, digest, started, step):
+    committed = run_step(filename, kind, hive_id, started, step)
+    ingest_journal.finish(os.path.join(folder, filename))
+    ingest_metrics.observe("ingest_seconds", time.perf_counter() - started, stage="total", kind=kind, hive=hive_id)
+    if not committed:
+        #NOTHING WAS STORED (i.e A SENSOR CSV KEPT IN THE QUARANTINE FOLDER), SO IT IS NOT
+        #IN THE LEDGER AND A CORRECTED RE-UPLOAD IS INGESTED
+        print(f"Not stored {filename}")
+        ingest_metrics.inc("ingest_files_total", kind=kind, hive=hive_id, result="rejected")
+        return None
+    print(HANDLERS[kind][2].format(filename))
+    ingest_ledger.record(hive_id, filename, digest, kind)
+    ingest_metrics.inc("ingest_files_total", kind=kind, hive=hive_id, result="ingested")
+    return None
+
+def dispatch_path(path):
+    return dispatch(os.path.basename(path), os.path.dirname(path))
+
+def delete_rows(table, path, hive_id):
+    mydb = database_connection()
+    mycursor = mydb.cursor()
+    try:
+        mycursor.execute(f"DELETE FROM {table} WHERE path = %s AND hive_id = %s", (path, hive_id))
+        mydb.commit()
+    finally:
+        mydb.close()
+
+#FINISHES OR ROLLS BACK FILES A CRASH LEFT HALF DONE, RUN BEFORE ANYTHING ELSE AT STARTUP
+#intent    -> nothing was written yet, leave the file in the arrival folder to be ingested again
+#inserting -> the DB commit was never recorded, delete the row it may have written (no row for
+#             the path existed before) and leave the file to be ingested again. A FILE NO LONGER
+#             THERE WAS INGESTED BY ANOTHER WATCHER MEANWHILE (--partitioned), ITS ROW STAYS
+#committed -> the row is in, replay the move (or delete, for sensor CSVs) and the features
+#moved     -> only the features (audio/vibration) and the bookkeeping may be missing
+#hives LIMITS RECOVERY TO THOSE HIVE IDS, FOR WATCHERS THAT ONLY OWN SOME HIVES
+def recover_journal(hives=None):
+    for entry in ingest_journal.unfinished():
+        if hives is not None and entry["hive_id"] not in hives:
+            continue
+        path, kind, stage = entry["path"], entry["kind"], entry["stage"]
+        folder, filename = os.path.split(path)
+        module = HANDLERS[kind][0]
+        try:
+            if stage in (ingest_journal.INTENT, ingest_journal.INSERTING):
+                if stage == ingest_journal.INSERTING and os.path.exists(path):
+                    delete_rows(module.table, media_store.relative_path(filename), entry["hive_id"])
+                print(f"Recovery: rolled back {filename}")
+                ingest_journal.finish(path)
+                continue
+            if stage == ingest_journal.COMMITTED and os.path.exists(path):
+                module.transfer(filename, folder)
+                print(f"Recovery: finished moving {filename}")
+            #FEATURES ARE MADE AFTER THE MOVE, THE CRASH MAY HAVE COME BEFORE THEY WERE STORED
+            store_features = getattr(module, "store_features", None)
+            if store_features is not None:
+                name = media_name.parse(filename)
+                stored = os.path.join(module.folder_destination, *media_store.relative_path(filename, name).split("/"))
+                if os.path.exists(stored):
+                    store_features(name, filename, os.path.dirname(stored))
+            ingest_ledger.record(entry["hive_id"], filename, entry["content_hash"], kind)
+            ingest_journal.finish(path)
+        except Exception as e:
+            print(f"Recovery of {filename} failed: {e}")
+
+#FILES LEFT IN THE ARRIVAL FOLDER FROM BEFORE A RESTART, HANDLED IN PARALLEL
+#BEFORE LISTENING STARTS. FILES YOUNGER THAN THE SETTLE TIME MAY STILL BE
+#UPLOADING AND ARE LEFT TO THE ARRIVAL QUEUE
+def ingest_backlog(dispatcher, folder, settle_seconds):
+    cutoff = time.time() - settle_seconds
+    for filename in sorted(os.listdir(folder)):
+        path = os.path.join(folder, filename)
+        if os.path.isfile(path) and os.path.getmtime(path) < cutoff:
+            dispatcher.submit(path)
+    dispatcher.wait_idle()
 
 
 # FILE SYSTEM EVENT HANDLER
+#EVENTS ONLY RECORD THE PATH, THE ARRIVAL QUEUE DECIDES WHEN IT IS COMPLETE
 class Handler(FileSystemEventHandler):
+    def __init__(self, queue):
+        super().__init__()
+        self.queue = queue
+
+    def on_created(self, event):
+        if not event.is_directory:
+            self.queue.add(event.src_path)
+
     def on_modified(self, event):
-        time.sleep(20)  # Delay for 20 seconds while pi confirms receipt of media
-        for filename in os.listdir(folder_to_track):
-            print()
-            print()
-            print(f"Received {filename}")  # Print received filename
-            media_flag = filename[-3:]
-            if media_flag == "wav":
-                print(f"Handling audio: {filename}")
-                try:
-                    register_hiveaudios.reg(filename, folder_to_track)
-                    print(f"Transferred {filename} to hiveaudio folder")
-                except Exception as e:
-                    print(f"Error registering audio {filename}: {e}")
-            elif media_flag == "mp4":
-                print(f"Handling video: {filename}")
-                try:
-                    register_hivevideos.reg(filename, folder_to_track)
-                    print(f"Transferred {filename} to hivevideo folder")
-                except Exception as e:
-                    print(f"Error registering video {filename}: {e}")
-            elif media_flag == "jpg":
-                print(f"Handling image: {filename}")
-                try:
-                    register_hiveimages.reg(filename, folder_to_track)
-                    print(f"Transferred {filename} to hiveimage folder")
-                except Exception as e:
-                    print(f"Error registering image {filename}: {e}")
-            elif media_flag == "csv":
-                if filename.startswith("vibration"):
-                    print(f"Handling Vibration CSV: {filename}")
-                    try:
-                        register_hivevibration.reg(filename, folder_to_track)
-                        print(f"Inserted Vibration CSV {filename} into DB")
-                        print(f"Handling vibration data not yet available")
-                    except Exception as e:
-                        print(f"Error registering Vibration CSV {filename}: {e}")
-                elif filename.startswith("power"):
-                    print(f"Not yet handling Power CSV: {filename}")
-                    # print(f"Handling Power CSV: {filename}")
-                    # try:
-                    #     # Assuming you have a similar function for power parameters
-                    #     register_power.reg(filename, folder_to_track)
-                    #     print(f"Inserted Power CSV {filename} into DB")
-                    # except Exception as e:
-                    #     print(f"Error registering Power CSV {filename}: {e}")
-                else:
-                    print(f"Handling temperature and humidity CSV: {filename}")
-                    try:
-                        register_hivetemp_hivehumidity.reg(filename, folder_to_track)
-                        print(f"Inserted other CSV {filename} into DB")
-                    except Exception as e:
-                        print(f"Error registering other CSV {filename}: {e}")
-            else:
-                print(f"Handling of {filename} file type not yet supported")
+        if not event.is_directory:
+            self.queue.add(event.src_path)
+
+    def on_moved(self, event):
+        #FILES UPLOADED UNDER A TEMPORARY NAME AND RENAMED INTO PLACE
+        if not event.is_directory:
+            self.queue.add(event.dest_path)
 
+    def on_closed(self, event):
+        #INOTIFY CLOSE-WRITE, ONLY RAISED ON LINUX
+        if not event.is_directory:
+            self.queue.add(event.src_path, closed=True)
+
+#FOLDER THE PIS UPLOAD TO, AND HOW LONG A FILE MUST STAY UNCHANGED BEFORE IT COUNTS AS COMPLETE
+folder_to_track = r"/var/www/html/ademnea_website/public/arriving_hive_media"
+settle_seconds = float(os.getenv('INGEST_SETTLE_SECONDS', '3'))
+
+#FOR THE ASYNCIO SERVICE MODE RUN python async_ingest.py INSTEAD
 if __name__ == '__main__':
-    folder_to_track = r"/var/www/html/ademnea_website/public/arriving_hive_media"
+    partition = None
+    if "--partitioned" in sys.argv[1:]:
+        #SEVERAL WATCHERS SHARING THE FOLDER BY HIVE, SEE hive_partition.py
+        #THE BACKLOG IS TAKEN PER HIVE AS ITS LEASE IS TAKEN
+        partition = HivePartition(folder_to_track, None, classify_path)
+    dispatcher = IngestDispatcher(partition.wrap(dispatch_path) if partition else dispatch_path, classify_path)
+    queue = ArrivalQueue(dispatcher.submit, settle_seconds=settle_seconds)
+    #A FILE THAT FAILED IS RETRIED ON ITS NEXT MODIFY OR CLOSE-WRITE EVENT
+    dispatcher.on_error = queue.forget
+    ingest_metrics.gauge("ingest_arrival_pending", "Files waiting for their upload to settle", lambda: len(queue))
+    ingest_metrics.gauge("ingest_dispatch_pending", "Files queued or running on the worker pools", dispatcher.pending)
+    ingest_metrics.gauge("ingest_spilled", "Files waiting in the on-disk overflow queue", dispatcher.spilled)
+    ingest_metrics.gauge("ingest_saturated", "1 while the in-memory ingest queue is over its high watermark",
+                         lambda: int(dispatcher.saturated.is_set()))
+    ingest_metrics.gauge("ingest_batch_pending", "Media rows waiting for the next batched insert", media_batcher.pending)
+    ingest_metrics.serve_from_env()
     observer = Observer()
-    event_handler = Handler()
-    observer.schedule(event_handler, folder_to_track, recursive=True) #handing the observer the folder to track
+    if partition is not None:
+        partition.queue = queue
+        ingest_metrics.gauge("ingest_hives_owned", "Hives this watcher holds the lease of", partition.held)
+        event_handler = Handler(partition)
+    else:
+        event_handler = Handler(queue)
+    observer.schedule(event_handler, folder_to_track, recursive=False) #handing the observer the folder to track
+    #THE JOURNAL IS LOCAL TO THIS MACHINE, ONLY THIS PROCESS CAN FINISH WHAT IT LEFT HALF DONE
+    recover_journal()
+    if partition is None:
+        print("INGESTING BACKLOG")
+        ingest_backlog(dispatcher, folder_to_track, settle_seconds)
     observer.start()
+    if partition is None:
+        queue.add_existing(folder_to_track)
+    queue.start()
+    if partition is not None:
+        partition.start()
     print("LISTENING STARTED")
     try:
         while True:
@@ -106,13 +288,8 @@ if __name__ == '__main__':
     except KeyboardInterrupt:
         observer.stop()
     observer.join()
-
-    
-
-    
-
-             
-                 
-            
-
-           
+    queue.stop()
+    print("DRAINING PENDING FILES")
+    dispatcher.shutdown()
+    if partition is not None:
+        partition.stop()
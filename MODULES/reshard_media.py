@@ -0,0 +1,83 @@
+ #ONE-OFF MIGRATION: MOVES MEDIA FILES STORED FLAT IN public/hive* INTO THE
+ #<hive_id>/<year>/<month>/ SHARDS media_store.py USES AND REWRITES THEIR DB path.
+ #THE DB ROWS OF A BATCH ARE UPDATED BEFORE ITS FILES MOVE AND A FILE IS ONLY
+ #MOVED IF ITS SHARD IS FREE, SO AN INTERRUPTED RUN CAN SIMPLY BE STARTED AGAIN.
+ #RUN: python reshard_media.py [--dry-run] [--batch-size N]
+import os
+import argparse
+import db_pool
+import media_name
+import media_store
+import register_hiveaudios
+import register_hiveimages
+import register_hivevideos
+import register_hivevibration
+
+MODULES = (register_hiveimages, register_hiveaudios, register_hivevideos, register_hivevibration)
+
+
+#FILES SITTING DIRECTLY IN folder WHOSE NAME PARSES, AS (filename, MediaName)
+def flat_files(folder):
+    for entry in os.scandir(folder):
+        if not entry.is_file() or entry.name.endswith(".part"):
+            continue
+        try:
+            yield entry.name, media_name.parse(entry.name)
+        except ValueError:
+            print(f"Leaving {entry.name}: not a media file name")
+
+
+def reshard_batch(table, folder, batch, dry_run):
+    updates = [(media_store.relative_path(filename, name), filename, name.hive_id) for filename, name in batch]
+    if dry_run:
+        for new_path, filename, _ in updates:
+            print(f"{table}: {filename} -> {new_path}")
+        return
+
+    mydb = db_pool.get_connection()
+    mycursor = mydb.cursor()
+    try:
+        mycursor.executemany(f"UPDATE {table} SET path = %s WHERE path = %s AND hive_id = %s", updates)
+        mydb.commit()
+    finally:
+        mydb.close()
+
+    for new_path, filename, _ in updates:
+        dest = os.path.join(folder, *new_path.split("/"))
+        if os.path.exists(dest):
+            print(f"Leaving {filename}: {new_path} already exists")
+            continue
+        media_store.move_file(os.path.join(folder, filename), dest)
+
+
+def reshard(module, batch_size, dry_run):
+    table, folder = module.table, module.folder_destination
+    if not os.path.isdir(folder):
+        print(f"Skipping {table}: {folder} not found")
+        return 0
+    moved = 0
+    batch = []
+    for item in flat_files(folder):
+        batch.append(item)
+        if len(batch) >= batch_size:
+            reshard_batch(table, folder, batch, dry_run)
+            moved += len(batch)
+            batch = []
+    if batch:
+        reshard_batch(table, folder, batch, dry_run)
+        moved += len(batch)
+    print(f"{table}: {moved} files resharded")
+    return moved
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move flat media folders into hive/year/month shards")
+    parser.add_argument("--dry-run", action="store_true", help="only print what would move")
+    parser.add_argument("--batch-size", type=int, default=500, help="rows updated per transaction")
+    args = parser.parse_args()
+    for module in MODULES:
+        reshard(module, args.batch_size, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
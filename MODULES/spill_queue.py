@@ -0,0 +1,85 @@
+ #THIS FILE IS THE ON-DISK OVERFLOW OF THE INGEST DISPATCHER: A FIFO OF FILE PATHS
+ #IN A LOCAL SQLITE FILE, USED ONCE THE DISPATCHER HOLDS AS MANY FILES IN MEMORY AS IT
+ #MAY. A PATH IS STORED AT MOST ONCE. THE SPILLED FILES ARE STILL IN THE ARRIVAL
+ #FOLDER, SO THE QUEUE IS EMPTIED AT STARTUP AND THE BACKLOG SCAN PICKS THEM UP AGAIN.
+ #EVERY WATCHER PROCESS HAS ITS OWN FILE, spill.<host>.<pid>.sqlite3, SO SEVERAL WATCHERS
+ #(SEE hive_partition.py) NEVER EMPTY OR POP EACH OTHER'S QUEUES.
+import os
+import glob
+import socket
+import sqlite3
+import threading
+from ingest_ledger import STATE_DIR
+
+HOST = socket.gethostname()
+SPILL_PATH = os.path.join(STATE_DIR, f"spill.{HOST}.{os.getpid()}.sqlite3")
+
+
+def _running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+#SPILL FILES LEFT BY WATCHERS OF THIS HOST THAT ARE NO LONGER RUNNING, THEIR FILES ARE
+#STILL IN THE ARRIVAL FOLDER AND GET PICKED UP BY WHOEVER SCANS IT NEXT
+def remove_stale(folder=STATE_DIR):
+    for path in glob.glob(os.path.join(glob.escape(folder), f"spill.{glob.escape(HOST)}.*.sqlite3*")):
+        pid = os.path.basename(path)[len(f"spill.{HOST}."):].split(".")[0]
+        if pid.isdigit() and int(pid) != os.getpid() and not _running(int(pid)):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class SpillQueue:
+    """Disk-backed FIFO of unique paths, safe to share between threads."""
+
+    def __init__(self, path=SPILL_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if path == SPILL_PATH:
+            remove_stale(os.path.dirname(path))
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        #LOSING THE QUEUE IN A POWER CUT IS FINE, THE FILES ARE STILL IN THE ARRIVAL FOLDER
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=OFF")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS spill ("
+            " seq INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " path TEXT NOT NULL UNIQUE)"
+        )
+        #ONLY THIS PROCESS USES THE FILE, ANYTHING IN IT IS FROM AN EARLIER PROCESS WITH THE SAME PID
+        self._conn.execute("DELETE FROM spill")
+        self._conn.commit()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM spill").fetchone()[0]
+
+    #FALSE IF THE PATH IS ALREADY WAITING
+    def push(self, path):
+        with self._lock:
+            cursor = self._conn.execute("INSERT OR IGNORE INTO spill(path) VALUES (?)", (path,))
+            self._conn.commit()
+            return cursor.rowcount == 1
+
+    #OLDEST PATH, OR None WHEN EMPTY
+    def pop(self):
+        with self._lock:
+            row = self._conn.execute("SELECT seq, path FROM spill ORDER BY seq LIMIT 1").fetchone()
+            if row is None:
+                return None
+            seq, path = row
+            self._conn.execute("DELETE FROM spill WHERE seq = ?", (seq,))
+            self._conn.commit()
+            return path
+
+    def __contains__(self, path):
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM spill WHERE path = ?", (path,)).fetchone() is not None
@@ -0,0 +1,5 @@
+import os
+import sys
+
+#THE MODULES IMPORT EACH OTHER BY NAME, AS WHEN RUN FROM THIS FOLDER
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
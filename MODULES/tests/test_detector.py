@@ -0,0 +1,44 @@
+import os
+import pytest
+
+pytest.importorskip("ultralytics")
+from BeeDetection import detector
+
+FRAME = os.path.join(os.path.dirname(detector.__file__), "test3.jpeg")
+
+#AN UNTRAINED MODEL ONLY FINDS LOW-SCORING BOXES, LET EVERY ONE OF THEM START A TRACK
+LENIENT_TRACKER = """tracker_type: bytetrack
+track_high_thresh: 0.0001
+track_low_thresh: 0.00001
+new_track_thresh: 0.0001
+track_buffer: 30
+match_thresh: 0.8
+fuse_score: False
+"""
+
+
+@pytest.fixture
+def model():
+    from ultralytics import YOLO
+    #BUILT FROM THE PACKAGED CONFIG, NO WEIGHTS TO DOWNLOAD
+    return YOLO("yolov8n.yaml")
+
+
+def _track(model, frame, tracker, new_sequence=False):
+    ids, _ = detector.track(model, frame, new_sequence=new_sequence, confidence=0.0001, tracker=tracker)
+    return set(ids[ids >= 0].tolist())
+
+
+def test_track_ids_survive_to_the_next_frame(model, tmp_path):
+    tracker = tmp_path / "lenient.yaml"
+    tracker.write_text(LENIENT_TRACKER)
+    frame = detector.read_image(FRAME)
+
+    first = _track(model, frame, str(tracker), new_sequence=True)
+    second = _track(model, frame, str(tracker))
+    assert first and first & second
+    assert model.predictor.trackers[0].frame_id == 2
+
+    #A NEW VIDEO STARTS OVER
+    _track(model, frame, str(tracker), new_sequence=True)
+    assert model.predictor.trackers[0].frame_id == 1
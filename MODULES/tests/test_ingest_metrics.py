@@ -0,0 +1,19 @@
+import re
+import ingest_metrics
+
+
+def _value(text, series):
+    match = re.search(rf"^{re.escape(series)} (\S+)$", text, re.M)
+    assert match, series
+    return float(match.group(1))
+
+
+def test_histogram_inf_bucket_matches_count():
+    labels = dict(stage="test", kind="photo", hive="1")
+    for seconds in (0.2, 3.0, 120.0):
+        ingest_metrics.observe("ingest_seconds", seconds, **labels)
+    text = ingest_metrics.render()
+    prefix = 'ingest_seconds_bucket{hive="1",kind="photo",stage="test",le='
+    assert _value(text, prefix + '"+Inf"}') == _value(text, 'ingest_seconds_count{hive="1",kind="photo",stage="test"}') == 3
+    assert _value(text, prefix + '"60"}') == 2
+    assert _value(text, 'ingest_seconds_sum{hive="1",kind="photo",stage="test"}') == 123.2
@@ -0,0 +1,139 @@
+ #THIS FILE PARSES A VIBRATION CSV ONCE AT INGEST INTO A .npy SIDECAR NEXT TO IT
+ #(A STRUCTURED ARRAY, ONE FIELD PER CSV COLUMN, OPEN IT WITH np.load(path, mmap_mode="r"))
+ #AND WORKS OUT RMS, PEAK FREQUENCY AND BAND ENERGIES IN THE SAME PASS. THE FEATURES GO
+ #INTO hive_vibration_features SO QUERIES NEVER RE-READ THE CSV.
+ #THE PIS UPLOAD SPECTRA, A Frequency_X COLUMN WITH THE AMPLITUDE OF EACH BIN NEXT TO IT
+ #(AS PLOTTED BY admin/hivegraphs/vibrations.blade.php), THE FEATURES ARE READ OFF THOSE BINS.
+ #ONLY A HEADERLESS FILE OF RAW ACCELEROMETER SAMPLES IS PUT THROUGH AN FFT FIRST.
+import os
+import csv
+import json
+import warnings
+import numpy as np
+from numpy.lib import recfunctions
+import db_pool
+import media_store
+
+#SAMPLING RATE OF RAW ACCELEROMETER FILES, THE COLUMN HOLDING THE SIGNAL (OR THE AMPLITUDE
+#OF EACH BIN) AND THE COLUMN HOLDING THE BIN FREQUENCIES OF A SPECTRUM
+SAMPLE_RATE = float(os.getenv("VIBRATION_SAMPLE_RATE_HZ", "3200"))
+SIGNAL_COLUMN = os.getenv("VIBRATION_SIGNAL_COLUMN", "Amplitude_Y")
+FREQUENCY_COLUMN = os.getenv("VIBRATION_FREQUENCY_COLUMN", "Frequency_X")
+
+#BAND EDGES IN Hz, BANDS ABOVE THE NYQUIST FREQUENCY COME OUT EMPTY
+BAND_EDGES = tuple(float(edge) for edge in os.getenv("VIBRATION_BAND_EDGES_HZ", "0,50,100,200,400,800,1600").split(","))
+
+
+#READS THE CSV INTO A float32 STRUCTURED ARRAY, COLUMNS WITHOUT A HEADER ARE NAMED column_0, column_1, ...
+def read_samples(filepath):
+    with open(filepath, newline="") as file_obj:
+        first = next(csv.reader(file_obj), [])
+    if not first:
+        raise ValueError(f"{filepath} is empty")
+    try:
+        [float(value) for value in first]
+        names, skip = [f"column_{i}" for i in range(len(first))], 0
+    except ValueError:
+        names, skip = [name.strip() or f"column_{i}" for i, name in enumerate(first)], 1
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", UserWarning)  # "input contained no data", raised below instead
+        values = np.loadtxt(filepath, delimiter=",", skiprows=skip, dtype=np.float32, ndmin=2)
+    if values.shape[0] == 0:
+        raise ValueError(f"{filepath} has no samples")
+    if values.shape[1] != len(names):
+        raise ValueError(f"{filepath}: {len(names)} columns in the header, {values.shape[1]} in the data")
+    dtype = np.dtype([(name, np.float32) for name in names])
+    return recfunctions.unstructured_to_structured(values, dtype=dtype)
+
+
+#THE COLUMN FEATURES ARE COMPUTED ON, SIGNAL_COLUMN IF PRESENT OTHERWISE THE LAST ONE
+def signal_of(samples):
+    names = samples.dtype.names
+    return samples[SIGNAL_COLUMN if SIGNAL_COLUMN in names else names[-1]].astype(np.float64)
+
+
+#BIN FREQUENCIES OF A SPECTRUM FILE, None FOR A FILE OF RAW SAMPLES
+def frequencies_of(samples):
+    if FREQUENCY_COLUMN not in samples.dtype.names:
+        return None
+    return samples[FREQUENCY_COLUMN].astype(np.float64)
+
+
+#ENERGY PER BAND FROM ONE CUMULATIVE SUM INSTEAD OF A MASK PER BAND, freqs ASCENDING
+def band_energies(freqs, power, edges=BAND_EDGES):
+    cumulative = np.concatenate(([0.0], np.cumsum(power)))
+    bounds = np.searchsorted(freqs, edges)
+    energies = cumulative[bounds[1:]] - cumulative[bounds[:-1]]
+    return {f"{lo:g}-{hi:g}": float(e) for lo, hi, e in zip(edges, edges[1:], energies)}
+
+
+#FEATURES OF A SPECTRUM THE PI ALREADY COMPUTED: amplitude[i] IS THE AMPLITUDE AT freqs[i]
+#THE RMS FOLLOWS FROM PARSEVAL, TAKING EACH BIN AS THE PEAK AMPLITUDE OF A SINE
+def spectrum_features(freqs, amplitude, edges=BAND_EDGES):
+    order = np.argsort(freqs, kind="stable")
+    freqs, amplitude = freqs[order], amplitude[order]
+    power = amplitude ** 2
+    return {
+        "rms": float(np.sqrt(power.sum() / 2)),
+        "peak_frequency": float(freqs[np.argmax(amplitude)]) if len(freqs) else 0.0,
+        "band_energies": band_energies(freqs, power, edges),
+    }
+
+
+#FEATURES OF RAW ACCELEROMETER SAMPLES, THROUGH AN FFT
+def spectral_features(signal, sample_rate=SAMPLE_RATE, edges=BAND_EDGES):
+    signal = signal - signal.mean()
+    power = np.abs(np.fft.rfft(signal)) ** 2 / max(len(signal), 1)
+    freqs = np.fft.rfftfreq(len(signal), d=1.0 / sample_rate)
+
+    #BIN 0 IS THE (REMOVED) DC COMPONENT
+    peak = freqs[np.argmax(power[1:]) + 1] if len(power) > 1 else 0.0
+    return {
+        "rms": float(np.sqrt(np.mean(signal ** 2))) if len(signal) else 0.0,
+        "peak_frequency": float(peak),
+        "band_energies": band_energies(freqs, power, edges),
+    }
+
+
+#WRITES THE SIDECAR UNDER A TEMPORARY NAME FIRST SO READERS NEVER SEE HALF AN ARRAY
+def write_sidecar(samples, dest):
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    partial = dest + ".part"
+    with open(partial, "wb") as file_obj:
+        np.save(file_obj, samples)
+    os.replace(partial, dest)
+
+
+#PARSES source, WRITES ITS SIDECAR UNDER destination_folder, RETURNS THE FEATURE ROW
+def extract(name, filename, source_folder, destination_folder):
+    samples = read_samples(os.path.join(source_folder, filename))
+    sidecar = media_store.sidecar_path(filename, ".npy", name)
+    write_sidecar(samples, os.path.join(destination_folder, *sidecar.split("/")))
+    freqs = frequencies_of(samples)
+    if freqs is None:
+        features, sample_rate = spectral_features(signal_of(samples)), SAMPLE_RATE
+    else:
+        #THE SAMPLING RATE OF A SPECTRUM IS NOT IN THE FILE
+        features, sample_rate = spectrum_features(freqs, signal_of(samples)), None
+    return (name.hive_id, media_store.relative_path(filename, name), sidecar, sample_rate, len(samples),
+            features["rms"], features["peak_frequency"], json.dumps(features["band_energies"]), name.timestamp)
+
+
+#path IS UNIQUE, A RE-INGESTED FILE REPLACES ITS OLD FEATURES
+def insert_query():
+    return ("INSERT INTO hive_vibration_features"
+            "(hive_id, path, sidecar, sample_rate, samples, rms, peak_frequency, band_energies, created_at) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s) "
+            "ON DUPLICATE KEY UPDATE sidecar = VALUES(sidecar), sample_rate = VALUES(sample_rate), "
+            "samples = VALUES(samples), rms = VALUES(rms), peak_frequency = VALUES(peak_frequency), "
+            "band_energies = VALUES(band_energies), created_at = VALUES(created_at)")
+
+
+def insert_features(row):
+    mydb = db_pool.get_connection()
+    mycursor = mydb.cursor()
+    try:
+        mycursor.execute(insert_query(), row)
+        mydb.commit()
+    finally:
+        mydb.close()
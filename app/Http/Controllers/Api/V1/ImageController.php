@@ -4,13 +4,14 @@ namespace App\Http\Controllers\Api\V1;
 
 use App\Http\Controllers\Controller;
 use Illuminate\Http\Request;
+use App\Models\HivePhoto;
 use Illuminate\Support\Facades\Storage;
 use Symfony\Component\HttpFoundation\Response;
 
 class ImageController extends Controller
 {
     //
-    public function show()
+    public function show(Request $request)
     {
 
         $imagePath = public_path('hiveimage');
@@ -23,33 +24,42 @@ class ImageController extends Controller
             ], 404);
         }
 
-        // Get all image files
-        $imageFiles = array_filter(scandir($imagePath), function ($file) {
-            return preg_match('/\.(jpg|jpeg|png|gif|webp)$/i', $file);
-        });
+        // List the images from hive_photos a page at a time instead of walking every
+        // hive/year/month folder, the path column holds the file's place under hiveimage
+        $photos = HivePhoto::orderByDesc('created_at')
+            ->orderByDesc('id')
+            ->select('path', 'hive_id', 'created_at')
+            ->paginate(min(max((int) $request->input('per_page', 50), 1), 200));
 
-        // Remove . and .. from directory listing
-        $imageFiles = array_diff($imageFiles, ['.', '..']);
-
-        if (empty($imageFiles)) {
+        if ($photos->isEmpty()) {
             return response()->json(['message' => 'No images found in directory'], 404);
         }
 
-        // Process images
-        $images = array_map(function ($file) use ($imagePath) {
-            $fullPath = $imagePath . '/' . $file;
+        // Process images, rows whose file is gone are left out
+        $images = $photos->getCollection()->map(function ($photo) use ($imagePath) {
+            $relativePath = $photo->path;
+            $fullPath = $imagePath . '/' . $relativePath;
+            if (!is_file($fullPath)) {
+                return null;
+            }
+            // small copy made by MODULES/media_derivatives.py, null until it exists
+            $thumbnail = 'hivethumbs/image/' . preg_replace('/\.[^.]+$/', '', $relativePath) . '_320.webp';
             return [
-                'name' => $file,
-                'url' => asset('hiveimage/' . $file),
+                'name' => basename($relativePath),
+                'hive_id' => $photo->hive_id,
+                'url' => asset('hiveimage/' . $relativePath),
+                'thumbnail' => file_exists(public_path($thumbnail)) ? asset($thumbnail) : null,
                 'size' => filesize($fullPath),
                 'last_modified' => filemtime($fullPath),
                 'mime_type' => mime_content_type($fullPath)
             ];
-        }, $imageFiles);
+        })->filter();
 
         return response()->json([
-            'count' => count($images),
-            'images' => array_values($images) // Reset array keys
+            'count' => $photos->total(),
+            'current_page' => $photos->currentPage(),
+            'last_page' => $photos->lastPage(),
+            'images' => $images->values() // Reset array keys
         ]);
 
     }
@@ -4,17 +4,18 @@ use App\Http\Controllers\Controller;
 use Illuminate\Http\Request;
 use Illuminate\Support\Facades\Log;
 use Illuminate\Support\Facades\File;
+use App\Models\HiveVideo;
 class VideoController extends Controller
 {
     protected $videoDirectory = "hivevideo";
     // Show all videos
-    public function show()
+    public function show(Request $request)
     {
-        return $this->getVideos();
+        return $this->getVideos($request);
     }
 
     // Get all videos without filtering for date
-    protected function getVideos()
+    protected function getVideos(Request $request)
     {
         try {
             // Get video path
@@ -31,15 +32,15 @@ class VideoController extends Controller
                     404
                 );
             }
-            // Get all MP4 files
-            $videoFiles = collect(File::files($videoPath))
-                ->filter(function ($file) {
-                    return File::extension($file) === "mp4";
-                })
-                ->values();
-            Log::info("Found " . count($videoFiles) . " video files");
-            if ($videoFiles->isEmpty()) {
-                Log::warning("No video files found in directory");
+            // List the videos from hive_videos a page at a time instead of walking every
+            // hive/year/month folder, the path column holds the file's place under hivevideo
+            $rows = HiveVideo::orderByDesc("created_at")
+                ->orderByDesc("id")
+                ->select("path", "hive_id", "created_at")
+                ->paginate(min(max((int) $request->input("per_page", 50), 1), 200));
+            Log::info("Found " . $rows->total() . " videos");
+            if ($rows->isEmpty()) {
+                Log::warning("No videos found in hive_videos");
                 return response()->json(
                     [
                         "message" => "No videos found in directory",
@@ -47,27 +48,23 @@ class VideoController extends Controller
                     404
                 );
             }
-            // Process videos with their modification times
-            $videos = $videoFiles
-                ->map(function ($file) {
-                    $fileName = $file->getFilename();
-                    $lastModified = $file->getMTime();
-                    return [
-                        "name" => $fileName,
-                        "url" => asset($this->videoDirectory . "/" . $fileName),
-                        "size" => $file->getSize(),
-                        "last_modified" => $lastModified,
-                        "mime_type" => File::mimeType($file),
-                        "date" => date("Y-m-d", $lastModified),
-                    ];
+            // Process videos with their modification times, rows whose file is gone are left out
+            $videos = $rows
+                ->getCollection()
+                ->map(function ($row) use ($videoPath) {
+                    return $this->videoDetails($videoPath, $row->path);
                 })
+                ->filter()
+                ->values()
                 ->toArray();
 
             // Group videos by date
             $videosByDate = collect($videos)->groupBy("date")->toArray();
 
             return response()->json([
-                "count" => count($videos),
+                "count" => $rows->total(),
+                "current_page" => $rows->currentPage(),
+                "last_page" => $rows->lastPage(),
                 "videos" => $videos,
                 "dates" => array_keys($videosByDate),
             ]);
@@ -84,6 +81,32 @@ class VideoController extends Controller
         }
     }
 
+    // Details of one video from its path under hivevideo, null if the file is gone
+    protected function videoDetails($videoPath, $relativePath)
+    {
+        $fullPath = $videoPath . "/" . $relativePath;
+        if (!File::isFile($fullPath)) {
+            return null;
+        }
+        $lastModified = File::lastModified($fullPath);
+        return [
+            "name" => basename($relativePath),
+            "url" => asset($this->videoDirectory . "/" . $relativePath),
+            "poster" => $this->posterUrl($relativePath),
+            "size" => File::size($fullPath),
+            "last_modified" => $lastModified,
+            "mime_type" => File::mimeType($fullPath),
+            "date" => date("Y-m-d", $lastModified),
+        ];
+    }
+
+    // Keyframe poster made by MODULES/media_derivatives.py, null until it exists
+    protected function posterUrl($relativePath)
+    {
+        $poster = "hivethumbs/video/" . preg_replace('/\.[^.]+$/', "", $relativePath) . "_poster.jpg";
+        return file_exists(public_path($poster)) ? asset($poster) : null;
+    }
+
     // Show only the most recent videos by date
     // Show only the latest video
         public function showLatest()
@@ -105,36 +128,14 @@ class VideoController extends Controller
                     );
                 }
                 
-                // Get all MP4 files directly from directory without loading content
-                $files = File::files($videoPath);
-                
-                // If no files found
-                if (empty($files)) {
-                    Log::warning("No files found in directory");
-                    return response()->json(
-                        [
-                            "message" => "No videos found in directory",
-                        ],
-                        404
-                    );
-                }
-                
-                // Find the latest MP4 file by modified time
-                $latestVideo = null;
-                $latestModTime = 0;
-                
-                foreach ($files as $file) {
-                    if (File::extension($file) === "mp4") {
-                        $modTime = $file->getMTime();
-                        if ($modTime > $latestModTime) {
-                            $latestModTime = $modTime;
-                            $latestVideo = $file;
-                        }
-                    }
-                }
-                
+                // The latest video is the newest row of hive_videos, no folder walk needed
+                $latest = HiveVideo::orderByDesc("created_at")
+                    ->orderByDesc("id")
+                    ->first();
+                $video = $latest ? $this->videoDetails($videoPath, $latest->path) : null;
+
                 // If no MP4 files found
-                if (!$latestVideo) {
+                if (!$video) {
                     Log::warning("No MP4 files found in directory");
                     return response()->json(
                         [
@@ -144,18 +145,6 @@ class VideoController extends Controller
                     );
                 }
                 
-                // Process the latest video
-                $fileName = $latestVideo->getFilename();
-                $lastModified = $latestVideo->getMTime();
-                $video = [
-                    "name" => $fileName,
-                    "url" => asset($this->videoDirectory . "/" . $fileName),
-                    "size" => $latestVideo->getSize(),
-                    "last_modified" => $lastModified,
-                    "mime_type" => File::mimeType($latestVideo),
-                    "date" => date("Y-m-d", $lastModified),
-                ];
-                
                 return response()->json([
                     "date" => $video["date"],
                     "video" => $video,
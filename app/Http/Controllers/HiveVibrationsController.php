@@ -1,7 +1,6 @@
 <?php
 
 namespace App\Http\Controllers;
-use Illuminate\Support\Facades\File;
 
 use Illuminate\Http\Request;
 use App\Models\Hive;
@@ -21,15 +20,13 @@ class HiveVibrationsController extends Controller
             // Define the directory where the CSV files are stored
             $directory = public_path('hivevibration');
 
-            // the latest CSV file that matches the hive ID
-            $csvFiles = File::files($directory);
-            $csvFilePath = null;
-            foreach ($csvFiles as $file) {
-                if (strpos($file->getFilename(), (string)$hiveId) !== false && $file->getExtension() == 'csv') {
-                    $csvFilePath = $file->getRealPath();
-                    break;
-                }
-            }
+            // the latest CSV of this hive from hive_vibrations, whose path is the file's
+            // hive/year/month place under hivevibration, so no folder has to be walked
+            $vibration = Vibration::where('hive_id', $hiveId)
+                ->orderByDesc('created_at')
+                ->orderByDesc('id')
+                ->first();
+            $csvFilePath = $vibration ? $directory . '/' . $vibration->path : null;
 
             // Check if the CSV file exists
             if (!$csvFilePath || !file_exists($csvFilePath)) {
@@ -0,0 +1,49 @@
+<?php
+
+namespace App\Models;
+
+use Illuminate\Database\Eloquent\Factories\HasFactory;
+use Illuminate\Database\Eloquent\Model;
+
+class AudioFeature extends Model
+{
+    use HasFactory;
+
+    /**
+     * The database table used by the model.
+     *
+     * @var string
+     */
+    protected $table = 'hive_audio_features';
+
+    /**
+     * The database primary key value.
+     *
+     * @var string
+     */
+    protected $primaryKey = 'id';
+
+    /**
+     * Attributes that should be mass-assignable.
+     *
+     * @var array
+     */
+    protected $fillable = ['hive_id', 'path', 'sidecar', 'sample_rate', 'channels', 'duration', 'rms', 'peak_amplitude', 'dominant_frequency', 'band_energies'];
+
+    /**
+     * The attributes that should be cast.
+     *
+     * @var array
+     */
+    protected $casts = [
+        'band_energies' => 'array',
+    ];
+
+    /**
+     * Get the hive the recording was made on.
+     */
+    public function hive()
+    {
+        return $this->belongsTo(Hive::class);
+    }
+}
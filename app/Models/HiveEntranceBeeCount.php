@@ -28,7 +28,7 @@ class HiveEntranceBeeCount extends Model
      *
      * @var array
      */
-    protected $fillable = ['detected_bees', 'hive_id'];
+    protected $fillable = ['detected_bees', 'hive_id', 'hive_video_id'];
 
     /**
      * Get the hive that owns the bee count at the entrance.
@@ -37,4 +37,12 @@ class HiveEntranceBeeCount extends Model
     {
         return $this->belongsTo(Hive::class);
     }
+
+    /**
+     * Get the video the bees were counted in.
+     */
+    public function video()
+    {
+        return $this->belongsTo(HiveVideo::class, 'hive_video_id');
+    }
 }
\ No newline at end of file
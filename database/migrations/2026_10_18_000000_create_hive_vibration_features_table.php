@@ -0,0 +1,53 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+class CreateHiveVibrationFeaturesTable extends Migration
+{
+    /**
+     * Run the migrations.
+     *
+     * @return void
+     */
+    public function up()
+    {
+        Schema::create('hive_vibration_features', function (Blueprint $table) {
+            $table->id();
+
+            $table->unsignedBigInteger('hive_id');
+
+            // same relative path as hive_vibrations.path
+            $table->string('path')->unique();
+            // parsed samples, a .npy file next to the csv
+            $table->string('sidecar');
+
+            // null for spectra, which are uploaded without the sampling rate
+            $table->float('sample_rate')->nullable();
+            // samples, or frequency bins of a spectrum
+            $table->unsignedInteger('samples');
+            $table->double('rms');
+            $table->double('peak_frequency');
+            // energy per frequency band, i.e {"0-50": 1.2, "50-100": 0.4}
+            $table->json('band_energies');
+
+            $table->foreign('hive_id')
+                ->references('id')->on('hives')
+                ->onDelete('cascade');
+
+            $table->timestamps();
+            $table->index(['hive_id', 'created_at']);
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     *
+     * @return void
+     */
+    public function down()
+    {
+        Schema::dropIfExists('hive_vibration_features');
+    }
+}
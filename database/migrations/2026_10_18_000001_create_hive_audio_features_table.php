@@ -0,0 +1,56 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+class CreateHiveAudioFeaturesTable extends Migration
+{
+    /**
+     * Run the migrations.
+     *
+     * @return void
+     */
+    public function up()
+    {
+        Schema::create('hive_audio_features', function (Blueprint $table) {
+            $table->id();
+
+            $table->unsignedBigInteger('hive_id');
+
+            // same relative path as hive_audios.path
+            $table->string('path')->unique();
+            // per frame envelope, band energies and dominant frequency, a .npz file next to the wav
+            $table->string('sidecar');
+
+            $table->unsignedInteger('sample_rate');
+            $table->unsignedTinyInteger('channels');
+            // seconds
+            $table->double('duration');
+            // amplitudes are relative to full scale, 1.0
+            $table->double('rms');
+            $table->double('peak_amplitude');
+            // peak of the spectrum summed over the whole recording
+            $table->double('dominant_frequency');
+            // energy per frequency band over the whole recording, i.e {"0-50": 1.2, "50-100": 0.4}
+            $table->json('band_energies');
+
+            $table->foreign('hive_id')
+                ->references('id')->on('hives')
+                ->onDelete('cascade');
+
+            $table->timestamps();
+            $table->index(['hive_id', 'created_at']);
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     *
+     * @return void
+     */
+    public function down()
+    {
+        Schema::dropIfExists('hive_audio_features');
+    }
+}
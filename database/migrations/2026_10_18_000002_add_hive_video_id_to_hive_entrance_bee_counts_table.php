@@ -0,0 +1,36 @@
+<?php
+
+use Illuminate\Database\Migrations\Migration;
+use Illuminate\Database\Schema\Blueprint;
+use Illuminate\Support\Facades\Schema;
+
+class AddHiveVideoIdToHiveEntranceBeeCountsTable extends Migration
+{
+    /**
+     * Run the migrations.
+     *
+     * @return void
+     */
+    public function up()
+    {
+        Schema::table('hive_entrance_bee_counts', function (Blueprint $table) {
+            // The video the count was taken from, MODULES/entrance_count_worker.py replaces
+            // a video's rows by this id when it counts the video again
+            $table->foreignId('hive_video_id')->nullable()->after('hive_id')
+                ->constrained()->onDelete('cascade');
+        });
+    }
+
+    /**
+     * Reverse the migrations.
+     *
+     * @return void
+     */
+    public function down()
+    {
+        Schema::table('hive_entrance_bee_counts', function (Blueprint $table) {
+            $table->dropForeign(['hive_video_id']);
+            $table->dropColumn('hive_video_id');
+        });
+    }
+}